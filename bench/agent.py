@@ -0,0 +1,167 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure the throughput of the agent pipeline.  Runs an Agent with the
+specified number of systems and probes per system against an in-process
+stand-in supervisor, and reports messages/sec, queue depth, drops, and
+probe-to-ack latency.  Agent settings can be overridden with --set.
+
+    python bench/agent.py [--systems N] [--probes M] [--duration SECONDS]
+        [--latency SECONDS] [--error-rate RATE] [--set 'NAME = VALUE' ...]
+"""
+
+import os, sys, time, shutil, tempfile, argparse
+from ConfigParser import RawConfigParser
+from twisted.web import server
+from pesky.settings.namespace import Namespace
+from mandelbrot.agent.agent import Agent
+from supervisor import FakeSupervisor
+
+SYSTEM = """
+system:
+  system type: "io.mandelbrot.system.GenericHost"
+  uri: "fqdn:bench%(system)i.example.com"
+  probes:
+"""
+
+PROBE = """
+    /probe:
+      probe type: "%(probetype)s"
+      probe instances: %(probes)i
+"""
+
+SYNTHETIC = """
+      metric count: %(metrics)i
+      cpu time: %(cputime)i microseconds
+      blocking time: %(blockingtime)i microseconds
+      flip rate: %(fliprate)f
+"""
+
+def microseconds(seconds):
+    return int(round(seconds * 1000000))
+
+def write_systems(path, args):
+    for i in range(args.systems):
+        with open(os.path.join(path, "bench%i.yaml" % i), 'w') as f:
+            f.write(SYSTEM % {'system': i})
+            f.write(PROBE % {'probetype': args.probe_type, 'probes': args.probes})
+            if args.probe_type == "io.mandelbrot.probe.Synthetic":
+                f.write(SYNTHETIC % {'metrics': args.metrics, 'cputime': microseconds(args.cpu_time),
+                    'blockingtime': microseconds(args.blocking_time), 'fliprate': args.flip_rate})
+
+def make_settings(url, statedir, systemdir, args):
+    options = RawConfigParser()
+    options.add_section('supervisor')
+    options.set('supervisor', 'supervisor url', url)
+    options.add_section('endpoint')
+    options.add_section('agent')
+    options.set('agent', 'state directory', statedir)
+    options.set('agent', 'system directory', systemdir)
+    options.set('agent', 'probe interval', "%i milliseconds" % (args.interval * 1000))
+    options.set('agent', 'probe splay', "%i milliseconds" % (args.interval * 1000))
+    options.set('agent', 'xmlrpc tcp port', '0')
+    options.set('agent', 'max registration attempts', '3')
+    for setting in args.set:
+        name,value = [part.strip() for part in setting.split('=', 1)]
+        if name.startswith('endpoint:'):
+            options.set('endpoint', name[9:].strip(), value)
+        else:
+            options.set('agent', name, value)
+    return Namespace([], options, [], 'mandelbrot-agent', os.getcwd(), 'agent')
+
+def count_dropped(agent):
+    dropped = 0
+    for runners in agent.scheduler.systems.values():
+        for runner in runners.values():
+            dropped += runner.dropped
+    spool = agent.endpoint.spool
+    if spool is not None:
+        dropped += spool.evicted
+    return dropped
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the agent pipeline")
+    parser.add_argument('--systems', type=int, default=10, help="number of systems")
+    parser.add_argument('--probes', type=int, default=10, help="number of probes per system")
+    parser.add_argument('--probe-type', default="io.mandelbrot.probe.Synthetic", help="probe type to run")
+    parser.add_argument('--metrics', type=int, default=4, help="metrics per synthetic probe")
+    parser.add_argument('--cpu-time', type=float, default=0.0, help="cpu seconds per synthetic probe invocation")
+    parser.add_argument('--blocking-time', type=float, default=0.0, help="seconds each synthetic probe invocation blocks")
+    parser.add_argument('--flip-rate', type=float, default=0.0, help="probability a synthetic probe changes health")
+    parser.add_argument('--interval', type=float, default=1.0, help="probe interval in seconds")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to measure for")
+    parser.add_argument('--warmup', type=float, default=5.0, help="seconds to run before measuring")
+    parser.add_argument('--latency', type=float, default=0.0, help="supervisor response delay in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="maximum extra supervisor delay in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of submissions which fail with 503")
+    parser.add_argument('--set', action='append', default=[], metavar="'NAME = VALUE'",
+        help="override an agent setting, or an endpoint setting as 'endpoint:NAME = VALUE'")
+    args = parser.parse_args()
+    # durations are written to the system files in whole microseconds
+    for name,value in (('--cpu-time', args.cpu_time), ('--blocking-time', args.blocking_time)):
+        if value < 0.0 or (value > 0.0 and microseconds(value) == 0):
+            parser.error("%s must be 0 or at least 1 microsecond" % name)
+
+    from twisted.internet import reactor, task
+    supervisor = FakeSupervisor(args.latency, args.jitter, args.error_rate)
+    port = reactor.listenTCP(0, server.Site(supervisor), interface='127.0.0.1')
+    url = "http://127.0.0.1:%i/" % port.getHost().port
+
+    workdir = tempfile.mkdtemp(prefix="mandelbrot-bench-")
+    statedir = os.path.join(workdir, "state")
+    systemdir = os.path.join(workdir, "systems")
+    os.mkdir(statedir)
+    os.mkdir(systemdir)
+    write_systems(systemdir, args)
+    agent = Agent()
+    agent.configure(make_settings(url, statedir, systemdir, args))
+
+    depths = list()
+    sample = task.LoopingCall(lambda: depths.append(agent.endpoint.queue.qsize()))
+    results = dict()
+    def start_measuring():
+        supervisor.stats.reset()
+        results['dropped'] = count_dropped(agent)
+        del depths[:]
+        sample.start(0.1)
+        reactor.callLater(args.duration, stop_measuring)
+    def stop_measuring():
+        sample.stop()
+        stats = supervisor.stats
+        elapsed = time.time() - stats.started
+        print "systems:       %i x %i probes every %.1f seconds" % (args.systems, args.probes, args.interval)
+        print "messages/sec:  %.1f" % (stats.messages / elapsed)
+        print "requests/sec:  %.1f (%i errors)" % (stats.requests / elapsed, stats.errors)
+        print "queue depth:   mean %.1f max %i" % (float(sum(depths)) / max(1, len(depths)), max(depths or [0]))
+        print "dropped:       %i" % (count_dropped(agent) - results['dropped'])
+        print "latency p50:   %s" % stats.percentile(50)
+        print "latency p99:   %s" % stats.percentile(99)
+        print "scheduler lag: %.3f (max %.3f)" % agent.scheduler.get_lag()
+        reactor.stop()
+
+    reactor.callWhenRunning(agent.startService)
+    reactor.callLater(args.warmup, start_measuring)
+    reactor.addSystemEventTrigger('before', 'shutdown', agent.stopService)
+    try:
+        reactor.run()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
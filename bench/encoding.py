@@ -0,0 +1,79 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the throughput of encoding messages with the original JSON
+encoder, from __dump__() with the current JSON encoder, and with the
+message encoder.
+
+    python bench/encoding.py [--count N]
+"""
+
+import sys, json, time, datetime, argparse
+from dateutil.tz import tzutc
+from mandelbrot.http import json_encoder, message_encoder
+from mandelbrot.message import StatusMessage, MetricsMessage
+from mandelbrot.ref import parse_proberef
+
+class OriginalJSONEncoder(json.JSONEncoder):
+    """
+    The JSON encoder as it was before the message encoder was added, which
+    converted datetimes with time.mktime.  Used as the baseline.
+    """
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            seconds = time.mktime(o.utctimetuple())
+            return long(seconds * 1000)
+        if isinstance(o, datetime.timedelta):
+            seconds = (float(o.microseconds) + (float(o.seconds) + float(o.days) * 24.0 * 3600.0) * 10**6) / 10**6
+            return long(seconds * 1000)
+        return json.JSONEncoder.default(self, o)
+
+original_encoder = OriginalJSONEncoder()
+
+def make_messages(count):
+    refs = [parse_proberef("fqdn:host.example.com/system/disk/sda%i" % i) for i in range(16)]
+    metrics = {'reads': 12.5, 'writes': 3.0, 'readbytes': 51200.0, 'writebytes': 12288.0}
+    messages = list()
+    for i in range(count):
+        timestamp = datetime.datetime.now(tzutc())
+        ref = refs[i % len(refs)]
+        if i % 2 == 0:
+            messages.append(StatusMessage(ref, 'healthy', 'disk is healthy', timestamp))
+        else:
+            messages.append(MetricsMessage(ref, metrics, timestamp))
+    return messages
+
+def measure(name, encode, messages):
+    started = time.time()
+    for message in messages:
+        encode(message)
+    elapsed = time.time() - started
+    print "%-16s %10.0f messages/sec" % (name, len(messages) / elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark message encoding")
+    parser.add_argument('--count', type=int, default=100000, help="number of messages to encode")
+    args = parser.parse_args()
+    messages = make_messages(args.count)
+    measure("original", lambda message: original_encoder.encode(message.__dump__()), messages)
+    measure("__dump__", lambda message: json_encoder.encode(message.__dump__()), messages)
+    measure("message encoder", message_encoder.encode, messages)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A stand-in supervisor for load testing the agent.  It accepts system
+registrations and message submissions in JSON (optionally compressed) or
+binary frames, and records the latency from each message timestamp to its
+acknowledgement.  Latency and errors can be injected.
+
+    python bench/supervisor.py [--port PORT] [--latency SECONDS] [--error-rate RATE]
+"""
+
+import sys, time, zlib, random, urllib, argparse
+from twisted.web import server, resource
+from mandelbrot.http import from_json
+from mandelbrot.endpoints.binary import CONTENT_TYPE, decode_frames
+
+class SupervisorStats(object):
+    """
+    Counts accepted and failed requests, and keeps the probe-to-ack
+    latency in seconds of each accepted message.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.messages = 0
+        self.registrations = 0
+        self.latencies = list()
+
+    def reset(self):
+        self.__init__()
+
+    def percentile(self, p):
+        if len(self.latencies) == 0:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100.0))]
+
+class FakeSupervisor(resource.Resource):
+    """
+    Serves objects/systems, objects/systems/<uri> and
+    objects/systems/<uri>/actions/submit.  Each response is delayed by
+    `latency` seconds plus up to `jitter` seconds, and a fraction
+    `errorrate` of submissions fail with 503.
+    """
+    isLeaf = True
+
+    def __init__(self, latency=0.0, jitter=0.0, errorrate=0.0):
+        resource.Resource.__init__(self)
+        self.latency = latency
+        self.jitter = jitter
+        self.errorrate = errorrate
+        self.systems = dict()
+        self.stats = SupervisorStats()
+
+    def _respond(self, request, code, body=''):
+        from twisted.internet import reactor
+        def finish():
+            request.setResponseCode(code)
+            request.write(body)
+            request.finish()
+        delay = self.latency + random.uniform(0.0, self.jitter)
+        if delay > 0.0:
+            reactor.callLater(delay, finish)
+        else:
+            finish()
+        return server.NOT_DONE_YET
+
+    def _read_entity(self, request):
+        entity = request.content.read()
+        encoding = request.getHeader('content-encoding')
+        if encoding == 'gzip':
+            entity = zlib.decompress(entity, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            entity = zlib.decompress(entity)
+        if request.getHeader('content-type') == CONTENT_TYPE:
+            return decode_frames(entity)
+        return from_json(entity)
+
+    def render_GET(self, request):
+        segments = request.postpath
+        if len(segments) == 3 and segments[:2] == ['objects', 'systems']:
+            uri = urllib.unquote(segments[2])
+            if uri in self.systems:
+                request.setHeader('content-type', 'application/json')
+                return self._respond(request, 200, self.systems[uri])
+        return self._respond(request, 404)
+
+    def render_PUT(self, request):
+        segments = request.postpath
+        if len(segments) == 3 and segments[:2] == ['objects', 'systems']:
+            uri = urllib.unquote(segments[2])
+            if uri not in self.systems:
+                return self._respond(request, 404)
+            self.systems[uri] = request.content.read()
+            return self._respond(request, 202)
+        return self._respond(request, 404)
+
+    def render_POST(self, request):
+        self.stats.requests += 1
+        segments = request.postpath
+        if segments == ['objects', 'systems']:
+            entity = request.content.read()
+            self.systems[from_json(entity)['uri']] = entity
+            self.stats.registrations += 1
+            return self._respond(request, 202)
+        if len(segments) == 5 and segments[:2] == ['objects', 'systems'] and segments[3:] == ['actions', 'submit']:
+            if random.random() < self.errorrate:
+                self.stats.errors += 1
+                return self._respond(request, 503)
+            messages = self._read_entity(request)
+            if not isinstance(messages, list):
+                messages = [messages]
+            now = time.time() * 1000.0
+            for message in messages:
+                timestamp = message['payload'].get('timestamp')
+                if timestamp is not None:
+                    self.stats.latencies.append((now - timestamp) / 1000.0)
+            self.stats.messages += len(messages)
+            return self._respond(request, 202)
+        return self._respond(request, 404)
+
+def main():
+    parser = argparse.ArgumentParser(description="run a stand-in mandelbrot supervisor")
+    parser.add_argument('--port', type=int, default=8080, help="port to listen on")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds to delay each response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="maximum extra random delay in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of submissions which fail with 503")
+    args = parser.parse_args()
+    from twisted.internet import reactor, task
+    supervisor = FakeSupervisor(args.latency, args.jitter, args.error_rate)
+    reactor.listenTCP(args.port, server.Site(supervisor))
+    def report():
+        stats = supervisor.stats
+        elapsed = time.time() - stats.started
+        print "%.0f messages/sec, %i errors, p50 %s p99 %s" % (stats.messages / elapsed, stats.errors,
+            stats.percentile(50), stats.percentile(99))
+        stats.reset()
+    task.LoopingCall(report).start(10.0, False)
+    reactor.run()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,6 +20,7 @@ import pwd, grp
 from twisted.application.service import MultiService
 from twisted.web.http_headers import Headers
 from twisted.python.failure import Failure
+from pesky.settings import ConfigureError
 from daemon import DaemonContext
 from daemon.pidfile import TimeoutPIDLockFile
 from setproctitle import setproctitle
@@ -28,8 +29,10 @@ from mandelbrot.plugin import PluginManager
 from mandelbrot.agent.registry import RegistryService
 from mandelbrot.agent.scheduler import SchedulerService
 from mandelbrot.agent.endpoints import EndpointWriter
+from mandelbrot.agent.profiler import ProfilerService
 from mandelbrot.agent.xmlrpc import XMLRPCService
-from mandelbrot.loggers import getLogger, startLogging, StdoutHandler, DEBUG
+from mandelbrot.loggers import getLogger, startLogging, stopLogging, flushSuppressed, StdoutHandler, AsyncFileHandler
+from mandelbrot.loggers import DEBUG, INFO, LOG_FORMATS
 from mandelbrot.defaults import defaults
 from mandelbrot import versionstring
 
@@ -60,6 +63,10 @@ class Agent(MultiService):
         self.registry = RegistryService(self.plugins, self.scheduler, self.endpoint)
         self.registry.configure(ns)
         self.addService(self.registry)
+        # configure profiler
+        self.profiler = ProfilerService()
+        self.profiler.configure(ns)
+        self.addService(self.profiler)
         # configure xmlrpc
         self.xmlrpc = XMLRPCService(self)
         self.xmlrpc.configure(ns)
@@ -87,8 +94,26 @@ class Agent(MultiService):
                 self.gid = None
         # configure logging
         logconfigfile = section.get_path('log config file', "%s.logconfig" % ns.appname)
-        if section.get_bool("debug", False):
-            startLogging(StdoutHandler(), DEBUG, logconfigfile)
+        logformat = section.get_str("log format", "text")
+        if logformat not in LOG_FORMATS:
+            raise ConfigureError("unknown log format %s" % logformat)
+        loglevel = DEBUG if section.get_bool("debug", False) else INFO
+        # debug output is not rate limited unless a limit is set explicitly
+        ratelimit = section.get_float("log rate limit", 0.0 if loglevel == DEBUG else 10.0)
+        rateburst = section.get_int("log rate burst", 50)
+        if ratelimit < 0.0 or rateburst < 1:
+            raise ConfigureError("log rate limit must not be negative and log rate burst must be greater than 0")
+        logfile = section.get_path("log file", None)
+        if logfile is not None:
+            buffersize = section.get_int("log buffer size", 8192)
+            if buffersize < 1:
+                raise ConfigureError("log buffer size must be greater than 0")
+            maxbytes = section.get_size("log file max size", 64 * 1024 * 1024)
+            backups = section.get_int("log file backups", 5)
+            handler = AsyncFileHandler(logfile, logformat, buffersize, maxbytes, backups)
+            startLogging(handler, loglevel, logconfigfile, ratelimit, rateburst)
+        elif loglevel == DEBUG:
+            startLogging(StdoutHandler(logformat), DEBUG, logconfigfile, ratelimit, rateburst)
         else:
             startLogging(None)
 
@@ -121,13 +146,22 @@ class Agent(MultiService):
             daemon.detach_process = True
         with daemon:
             from twisted.internet import reactor
+            from twisted.internet.task import LoopingCall
             self.startService()
+            # report messages suppressed at call sites which have gone quiet
+            LoopingCall(flushSuppressed).start(10.0, now=False)
+            # stop services while the reactor is still running, so that
+            # sends in flight can complete and the spool is closed cleanly
+            reactor.addSystemEventTrigger('before', 'shutdown', self.shutdown)
             reactor.run()
-            logger.info("-- stopping mandelbrot agent --")
-            self.stopService()
-        logger.info("-- stopped mandelbrot agent --")
+            logger.info("-- stopped mandelbrot agent --")
+            stopLogging()
         return 0
 
+    def shutdown(self):
+        logger.info("-- stopping mandelbrot agent --")
+        return self.stopService()
+
     def printError(self, failure):
         import StringIO
         s = StringIO.StringIO()
@@ -15,15 +15,26 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-import Queue, random, datetime, urlparse
-from threading import Thread
+import os, random, datetime, urlparse
 from twisted.application.service import MultiService
+from twisted.internet.task import LoopingCall
+from twisted.internet.defer import Deferred, DeferredList, maybeDeferred, succeed
 from pesky.settings import ConfigureError
+from mandelbrot.agent.queues import FifoQueue, CoalescingQueue, PriorityQueue
+from mandelbrot.agent.spool import Spool, HoldingBuffer
 from mandelbrot.plugin import PluginError
+from mandelbrot.instrumentation import instruments
+from mandelbrot.metric import MetricUnit
+from mandelbrot.convert import timedelta2seconds
+from mandelbrot.defaults import defaults
 from mandelbrot.loggers import getLogger
 
 logger = getLogger('mandelbrot.agent.endpoints')
 
+send_latency = instruments.histogram("send_latency", MetricUnit.SECONDS)
+messages_sent = instruments.counter("messages_sent", MetricUnit.UNITS)
+messages_undelivered = instruments.counter("messages_undelivered", MetricUnit.UNITS)
+
 class EndpointWriter(MultiService):
     """
     """
@@ -34,6 +45,12 @@ class EndpointWriter(MultiService):
         self.endpoint = None
         self.queue = None
         self.consumer = None
+        self.batchsize = 1
+        self.batchdelay = 0.0
+        self.maxinflight = 1
+        self.spool = None
+        self.replayrate = None
+        self.shutdowntimeout = None
 
     def configure(self, ns):
         section = ns.get_section('agent')
@@ -42,8 +59,60 @@ class EndpointWriter(MultiService):
         url = urlparse.urlparse(self.supervisor)
         # create the internal agent queue
         queuesize = section.get_int("agent queue size", 4096)
-        self.queue = Queue.Queue(maxsize=queuesize)
-        logger.debug("created agent queue with size %i", queuesize)
+        queuemode = section.get_str("agent queue mode", "fifo")
+        if queuemode == "fifo":
+            self.queue = FifoQueue(queuesize)
+        elif queuemode == "priority":
+            statussize = section.get_int("status lane size", queuesize)
+            metricssize = section.get_int("metrics lane size", queuesize)
+            weights = (section.get_int("transition lane weight", 4),
+                       section.get_int("status lane weight", 2),
+                       section.get_int("metrics lane weight", 1))
+            if min(weights) < 1:
+                raise ConfigureError("lane weights must be greater than 0")
+            self.queue = PriorityQueue(statussize, metricssize, weights)
+        elif queuemode == "coalesce":
+            metricsperprobe = section.get_int("coalesce metrics per probe", 1)
+            if metricsperprobe < 1:
+                raise ConfigureError("coalesce metrics per probe must be greater than 0")
+            self.queue = CoalescingQueue(queuesize, metricsperprobe)
+        else:
+            raise ConfigureError("unknown agent queue mode %s" % queuemode)
+        logger.debug("created %s agent queue with size %i", queuemode, queuesize)
+        instruments.gauge("queue_depth", MetricUnit.UNITS, self.queue.qsize)
+        # configure message batching
+        self.batchsize = section.get_int("endpoint batch size", 1)
+        if self.batchsize < 1:
+            raise ConfigureError("endpoint batch size must be greater than 0")
+        batchdelay = section.get_timedelta("endpoint batch delay", datetime.timedelta(milliseconds=100))
+        self.batchdelay = timedelta2seconds(batchdelay)
+        # configure the number of requests which may be in flight
+        self.maxinflight = section.get_int("endpoint max inflight", 4)
+        if self.maxinflight < 1:
+            raise ConfigureError("endpoint max inflight must be greater than 0")
+        # configure how long to wait for sends in flight when stopping
+        shutdowntimeout = section.get_timedelta("endpoint shutdown timeout", datetime.timedelta(seconds=5))
+        self.shutdowntimeout = timedelta2seconds(shutdowntimeout)
+        # configure the spool
+        if section.get_bool("spool enabled", False):
+            statedir = section.get_path("state directory", os.path.join(defaults.get("LOCALSTATE_DIR"), "agent"))
+            path = section.get_path("spool directory", os.path.join(statedir, "spool"))
+            segmentsize = section.get_size("spool segment size", 16 * 1024 * 1024)
+            maxsize = section.get_size("spool max size", 256 * 1024 * 1024)
+            self.spool = Spool(path, segmentsize, maxsize)
+            instruments.gauge("spool_size", MetricUnit.BYTES, self.spool.size)
+            self.queue.spool = self.spool
+            self.replayrate = section.get_int("spool replay rate", 100)
+            if self.replayrate < 1:
+                raise ConfigureError("spool replay rate must be greater than 0")
+            logger.debug("spooling undelivered messages to %s", path)
+        else:
+            # hold undelivered messages in memory until the endpoint recovers
+            buffersize = section.get_int("holding buffer size", 1024)
+            if buffersize > 0:
+                self.spool = HoldingBuffer(buffersize)
+                instruments.gauge("spool_size", MetricUnit.UNITS, self.spool.size)
+                self.replayrate = section.get_int("spool replay rate", 100)
         # configure the endpoint
         endpointtype = section.get_str('endpoint type')
         if endpointtype is None:
@@ -62,7 +131,8 @@ class EndpointWriter(MultiService):
 
     def startService(self):
         logger.debug("starting endpoint writer")
-        self.consumer = MessageConsumer(self.queue, self.endpoint)
+        self.consumer = MessageConsumer(self.queue, self.endpoint, self.maxinflight,
+            self.batchsize, self.batchdelay, self.spool, self.replayrate, self.shutdowntimeout)
         self.consumer.start()
 
     def get_queue(self):
@@ -79,27 +149,343 @@ class EndpointWriter(MultiService):
  
     def stopService(self):
         if self.consumer is not None:
-            logger.debug("stopping message consumer thread")
-            self.queue.put(MessageConsumer.TERMINATE)
-            self.consumer.join()
+            logger.debug("stopping message consumer")
+            defer = self.consumer.stop()
+        else:
+            defer = succeed(None)
         self.consumer = None
-        logger.debug("stopped endpoint writer")
+        def on_stopped(result):
+            try:
+                if self.spool is not None:
+                    self.spool.close()
+            except Exception, e:
+                logger.warning("failed to close spool: %s", e)
+            logger.debug("stopped endpoint writer")
+            return self.endpoint.close()
+        return defer.addBoth(on_stopped)
 
-class MessageConsumer(Thread):
+class MessageConsumer(object):
     """
+    Drains the agent queue on the reactor thread and sends each message to
+    the endpoint, keeping at most `maxinflight` sends outstanding.  While
+    every send is outstanding, messages wait in the queue.  If `batchsize`
+    is greater than 1, then up to `batchsize` messages are collected,
+    waiting at most `batchdelay` seconds after the first, and sent to the
+    endpoint as a single batch.
+
+    If `spool` is specified, then messages which could not be delivered are
+    appended to the spool, and once deliveries succeed again the spool is
+    replayed in order at up to `replayrate` messages per second.  While
+    deliveries are failing, one spooled message per second is sent to find
+    out whether the endpoint has recovered.  Spooled messages are replayed
+    one send at a time, and are only removed from the spool once they are
+    delivered, so a failed replay leaves the spool in order.  While the
+    spool holds messages, newly queued messages are appended to the spool
+    rather than sent, so they cannot overtake older spooled messages.
+
+    When stopped, sends in flight are given up to `shutdowntimeout` seconds
+    to complete, after which their messages are spooled as undelivered.
+    Messages still in the queue are then moved to the spool.
     """
-    def __init__(self, queue, endpoint):
-        Thread.__init__(self, name="message-consumer-thread")
-        self.daemon = True
+    def __init__(self, queue, endpoint, maxinflight=1, batchsize=1, batchdelay=0.0, spool=None,
+                 replayrate=100, shutdowntimeout=5.0):
+        self.inflight = 0
+        self.running = False
+        self.available = True
         self._queue = queue
         self._endpoint = endpoint
+        self._maxinflight = maxinflight
+        self._batchsize = batchsize
+        self._batchdelay = batchdelay
+        self._consuming = False
+        self._waiting = False
+        self._timer = None
+        self._expired = False
+        self._stopped = None
+        self._spool = spool
+        self._replayrate = replayrate
+        self._replayer = None
+        self._replaying = False
+        self._shutdowntimeout = shutdowntimeout
+        self._abandoner = None
+        self._sends = dict()
+
+    def start(self):
+        self.running = True
+        if self._spool is not None:
+            self._replayer = LoopingCall(self.replay)
+            self._replayer.start(1.0, False)
+        self.consume()
+
+    def replay(self):
+        """
+        Send up to `replayrate` spooled messages, or a single message if
+        the endpoint is unavailable.
+        """
+        if self._replaying:
+            return
+        # while the endpoint is unavailable, only send a single message
+        self._replay(self._replayrate if self.available else 1)
+
+    def _replay(self, remaining):
+        """
+        Send the messages at the front of the spool, and once they are
+        delivered remove them and send the next, until `remaining` messages
+        have been replayed.  If a send fails, the messages stay at the
+        front of the spool.
+        """
+        if not self.running or remaining <= 0 or self.inflight >= self._maxinflight:
+            return
+        # the spool is replayed one step at a time, but each step uses the
+        # full send capacity, so a backlog is not replayed slower than
+        # messages are sent from the queue
+        messages = self._spool.peek(min(self._batchsize * self._maxinflight, remaining))
+        if len(messages) == 0:
+            # the spool has been replayed, so resume sending from the queue
+            self.consume()
+            return
+        from twisted.internet import reactor
+        self._replaying = True
+        token = self._begin(None)
+        started = reactor.seconds()
+        defer = self._send_chunks(messages)
+        def on_delivered(undelivered):
+            self._replaying = False
+            if not self._end(token):
+                return
+            if len(undelivered) > 0:
+                # a partial failure is replayed again in full, rather than
+                # appending the undelivered messages out of order
+                logger.debug("failed to replay %i of %i messages", len(undelivered), len(messages))
+                self.available = False
+                return
+            self._spool.commit()
+            self.available = True
+            messages_sent.increment(len(messages))
+            logger.debug("replayed %i spooled messages", len(messages))
+            self._replay(remaining - len(messages))
+        def on_failure(failure):
+            self._replaying = False
+            if not self._end(token):
+                return
+            logger.debug("failed to replay messages: %s", failure.getErrorMessage())
+            self.available = False
+        defer.addCallbacks(on_delivered, on_failure)
+        defer.addBoth(self._on_sent, started)
+
+    def _send_chunks(self, messages):
+        """
+        Send `messages` concurrently in chunks of `batchsize` messages.
+        Returns a Deferred which fires with the list of messages which
+        were not delivered.
+        """
+        chunks = [messages[i:i + self._batchsize] for i in xrange(0, len(messages), self._batchsize)]
+        defers = list()
+        for chunk in chunks:
+            if self._batchsize == 1:
+                defer = maybeDeferred(self._endpoint.send, chunk[0]).addCallback(lambda _: list())
+            else:
+                defer = maybeDeferred(self._endpoint.send_batch, chunk)
+            defers.append(defer)
+        def on_complete(results):
+            undelivered = list()
+            for chunk,(success,result) in zip(chunks, results):
+                undelivered.extend(result if success else chunk)
+            return undelivered
+        return DeferredList(defers, consumeErrors=True).addCallback(on_complete)
+
+    def consume(self):
+        """
+        Send messages until the queue is empty or the maximum number of
+        sends is outstanding.  Sends which complete synchronously return
+        here rather than recursing.
+        """
+        if self._consuming:
+            return
+        self._consuming = True
+        try:
+            # spooled messages are older than anything in the queue, so while
+            # the spool holds messages the queue is appended to it, and new
+            # messages are only sent directly once the spool has been replayed
+            if self.running and self._spool is not None and not self._spool.empty():
+                if self._timer is not None and self._timer.active():
+                    self._timer.cancel()
+                self._timer = None
+                self._drain()
+            while self.running and self.inflight < self._maxinflight and not self._queue.empty():
+                if self._batchsize == 1:
+                    self._send(self._queue.get_nowait())
+                    continue
+                # wait for a full batch, until the batch delay expires
+                if self._queue.qsize() < self._batchsize and not self._expired:
+                    if self._timer is None:
+                        from twisted.internet import reactor
+                        self._timer = reactor.callLater(self._batchdelay, self._on_expired)
+                    break
+                if self._timer is not None and self._timer.active():
+                    self._timer.cancel()
+                self._timer = None
+                self._expired = False
+                batch = list()
+                while len(batch) < self._batchsize and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                self._send_batch(batch)
+        finally:
+            self._consuming = False
+        # if there is capacity for more sends, then wait for the next message
+        if self.running and self.inflight < self._maxinflight and not self._waiting:
+            self._waiting = True
+            self._queue.wait().addCallback(self._on_ready)
 
-    TERMINATE = 'terminate-thread'
+    def _on_ready(self, result):
+        self._waiting = False
+        self.consume()
 
-    def run(self):
-        while True:
-            message = self._queue.get()
-            if message is MessageConsumer.TERMINATE:
-                break
-            self._endpoint.send(message)
-        logger.debug("message-consumer-thread finishes")
+    def _on_expired(self):
+        self._timer = None
+        self._expired = True
+        self.consume()
+
+    def _begin(self, messages):
+        """
+        Record a send of `messages`, returning a token for _end().  The
+        messages are spooled if the send is abandoned at shutdown; replayed
+        messages are still in the spool, so they are recorded as None.
+        """
+        token = object()
+        self._sends[token] = messages
+        self.inflight += 1
+        return token
+
+    def _end(self, token):
+        """
+        Record that the send for `token` completed.  Returns False if the
+        send was abandoned at shutdown, in which case its result is ignored.
+        """
+        if token not in self._sends:
+            return False
+        del self._sends[token]
+        self.inflight -= 1
+        return True
+
+    def _send(self, message):
+        from twisted.internet import reactor
+        token = self._begin([message])
+        started = reactor.seconds()
+        defer = maybeDeferred(self._endpoint.send, message)
+        def on_delivered(result):
+            if not self._end(token):
+                return
+            self.available = True
+            messages_sent.increment()
+        def on_failure(failure):
+            if not self._end(token):
+                return
+            logger.debug("failed to send message: %s", failure.getErrorMessage())
+            self.on_undelivered([message])
+        defer.addCallbacks(on_delivered, on_failure)
+        defer.addBoth(self._on_sent, started)
+
+    def _send_batch(self, batch):
+        from twisted.internet import reactor
+        token = self._begin(batch)
+        started = reactor.seconds()
+        defer = maybeDeferred(self._endpoint.send_batch, batch)
+        def on_delivered(undelivered):
+            if not self._end(token):
+                return
+            messages_sent.increment(len(batch) - len(undelivered))
+            if len(undelivered) > 0:
+                logger.debug("failed to send %i of %i messages", len(undelivered), len(batch))
+                self.on_undelivered(undelivered)
+            else:
+                self.available = True
+        def on_failure(failure):
+            if not self._end(token):
+                return
+            logger.debug("failed to send batch: %s", failure.getErrorMessage())
+            self.on_undelivered(batch)
+        defer.addCallbacks(on_delivered, on_failure)
+        defer.addBoth(self._on_sent, started)
+
+    def on_undelivered(self, messages):
+        self.available = False
+        messages_undelivered.increment(len(messages))
+        if self._spool is None:
+            logger.debug("dropping %i undelivered messages", len(messages))
+            return
+        for message in messages:
+            self._spool.append(message)
+
+    def _on_sent(self, result, started):
+        from twisted.internet import reactor
+        send_latency.observe(reactor.seconds() - started)
+        if self._stopped is not None and self.inflight == 0:
+            self._finish()
+        self.consume()
+
+    def _drain(self):
+        """
+        Move the messages remaining in the queue to the spool.
+        """
+        messages = list()
+        while not self._queue.empty():
+            messages.append(self._queue.get_nowait())
+        if len(messages) == 0:
+            return
+        if self._spool is None:
+            logger.info("dropping %i queued messages", len(messages))
+            return
+        logger.debug("spooling %i queued messages", len(messages))
+        for message in messages:
+            self._spool.append(message)
+
+    def _abandon(self):
+        """
+        Give up on the sends still in flight, and spool their messages.
+        """
+        self._abandoner = None
+        logger.warning("abandoning %i sends still in flight", len(self._sends))
+        sends = self._sends.values()
+        self._sends = dict()
+        self.inflight = 0
+        for messages in sends:
+            if messages is not None:
+                self.on_undelivered(messages)
+        self._finish()
+
+    def _finish(self):
+        if self._abandoner is not None and self._abandoner.active():
+            self._abandoner.cancel()
+        self._abandoner = None
+        stopped = self._stopped
+        self._stopped = None
+        try:
+            self._drain()
+        except Exception, e:
+            logger.warning("failed to spool queued messages: %s", e)
+        if stopped is not None:
+            stopped.callback(None)
+
+    def stop(self):
+        """
+        Stop consuming messages.  Returns a Deferred which fires once all
+        outstanding sends have completed or have been abandoned, and the
+        queued messages have been moved to the spool.  The reactor must
+        still be running for sends in flight to complete.
+        """
+        from twisted.internet import reactor
+        self.running = False
+        if self._replayer is not None and self._replayer.running:
+            self._replayer.stop()
+        self._replayer = None
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        self._stopped = Deferred()
+        stopped = self._stopped
+        if self.inflight == 0:
+            self._finish()
+        else:
+            self._abandoner = reactor.callLater(self._shutdowntimeout, self._abandon)
+        return stopped
@@ -0,0 +1,209 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from pesky.settings import ConfigureError
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.internet.task import LoopingCall
+from twisted.python.threadpool import ThreadPool
+from mandelbrot.convert import timedelta2seconds
+from mandelbrot.loggers import getLogger
+
+logger = getLogger('mandelbrot.agent.executor')
+
+class ReactorExecutor(object):
+    """
+    Runs probes directly on the reactor thread.
+    """
+    def start(self):
+        pass
+
+    def submit(self, probe):
+        return maybeDeferred(probe.probe)
+
+    def stop(self):
+        pass
+
+class _ProbeThreadPool(ThreadPool):
+    """
+    A thread pool whose workers are daemon threads, and which can be
+    stopped without waiting indefinitely for running probes to finish.
+    """
+    def threadFactory(self, *args, **kwargs):
+        thread = threading.Thread(*args, **kwargs)
+        thread.daemon = True
+        return thread
+
+    def stop_with_timeout(self, timeout):
+        """
+        Stop the pool, waiting up to `timeout` seconds for the workers to
+        exit.  ThreadPool.stop() joins every worker, so it is run on a
+        separate daemon thread which is abandoned if the timeout passes.
+        Returns the list of workers which are still running.
+        """
+        stopper = threading.Thread(target=self.stop, name="probe-worker-stop")
+        stopper.daemon = True
+        stopper.start()
+        stopper.join(timeout)
+        return [thread for thread in self.threads if thread.is_alive()]
+
+class ThreadExecutor(object):
+    """
+    Runs probes on a bounded pool of worker threads.  Results are delivered
+    back to the reactor thread.  Workers are daemon threads, so a probe
+    which hangs cannot keep the agent from exiting.
+    """
+    def __init__(self, nthreads, stoptimeout=5.0):
+        self.pool = _ProbeThreadPool(minthreads=0, maxthreads=nthreads, name="probe-worker")
+        self.stoptimeout = stoptimeout
+
+    def start(self):
+        self.pool.start()
+        logger.debug("started probe worker pool with %i threads", self.pool.max)
+
+    def submit(self, probe):
+        from twisted.internet import reactor
+        from twisted.internet.threads import deferToThreadPool
+        return deferToThreadPool(reactor, self.pool, probe.probe)
+
+    def stop(self):
+        running = self.pool.stop_with_timeout(self.stoptimeout)
+        if len(running) > 0:
+            logger.warning("abandoned %i probe worker threads which did not stop within %.1f seconds",
+                len(running), self.stoptimeout)
+        logger.debug("stopped probe worker pool")
+
+class ProbeProcessError(Exception):
+    """
+    Raised when a probe fails in a worker process.
+    """
+
+def _invoke(probe):
+    """
+    Run the probe in a worker process.  Exceptions are not guaranteed to be
+    picklable, so failures are returned as a string instead of raised.
+    """
+    try:
+        return True, probe.probe()
+    except Exception, e:
+        return False, "%s: %s" % (e.__class__.__name__, e)
+
+class ProcessExecutor(object):
+    """
+    Runs probes on a pool of worker processes.  Probes must be picklable,
+    and any state a probe keeps between invocations lives in the worker
+    process, not in the agent.
+
+    The pool only reports successful results through its callback, so
+    pending results are polled for errors (a probe or result which could
+    not be pickled) and for invocations which have not returned within
+    the timeout (a worker which died mid-invocation).
+    """
+    def __init__(self, nprocesses, timeout=300.0, pollinterval=1.0):
+        self.nprocesses = nprocesses
+        self.timeout = timeout
+        self.pollinterval = pollinterval
+        self.pool = None
+        self._pending = dict()
+        self._poller = None
+
+    def start(self):
+        from multiprocessing import Pool
+        self.pool = Pool(processes=self.nprocesses)
+        self._poller = LoopingCall(self._poll)
+        self._poller.start(self.pollinterval, now=False)
+        logger.debug("started probe worker pool with %i processes", self.nprocesses)
+
+    def submit(self, probe):
+        from twisted.internet import reactor
+        defer = Deferred()
+        def on_result(result):
+            reactor.callFromThread(self._complete, defer, result)
+        try:
+            asyncresult = self.pool.apply_async(_invoke, (probe,), callback=on_result)
+        except Exception, e:
+            defer.errback(e)
+        else:
+            self._pending[defer] = (asyncresult, reactor.seconds() + self.timeout)
+        return defer
+
+    def _complete(self, defer, result):
+        if self._pending.pop(defer, None) is None:
+            return
+        success,value = result
+        if success:
+            defer.callback(value)
+        else:
+            defer.errback(ProbeProcessError(value))
+
+    def _poll(self):
+        from twisted.internet import reactor
+        now = reactor.seconds()
+        for defer,(asyncresult,deadline) in self._pending.items():
+            if asyncresult.ready():
+                # successful results are delivered by the callback
+                if asyncresult.successful():
+                    continue
+                try:
+                    asyncresult.get(0)
+                except Exception, e:
+                    error = ProbeProcessError("%s: %s" % (e.__class__.__name__, e))
+            elif now >= deadline:
+                error = ProbeProcessError("probe did not return within %.1f seconds" % self.timeout)
+            else:
+                continue
+            del self._pending[defer]
+            defer.errback(error)
+
+    def stop(self):
+        if self._poller is not None and self._poller.running:
+            self._poller.stop()
+        self._poller = None
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        self.pool = None
+        pending = self._pending
+        self._pending = dict()
+        for defer in pending.keys():
+            defer.errback(ProbeProcessError("probe worker pool was stopped"))
+        logger.debug("stopped probe worker pool")
+
+def make_executor(section):
+    """
+    Create the probe executor specified by the `probe execution` setting.
+    """
+    mode = section.get_str("probe execution", "thread")
+    if mode == "reactor":
+        return ReactorExecutor()
+    if mode == "thread":
+        nthreads = section.get_int("probe worker threads", 4)
+        if nthreads < 1:
+            raise ConfigureError("probe worker threads must be greater than 0")
+        return ThreadExecutor(nthreads)
+    if mode == "process":
+        nprocesses = section.get_int("probe worker processes", 2)
+        if nprocesses < 1:
+            raise ConfigureError("probe worker processes must be greater than 0")
+        timeout = section.get_timedelta("probe worker timeout", None)
+        if timeout is None:
+            return ProcessExecutor(nprocesses)
+        timeout = timedelta2seconds(timeout)
+        if timeout <= 0.0:
+            raise ConfigureError("probe worker timeout must be greater than 0")
+        return ProcessExecutor(nprocesses, timeout)
+    raise ConfigureError("unknown probe execution mode %s" % mode)
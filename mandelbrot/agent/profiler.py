@@ -0,0 +1,188 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, sys, time, signal, datetime, threading, collections, cProfile
+from twisted.application.service import Service
+from pesky.settings import ConfigureError
+from mandelbrot.convert import timedelta2seconds
+from mandelbrot.defaults import defaults
+from mandelbrot.loggers import getLogger
+
+logger = getLogger('mandelbrot.agent.profiler')
+
+class ProfilerError(Exception):
+    pass
+
+class CProfileSession(object):
+    """
+    Runs cProfile on the reactor thread, and writes the stats in pstats
+    format to `path` when stopped.  cProfile only sees the thread it was
+    enabled on, so probes run on executor threads are not included.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+        self._profile.dump_stats(self.path)
+
+class SamplingSession(object):
+    """
+    Samples the stack of every thread each `interval` seconds from a
+    background thread, and writes the samples in collapsed stack format
+    (one line per distinct stack, frames separated by semicolons, followed
+    by the number of samples) to `path` when stopped.
+    """
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.samples = 0
+        self._stacks = collections.defaultdict(int)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mandelbrot-profiler")
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def sample(self):
+        names = dict([(thread.ident, thread.name) for thread in threading.enumerate()])
+        for ident,frame in sys._current_frames().items():
+            if ident == self._thread.ident:
+                continue
+            stack = list()
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s:%s" % (code.co_filename, code.co_name))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stack.reverse()
+            self._stacks[';'.join(stack)] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        # the samples are written here rather than on the sampler thread,
+        # so that a failed write is raised to the caller
+        self._stopped.set()
+        self._thread.join()
+        with open(self.path, 'w') as f:
+            for stack,count in sorted(self._stacks.items()):
+                f.write("%s %i\n" % (stack, count))
+
+class ProfilerService(Service):
+    """
+    Profiles the running agent on demand, either when the agent receives
+    SIGUSR2 or when asked through the XML-RPC API.  A single profile runs
+    at a time, for a bounded duration, and its output is written to the
+    profile directory.
+    """
+    MODES = ('cprofile', 'sample')
+
+    def __init__(self):
+        self.setName("ProfilerService")
+        self.directory = None
+        self.mode = None
+        self.duration = None
+        self.maxduration = None
+        self.interval = None
+        self.onsignal = True
+        self.session = None
+        self._timer = None
+        self._prevhandler = None
+
+    def configure(self, ns):
+        section = ns.get_section('agent')
+        statedir = section.get_path("state directory", os.path.join(defaults.get("LOCALSTATE_DIR"), "agent"))
+        self.directory = section.get_path("profile directory", statedir)
+        self.mode = section.get_str("profile mode", "sample")
+        if self.mode not in ProfilerService.MODES:
+            raise ConfigureError("unknown profile mode %s" % self.mode)
+        self.duration = timedelta2seconds(section.get_timedelta("profile duration", datetime.timedelta(seconds=30)))
+        self.maxduration = timedelta2seconds(section.get_timedelta("profile max duration", datetime.timedelta(minutes=10)))
+        if self.duration <= 0.0 or self.maxduration <= 0.0:
+            raise ConfigureError("profile duration must be greater than 0")
+        self.interval = timedelta2seconds(section.get_timedelta("profile sample interval", datetime.timedelta(milliseconds=10)))
+        if self.interval <= 0.0:
+            raise ConfigureError("profile sample interval must be greater than 0")
+        self.onsignal = section.get_bool("profile on signal", True)
+
+    def start(self, mode=None, duration=None):
+        """
+        Start profiling for `duration` seconds using the specified `mode`,
+        or the configured defaults if not specified.  Returns the path the
+        profile will be written to.
+        """
+        from twisted.internet import reactor
+        if self.session is not None:
+            raise ProfilerError("profiler is already running")
+        mode = mode or self.mode
+        if mode not in ProfilerService.MODES:
+            raise ProfilerError("unknown profile mode %s" % mode)
+        duration = min(duration or self.duration, self.maxduration)
+        name = "profile-%s-%i" % (time.strftime("%Y%m%dT%H%M%S"), os.getpid())
+        if mode == 'cprofile':
+            session = CProfileSession(os.path.join(self.directory, name + ".pstats"))
+        else:
+            session = SamplingSession(os.path.join(self.directory, name + ".collapsed"), self.interval)
+        session.start()
+        self.session = session
+        self._timer = reactor.callLater(duration, self.stop)
+        logger.info("profiling agent for %.1f seconds using %s, writing to %s", duration, mode, session.path)
+        return session.path
+
+    def stop(self):
+        if self.session is None:
+            return
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        session = self.session
+        self.session = None
+        try:
+            session.stop()
+            logger.info("wrote profile to %s", session.path)
+        except EnvironmentError, e:
+            logger.warning("failed to write profile to %s: %s", session.path, e)
+
+    def _on_signal(self, signum, frame):
+        from twisted.internet import reactor
+        def start():
+            try:
+                self.start()
+            except ProfilerError, e:
+                logger.info("ignoring SIGUSR2: %s", e)
+        reactor.callFromThread(start)
+
+    def startService(self):
+        Service.startService(self)
+        if self.onsignal:
+            self._prevhandler = signal.signal(signal.SIGUSR2, self._on_signal)
+
+    def stopService(self):
+        if self._prevhandler is not None:
+            signal.signal(signal.SIGUSR2, self._prevhandler)
+        self._prevhandler = None
+        self.stop()
+        Service.stopService(self)
@@ -0,0 +1,218 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import Queue, collections
+from twisted.internet.defer import Deferred
+from mandelbrot.message import ProbeMessage, StatusMessage, MetricsMessage
+from mandelbrot.loggers import getLogger
+
+logger = getLogger('mandelbrot.agent.queues')
+
+class MessageQueue(object):
+    """
+    Base class for the agent queue.  The queue is only used from the reactor
+    thread.  Producers call put_nowait(), which raises Queue.Full if the
+    queue is at capacity, and the consumer calls get_nowait(), which raises
+    Queue.Empty if the queue is empty.  Subclasses implement _put(), _get()
+    and qsize().
+
+    If `spool` is set, then messages which do not fit in the queue are
+    appended to the spool instead of raising Queue.Full.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.spool = None
+        self._waiters = list()
+
+    def put_nowait(self, message):
+        try:
+            self._put(message)
+        except Queue.Full:
+            if self.spool is None:
+                raise
+            self.spool.append(message)
+            return
+        if len(self._waiters) > 0:
+            waiters = self._waiters
+            self._waiters = list()
+            for waiter in waiters:
+                waiter.callback(None)
+
+    def get_nowait(self):
+        return self._get()
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.maxsize
+
+    def wait(self):
+        """
+        Return a Deferred which fires the next time a message is put into
+        the queue.  The Deferred never fires synchronously.
+        """
+        waiter = Deferred()
+        self._waiters.append(waiter)
+        return waiter
+
+    def qsize(self):
+        raise NotImplementedError()
+
+    def _put(self, message):
+        raise NotImplementedError()
+
+    def _get(self):
+        raise NotImplementedError()
+
+class FifoQueue(MessageQueue):
+    """
+    Delivers messages in the order they were queued.
+    """
+    def __init__(self, maxsize):
+        MessageQueue.__init__(self, maxsize)
+        self._messages = collections.deque()
+
+    def qsize(self):
+        return len(self._messages)
+
+    def _put(self, message):
+        if len(self._messages) >= self.maxsize:
+            raise Queue.Full()
+        self._messages.append(message)
+
+    def _get(self):
+        try:
+            return self._messages.popleft()
+        except IndexError:
+            raise Queue.Empty()
+
+class CoalescingQueue(MessageQueue):
+    """
+    Keeps only the latest queued message for each probe.  Probe messages
+    are keyed by source and message type; a StatusMessage replaces the
+    status already queued for its probe and keeps its place in the queue,
+    while MetricsMessages are kept up to `metricsperprobe` per probe, the
+    oldest being discarded first.  Probes take turns being dequeued, so the
+    queue size is bounded by the number of probes rather than by how far
+    behind the endpoint is.  `coalesced` counts the messages replaced.
+    """
+    def __init__(self, maxsize, metricsperprobe=1):
+        MessageQueue.__init__(self, maxsize)
+        self.metricsperprobe = metricsperprobe
+        self.coalesced = 0
+        self._entries = collections.OrderedDict()
+        self._size = 0
+
+    def qsize(self):
+        return self._size
+
+    def _put(self, message):
+        if isinstance(message, MetricsMessage):
+            key = (str(message.source), message.msgtype)
+            maxlen = self.metricsperprobe
+        elif isinstance(message, ProbeMessage):
+            key = (str(message.source), message.msgtype)
+            maxlen = 1
+        else:
+            key = object()
+            maxlen = 1
+        entry = self._entries.get(key)
+        if entry is not None and len(entry) == maxlen:
+            entry.append(message)
+            self.coalesced += 1
+            return
+        if self._size >= self.maxsize:
+            raise Queue.Full()
+        if entry is None:
+            entry = collections.deque(maxlen=maxlen)
+            self._entries[key] = entry
+        entry.append(message)
+        self._size += 1
+
+    def _get(self):
+        if self._size == 0:
+            raise Queue.Empty()
+        key,entry = self._entries.popitem(last=False)
+        message = entry.popleft()
+        # requeue the remaining messages for the probe behind the other probes
+        if len(entry) > 0:
+            self._entries[key] = entry
+        self._size -= 1
+        return message
+
+class PriorityQueue(MessageQueue):
+    """
+    Splits messages into three lanes: status messages which change the
+    health of their probe, routine status messages, and all other messages.
+    Lanes are drained in weighted round-robin order given by `weights`, a
+    tuple of the weight of each lane, skipping empty lanes.  The routine
+    status and metrics lanes hold at most `statussize` and `metricssize`
+    messages; the transition lane is never full, so a health transition is
+    never dropped and is never stuck behind other messages.  Queued routine
+    status for a probe is discarded when the probe transitions, so that it
+    is not delivered after the newer status.
+    """
+    TRANSITION = 0
+    STATUS = 1
+    METRICS = 2
+
+    def __init__(self, statussize, metricssize, weights=(4, 2, 1)):
+        MessageQueue.__init__(self, statussize + metricssize)
+        self._lanes = (collections.deque(), collections.deque(), collections.deque())
+        self._sizes = (None, statussize, metricssize)
+        self._schedule = list()
+        for lane,weight in enumerate(weights):
+            self._schedule.extend([lane] * weight)
+        self._next = 0
+        self._health = dict()
+
+    def qsize(self):
+        return sum([len(lane) for lane in self._lanes])
+
+    def lane_sizes(self):
+        return tuple([len(lane) for lane in self._lanes])
+
+    def _put(self, message):
+        if isinstance(message, StatusMessage):
+            source = str(message.source)
+            if self._health.get(source) != message.health:
+                self._health[source] = message.health
+                lane = PriorityQueue.TRANSITION
+                # routine status queued for the probe is now stale, and must
+                # not be sent after the transition
+                routine = self._lanes[PriorityQueue.STATUS]
+                if len(routine) > 0:
+                    stale = [m for m in routine if str(m.source) == source]
+                    for m in stale:
+                        routine.remove(m)
+            else:
+                lane = PriorityQueue.STATUS
+        else:
+            lane = PriorityQueue.METRICS
+        size = self._sizes[lane]
+        if size is not None and len(self._lanes[lane]) >= size:
+            raise Queue.Full()
+        self._lanes[lane].append(message)
+
+    def _get(self):
+        for i in range(len(self._schedule)):
+            lane = self._lanes[self._schedule[self._next]]
+            self._next = (self._next + 1) % len(self._schedule)
+            if len(lane) > 0:
+                return lane.popleft()
+        raise Queue.Empty()
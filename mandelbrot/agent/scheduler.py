@@ -15,32 +15,152 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-import random, datetime, Queue
+import math, random, datetime, Queue
+from dateutil.tz import tzutc
 from twisted.internet.task import LoopingCall
 from twisted.application.service import Service
+from twisted.python.failure import Failure
 from pesky.settings import ConfigureError
-from mandelbrot.evaluation import Evaluation
+from mandelbrot.evaluation import Evaluation, Health
 from mandelbrot.ref import parse_proberef
 from mandelbrot.message import StatusMessage, MetricsMessage
 from mandelbrot.convert import timedelta2seconds
+from mandelbrot.agent.executor import make_executor
+from mandelbrot.probes.snapshot import snapshots
+from mandelbrot.instrumentation import instruments, Histogram
+from mandelbrot.metric import MetricUnit
 from mandelbrot.loggers import getLogger
 
 logger = getLogger('mandelbrot.agent.scheduler')
 
+scheduler_lag = instruments.gauge("scheduler_lag", MetricUnit.SECONDS)
+probe_execution_time = instruments.histogram("probe_execution_time", MetricUnit.SECONDS)
+probes_skipped = instruments.counter("probes_skipped", MetricUnit.OPS)
+probe_errors = instruments.counter("probe_errors", MetricUnit.OPS)
+probe_deadlines_exceeded = instruments.counter("probe_deadlines_exceeded", MetricUnit.OPS)
+messages_suppressed = instruments.counter("messages_suppressed", MetricUnit.UNITS)
+messages_dropped = instruments.counter("messages_dropped", MetricUnit.UNITS)
+
+def next_deadline(deadline, now, interval, resolution):
+    """
+    Return the deadline following `deadline` for an item which runs every
+    `interval` seconds and actually ran at `now`.  If the item fell behind
+    by more than one interval, the missed invocations are skipped rather
+    than run back-to-back.  Up to one tick of `resolution` lag is expected
+    from the timing wheel, so it does not count as falling behind.
+    """
+    missed = max(0L, long((now - deadline - resolution) / interval))
+    return deadline + (missed + 1) * interval
+
+class TimingWheel(object):
+    """
+    Hashed timing wheel holding the deadline of every scheduled item.  Each
+    slot covers `resolution` seconds; deadlines further out than one rotation
+    of the wheel stay in their slot until the wheel comes around again.
+    """
+    def __init__(self, resolution, nslots, now):
+        self.resolution = float(resolution)
+        self.nslots = nslots
+        self._slots = [list() for _ in xrange(nslots)]
+        self._current = long(math.floor(now / self.resolution))
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, deadline, item):
+        """
+        Schedule `item` to expire at `deadline` seconds.  Deadlines which
+        have already passed expire on the next call to advance().
+        """
+        tick = long(math.floor(deadline / self.resolution))
+        if tick < self._current:
+            tick = self._current
+        self._slots[tick % self.nslots].append((tick, deadline, item))
+        self._size += 1
+
+    def advance(self, now):
+        """
+        Advance the wheel to `now`, and return a list of (deadline, item)
+        tuples which have expired, ordered by deadline.  The slot holding
+        `now` is visited again on the next advance, so items expire on the
+        first advance at or after their deadline.
+        """
+        current = long(math.floor(now / self.resolution))
+        expired = list()
+        if current < self._current:
+            return expired
+        # if we have fallen more than a full rotation behind, then each
+        # slot only needs to be visited once
+        first = max(self._current, current - self.nslots + 1)
+        for tick in xrange(first, current + 1):
+            index = tick % self.nslots
+            slot = self._slots[index]
+            if len(slot) == 0:
+                continue
+            remaining = list()
+            for entry in slot:
+                if entry[0] <= current and entry[1] <= now:
+                    expired.append((entry[1], entry[2]))
+                else:
+                    remaining.append(entry)
+            self._slots[index] = remaining
+        self._current = current
+        self._size -= len(expired)
+        expired.sort(key=lambda entry: entry[0])
+        return expired
+
 class SchedulerService(Service):
     """
+    Runs every scheduled probe from a single timing wheel, which is advanced
+    once per tick by one LoopingCall instead of one timer per probe.
     """
     def __init__(self):
         self.setName("SchedulerService")
         self.systems = dict()
         self.interval = None
         self.splay = None
+        self.resolution = None
+        self.wheel = None
+        self.executor = None
+        self.concurrency = None
+        self.deadline = None
+        self.maxsilence = None
+        self.comparesummary = True
+        self.deadband = None
+        self.lag = 0.0
+        self.maxlag = 0.0
+        self._ticker = None
 
     def configure(self, ns):
+        from twisted.internet import reactor
         # configure probe scheduling
         section = ns.get_section('agent')
         self.interval = section.get_timedelta("probe interval", datetime.timedelta(seconds=300))
         self.splay = section.get_timedelta("probe splay", datetime.timedelta(seconds=300))
+        self.resolution = timedelta2seconds(section.get_timedelta("scheduler resolution", datetime.timedelta(seconds=1)))
+        if self.resolution <= 0.0:
+            raise ConfigureError("scheduler resolution must be greater than 0")
+        nslots = section.get_int("scheduler wheel size", 512)
+        if nslots < 1:
+            raise ConfigureError("scheduler wheel size must be greater than 0")
+        self.wheel = TimingWheel(self.resolution, nslots, reactor.seconds())
+        logger.debug("created timing wheel with %i slots of %.3f seconds", nslots, self.resolution)
+        # system probes share one snapshot of each psutil source per tick
+        ttl = section.get_timedelta("snapshot ttl", None)
+        snapshots.ttl = timedelta2seconds(ttl) if ttl is not None else self.resolution
+        # configure probe execution
+        self.executor = make_executor(section)
+        self.concurrency = section.get_int("probe concurrency", 1)
+        if self.concurrency < 1:
+            raise ConfigureError("probe concurrency must be greater than 0")
+        self.deadline = section.get_timedelta("probe execution deadline", None)
+        # configure suppression of unchanged status and metrics
+        self.maxsilence = section.get_timedelta("status max silence", None)
+        self.comparesummary = section.get_bool("status compare summary", True)
+        self.deadband = section.get_float("metrics deadband", None)
+        if self.deadband is not None and self.deadband < 0.0:
+            raise ConfigureError("metrics deadband must not be negative")
 
     def schedule(self, system, queue):
         """
@@ -53,16 +173,24 @@ class SchedulerService(Service):
                 try:
                     if not probe.is_synthetic():
                         ref = parse_proberef(system.get_uri() + probe.get_path())
-                        runner = ProbeRunner(ref, probe, self.interval, self.splay, queue)
+                        deadline = probe.get_deadline()
+                        if deadline is None:
+                            deadline = self.deadline
+                        runner = ProbeRunner(ref, probe, self.interval, self.splay, queue,
+                                             self.executor, self.concurrency, deadline)
+                        if self.maxsilence is not None:
+                            runner.suppress(self.maxsilence, self.comparesummary, self.deadband)
                         runners[probe.get_path()] = runner
                     _schedule(map(lambda item: item[1], probe.iter_probes()))
                 except Exception, e:
                     logger.warning("failed to schedule probe %s: %s", probe.get_path, str(e))
         _schedule(map(lambda item: item[1], system.iter_probes()))
+        now = reactor.seconds()
         for path,runner in runners.items():
             splay = random.uniform(0.1, timedelta2seconds(runner.splay))
             logger.debug("scheduling probe %s with splay %s", path, datetime.timedelta(seconds=splay))
-            reactor.callLater(splay, runner.start)
+            runner.start()
+            self.wheel.insert(now + splay, runner)
         self.systems[system.get_uri()] = runners
 
     def unschedule(self, uri):
@@ -74,28 +202,184 @@ class SchedulerService(Service):
         del self.systems[uri]
         logger.info("unscheduled system %s", uri)
 
+    def tick(self):
+        """
+        Advance the timing wheel and run every probe which has come due,
+        then reschedule each probe for its next interval.  Stopped runners
+        are dropped from the wheel here rather than when they are stopped.
+        """
+        from twisted.internet import reactor
+        now = reactor.seconds()
+        expired = self.wheel.advance(now)
+        if len(expired) == 0:
+            return
+        self.lag = now - expired[0][0]
+        scheduler_lag.set(self.lag)
+        if self.lag > self.maxlag:
+            self.maxlag = self.lag
+        for deadline,runner in expired:
+            if not runner.running:
+                continue
+            runner.call(deadline)
+            interval = timedelta2seconds(runner.interval)
+            self.wheel.insert(next_deadline(deadline, now, interval, self.resolution), runner)
+        logger.trace("ran %i probes, scheduler is %.3f seconds behind", len(expired), self.lag)
+
+    def get_lag(self):
+        """
+        Return a tuple containing the number of seconds the scheduler was
+        behind on the last tick which ran probes, and the maximum lag seen
+        since the scheduler started.
+        """
+        return self.lag, self.maxlag
+
+    def get_probe_timings(self, limit=None):
+        """
+        Return a list of dicts holding the execution time and start drift
+        of each scheduled probe, slowest first by mean execution time.  If
+        `limit` is specified, then at most `limit` probes are returned.
+        """
+        timings = list()
+        for runners in self.systems.values():
+            for runner in runners.values():
+                timings.append(runner.get_timings())
+        timings.sort(key=lambda timing: timing['mean'], reverse=True)
+        if limit is not None:
+            timings = timings[:limit]
+        return timings
+
+    def startService(self):
+        Service.startService(self)
+        self.executor.start()
+        self._ticker = LoopingCall(self.tick)
+        self._ticker.start(self.resolution, False)
+        logger.debug("started scheduler")
+
     def stopService(self):
         if len(self.systems) > 0:
             logger.debug("stopping scheduled systems")
             for uri in self.systems.keys():
                 self.unschedule(uri)
+        if self._ticker is not None and self._ticker.running:
+            self._ticker.stop()
+        self._ticker = None
+        self.executor.stop()
+        Service.stopService(self)
 
 class ProbeRunner(object):
     """
+    Runs a single probe using the scheduler's executor, and converts each
+    evaluation into messages on the agent queue.  At most `concurrency`
+    invocations of the probe may be outstanding at once; further invocations
+    are skipped until one completes.
+
+    If `deadline` is specified and an invocation runs longer, the invocation
+    is abandoned and an unknown status is sent in place of its result.  The
+    abandoned invocation still counts against `concurrency` until it
+    returns, so a hung probe is skipped instead of piling up.
+
+    The execution time of each invocation, from when it is submitted to the
+    executor until its result is returned, and how late each invocation
+    started relative to its scheduled start, are kept in histograms.
+
+    If suppression is enabled with suppress(), then a status which has not
+    changed since it was last sent is not sent again until `maxsilence` has
+    passed, and likewise for metrics which are all within the deadband of
+    the values last sent.
     """
-    def __init__(self, proberef, probe, interval, splay, queue):
+    def __init__(self, proberef, probe, interval, splay, queue, executor, concurrency=1, deadline=None):
         self.proberef = proberef
         self.probe = probe
         self.interval = interval
         self.splay = splay
         self.queue = queue
+        self.executor = executor
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.running = False
+        self.inflight = 0
+        self.suppressed = 0
+        self.dropped = 0
+        self.timings = Histogram("%s:execution" % proberef, MetricUnit.SECONDS)
+        self.drift = Histogram("%s:drift" % proberef, MetricUnit.SECONDS)
+        self.maxsilence = None
+        self.comparesummary = True
+        self.deadband = None
         self._lastexctype = None
-        self._call = LoopingCall(self.call)
+        self._laststatus = None
+        self._laststatussent = None
+        self._lastmetrics = None
+        self._lastmetricssent = None
+
+    def suppress(self, maxsilence, comparesummary=True, deadband=None):
+        """
+        Enable suppression of unchanged status and metrics.  The supervisor
+        marks a probe as timed out if it receives nothing for the probe
+        timeout in the probe policy, and a suppressed status is only resent
+        when the probe next runs, so `maxsilence` is clamped to one interval
+        less than the probe timeout.
+        """
+        maxsilence = timedelta2seconds(maxsilence)
+        policy = self.probe.get_policy()
+        if policy is not None and policy.probe_timeout is not None:
+            limit = timedelta2seconds(policy.probe_timeout) - timedelta2seconds(self.interval)
+            if maxsilence > limit:
+                logger.debug("clamping max silence for probe %s to %.1f seconds", self.proberef, limit)
+                maxsilence = limit
+        if maxsilence <= 0.0:
+            logger.debug("probe interval is too long to suppress status for probe %s", self.proberef)
+            return
+        self.maxsilence = maxsilence
+        self.comparesummary = comparesummary
+        self.deadband = deadband
 
-    def call(self):
+    def call(self, scheduled=None):
+        if self.inflight >= self.concurrency:
+            logger.debug("probe %s is still running, skipping invocation", self.proberef)
+            probes_skipped.increment()
+            return
+        from twisted.internet import reactor
+        self.inflight += 1
+        started = reactor.seconds()
+        if scheduled is not None:
+            self.drift.observe(max(0.0, started - scheduled))
+        if self.deadline is not None:
+            timer = reactor.callLater(timedelta2seconds(self.deadline), self.on_deadline)
+        else:
+            timer = None
+        defer = self.executor.submit(self.probe)
+        defer.addBoth(self.on_result, started, timer)
+
+    def on_result(self, result, started, timer):
+        from twisted.internet import reactor
+        self.inflight -= 1
+        elapsed = reactor.seconds() - started
+        self.timings.observe(elapsed)
+        probe_execution_time.observe(elapsed)
+        if timer is not None:
+            if not timer.active():
+                logger.debug("probe %s returned after deadline, discarding result", self.proberef)
+                return
+            timer.cancel()
+            # a probe run on the reactor thread blocks the deadline timer,
+            # so check the elapsed time as well
+            if reactor.seconds() - started > timedelta2seconds(self.deadline):
+                self.on_deadline()
+                return
+        if isinstance(result, Failure):
+            self.on_error(result)
+        else:
+            self.on_evaluation(result)
+
+    def on_deadline(self):
+        logger.warning("probe %s exceeded execution deadline of %s", self.proberef, self.deadline)
+        probe_deadlines_exceeded.increment()
+        summary = "probe execution exceeded deadline of %s" % self.deadline
+        self.send(StatusMessage(self.proberef, Health.UNKNOWN, summary, datetime.datetime.now(tzutc())))
+
+    def on_evaluation(self, evaluation):
         try:
-            # invoke probe and parse evaluation
-            evaluation = self.probe.probe()
+            # parse evaluation
             if not isinstance(evaluation, Evaluation):
                 raise TypeError("probe returns unknown type %s" % evaluation.__class__.__name__)
             logger.debug("probe %s evaluates %s", self.proberef, evaluation)
@@ -108,25 +392,93 @@ class ProbeRunner(object):
                 metrics = evaluation.metrics
                 timestamp = metrics.timestamp if metrics.timestamp is not None else evaluation.timestamp
                 messages.append(MetricsMessage(self.proberef, metrics.metrics, timestamp))
-            # send messages to endpoint
+            # send messages to endpoint, unless they are unchanged
             for message in messages:
-                try:
-                    self.queue.put_nowait(message)
-                except Queue.Full:
-                    logger.debug("agent queue is full, dropping message")
+                if self.maxsilence is not None and self.is_unchanged(message):
+                    self.suppressed += 1
+                    messages_suppressed.increment()
+                    continue
+                self.send(message)
             # clear error flag
             if self._lastexctype is not None:
                 self._lastexctype = None
         except Exception, e:
-            if self._lastexctype is None or isinstance(e, self._lastexctype):
-                logger.warning("probe %s generates error: %s", self.proberef, e)
-                self._lastexctype = type(e)
+            self.on_error(Failure(e))
+
+    def on_error(self, failure):
+        e = failure.value
+        probe_errors.increment()
+        if self._lastexctype is None or isinstance(e, self._lastexctype):
+            logger.warning("probe %s generates error: %s", self.proberef, e)
+            self._lastexctype = type(e)
+
+    def is_unchanged(self, message):
+        """
+        Returns True if `message` carries the same status or metrics as the
+        last message of its type which was sent, and was sent less than
+        `maxsilence` seconds ago.
+        """
+        from twisted.internet import reactor
+        now = reactor.seconds()
+        if isinstance(message, StatusMessage):
+            if self._laststatus is None or now - self._laststatussent >= self.maxsilence:
+                return False
+            health,summary = self._laststatus
+            if message.health != health:
+                return False
+            return not self.comparesummary or message.summary == summary
+        if isinstance(message, MetricsMessage):
+            if self.deadband is None or self._lastmetrics is None:
+                return False
+            if now - self._lastmetricssent >= self.maxsilence:
+                return False
+            if set(message.metrics.keys()) != set(self._lastmetrics.keys()):
+                return False
+            for name,value in message.metrics.items():
+                last = self._lastmetrics[name]
+                try:
+                    if abs(value - last) > self.deadband * abs(last):
+                        return False
+                except TypeError:
+                    if value != last:
+                        return False
+            return True
+        return False
+
+    def send(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except Queue.Full:
+            logger.debug("agent queue is full, dropping message")
+            self.dropped += 1
+            messages_dropped.increment()
+            return
+        if self.maxsilence is None:
+            return
+        from twisted.internet import reactor
+        if isinstance(message, StatusMessage):
+            self._laststatus = (message.health, message.summary)
+            self._laststatussent = reactor.seconds()
+        elif isinstance(message, MetricsMessage):
+            self._lastmetrics = dict(message.metrics)
+            self._lastmetricssent = reactor.seconds()
+
+    def get_timings(self):
+        """
+        Return a dict summarizing the execution time and start drift of
+        the probe, in seconds.
+        """
+        timings = self.timings
+        mean = timings.sum / timings.count if timings.count > 0 else 0.0
+        return {'probeRef': str(self.proberef), 'count': timings.count, 'mean': mean,
+                'p99': timings.percentile(99), 'max': timings.max,
+                'interval': timedelta2seconds(self.interval),
+                'driftP99': self.drift.percentile(99), 'driftMax': self.drift.max}
 
     def start(self):
         logger.debug("starting probe %s with interval %s", self.proberef, self.interval)
-        self._call.start(timedelta2seconds(self.interval), True)
+        self.running = True
 
     def stop(self):
-        if self._call.running:
-            self._call.stop()
+        self.running = False
         logger.debug("stopped probe %s", self.proberef)
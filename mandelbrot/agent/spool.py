@@ -0,0 +1,281 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, mmap, struct, itertools, collections
+from mandelbrot.message import load_message
+from mandelbrot.http import message_encoder, json_decoder
+from mandelbrot.loggers import getLogger
+
+logger = getLogger('mandelbrot.agent.spool')
+
+class Spool(object):
+    """
+    Durable append-only log of messages, split into numbered segment files
+    under `path`.  Each record is a 4 byte big-endian length followed by
+    the message encoded as JSON, as it would be sent to the supervisor.  Segments are read through a read-only memory map,
+    and the read position is kept in a cursor file so that unread messages
+    survive a restart.  When the spool grows past `maxsize` bytes, the
+    oldest segments are evicted, whether or not they have been read.
+    """
+    def __init__(self, path, segmentsize=16 * 1024 * 1024, maxsize=256 * 1024 * 1024):
+        path = os.path.abspath(path)
+        if os.path.exists(path):
+            if not os.path.isdir(path):
+                raise Exception("path %s exists but is not a directory" % path)
+        else:
+            try:
+                os.mkdir(path)
+            except Exception, e:
+                raise Exception("failed to create spool directory %s" % path)
+        self.path = path
+        self.segmentsize = segmentsize
+        self.maxsize = maxsize
+        self.evicted = 0
+        self._segments = sorted([long(name[:-6]) for name in os.listdir(path) if name.endswith('.spool')])
+        self._size = sum([os.path.getsize(self._segmentpath(segment)) for segment in self._segments])
+        # open the last segment for writing
+        if len(self._segments) == 0:
+            self._segments.append(0L)
+        self._repair(self._segments[-1])
+        self._writer = open(self._segmentpath(self._segments[-1]), 'ab')
+        self._writersize = os.path.getsize(self._segmentpath(self._segments[-1]))
+        # load the read position
+        self._segment,self._offset = self._readcursor()
+        if self._segment not in self._segments:
+            self._segment,self._offset = self._segments[0],0
+        self._map = None
+        self._mapsegment = None
+        self._peeked = None
+        logger.debug("opened spool %s with %i segments", path, len(self._segments))
+
+    def _segmentpath(self, segment):
+        return os.path.join(self.path, "%020i.spool" % segment)
+
+    def _repair(self, segment):
+        """
+        Truncate a partial record left at the end of `segment` by a crash,
+        so that new records are not appended after it.
+        """
+        path = self._segmentpath(segment)
+        if not os.path.exists(path):
+            return
+        size = os.path.getsize(path)
+        offset = 0
+        with open(path, 'rb') as f:
+            while offset + 4 <= size:
+                f.seek(offset)
+                length, = struct.unpack('>I', f.read(4))
+                if offset + 4 + length > size:
+                    break
+                offset += 4 + length
+        if offset < size:
+            logger.warning("truncating %i bytes of partial record from %s", size - offset, path)
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+            self._size -= size - offset
+
+    def _readcursor(self):
+        try:
+            with open(os.path.join(self.path, 'cursor'), 'r') as f:
+                segment,offset = f.read().split()
+                return long(segment),long(offset)
+        except (IOError, ValueError):
+            return None,0
+
+    def _writecursor(self):
+        path = os.path.join(self.path, 'cursor')
+        with open(path + '.tmp', 'w') as f:
+            f.write("%i %i\n" % (self._segment, self._offset))
+        os.rename(path + '.tmp', path)
+
+    def append(self, message):
+        """
+        Append `message` to the end of the spool.
+        """
+        data = message_encoder.encode(message)
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        record = struct.pack('>I', len(data)) + data
+        if self._writersize > 0 and self._writersize + len(record) > self.segmentsize:
+            self._writer.close()
+            self._segments.append(self._segments[-1] + 1)
+            self._writer = open(self._segmentpath(self._segments[-1]), 'ab')
+            self._writersize = 0
+        self._writer.write(record)
+        self._writer.flush()
+        self._writersize += len(record)
+        self._size += len(record)
+        while self._size > self.maxsize and len(self._segments) > 1:
+            self._evict()
+
+    def _evict(self):
+        segment = self._segments.pop(0)
+        path = self._segmentpath(segment)
+        size = os.path.getsize(path)
+        if self._mapsegment == segment:
+            self._unmap()
+        os.unlink(path)
+        self._size -= size
+        self.evicted += size
+        if self._segment == segment:
+            self._segment,self._offset = self._segments[0],0
+            self._writecursor()
+            self._peeked = None
+        logger.warning("spool is full, evicted %i bytes of the oldest messages", size)
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+        self._map = None
+        self._mapsegment = None
+
+    def _mapped(self, segment, offset):
+        """
+        Map `segment`, or remap it if the segment has grown since it was
+        last mapped.  Returns False if there is nothing past `offset`.
+        """
+        if self._mapsegment == segment and offset < len(self._map):
+            return True
+        self._unmap()
+        with open(self._segmentpath(segment), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= offset:
+                return False
+            self._map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            self._mapsegment = segment
+        return True
+
+    def peek(self, count):
+        """
+        Return up to `count` messages from the front of the spool, in the
+        order they were appended, without removing them.  The messages are
+        removed by calling commit().
+        """
+        messages = list()
+        segment,offset = self._segment,self._offset
+        while len(messages) < count:
+            if self._mapped(segment, offset):
+                end = len(self._map)
+                # a partial record at the end of a segment is either still
+                # being written, or was cut short by a crash
+                if offset + 4 <= end:
+                    length, = struct.unpack('>I', self._map[offset:offset + 4])
+                    if offset + 4 + length <= end:
+                        data = self._map[offset + 4:offset + 4 + length]
+                        offset += 4 + length
+                        try:
+                            messages.append(load_message(json_decoder.decode(data)))
+                        except Exception, e:
+                            logger.warning("discarding unreadable spooled message: %s", e)
+                        continue
+            # move on to the next segment, unless this one is being written
+            if segment == self._segments[-1]:
+                self._unmap()
+                break
+            segment,offset = self._segments[self._segments.index(segment) + 1],0
+        self._peeked = (segment, offset)
+        return messages
+
+    def commit(self):
+        """
+        Remove the messages returned by the last call to peek(), deleting
+        any segments which have been completely read.
+        """
+        if self._peeked is None:
+            return
+        segment,offset = self._peeked
+        self._peeked = None
+        # the peeked segment was evicted, so the messages are already gone
+        if segment not in self._segments:
+            return
+        while self._segments[0] != segment:
+            old = self._segments.pop(0)
+            if self._mapsegment == old:
+                self._unmap()
+            path = self._segmentpath(old)
+            self._size -= os.path.getsize(path)
+            os.unlink(path)
+        if (segment,offset) != (self._segment,self._offset):
+            self._segment,self._offset = segment,offset
+            self._writecursor()
+
+    def read(self, count):
+        """
+        Remove up to `count` messages from the front of the spool, and
+        return them in the order they were appended.
+        """
+        messages = self.peek(count)
+        self.commit()
+        return messages
+
+    def empty(self):
+        if self._segment != self._segments[-1]:
+            return False
+        return self._offset >= self._writersize
+
+    def size(self):
+        return self._size
+
+    def close(self):
+        self._unmap()
+        self._writer.close()
+        self._writecursor()
+
+class HoldingBuffer(object):
+    """
+    In-memory stand-in for the spool, used when no spool is configured.
+    Holds at most `maxsize` messages, discarding the oldest when full.
+    Messages in the buffer are lost if the agent restarts.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.evicted = 0
+        self._messages = collections.deque()
+        self._peeked = 0
+
+    def append(self, message):
+        if len(self._messages) >= self.maxsize:
+            self._messages.popleft()
+            self.evicted += 1
+            # an evicted message no longer needs to be removed by commit()
+            if self._peeked > 0:
+                self._peeked -= 1
+        self._messages.append(message)
+
+    def peek(self, count):
+        messages = list(itertools.islice(self._messages, count))
+        self._peeked = len(messages)
+        return messages
+
+    def commit(self):
+        for _ in xrange(self._peeked):
+            self._messages.popleft()
+        self._peeked = 0
+
+    def read(self, count):
+        messages = self.peek(count)
+        self.commit()
+        return messages
+
+    def empty(self):
+        return len(self._messages) == 0
+
+    def size(self):
+        return len(self._messages)
+
+    def close(self):
+        pass
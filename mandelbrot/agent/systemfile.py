@@ -15,7 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-import os, yaml
+import os, copy, yaml
 from ConfigParser import RawConfigParser
 from pesky.settings.section import Section
 from mandelbrot.loggers import getLogger
@@ -75,6 +75,17 @@ class ProbeSpec(object):
         self.policy = policy
         self.probes = probes
 
+def expand_instances(probename, probe):
+    """
+    If `probe` specifies "probe instances: N", then return a list of N copies
+    of the probe named by appending the instance number to `probename`,
+    otherwise return a list containing only the probe.
+    """
+    instances = probe.pop("probe instances", None)
+    if instances is None:
+        return [(probename, probe)]
+    return [(probename + str(i), copy.deepcopy(probe)) for i in range(int(instances))]
+
 def parse_systemfile(systemfile):
     """
     """
@@ -121,13 +132,15 @@ def parse_systemfile(systemfile):
         # probe children
         children = dict()
         for childname,childprobe in probe.items():
-            parse_probe(childname, childprobe, probe_path, children)
+            for name,instance in expand_instances(childname, childprobe):
+                parse_probe(name, instance, probe_path, children)
         parent[probename] = ProbeSpec(probe_path, probe_type, probe_settings, probe_metadata, probe_policy, children)
     system_probes = dict()
     for childname,childprobe in system.pop("probes").items():
         if not childname.startswith("/"):
             raise Exception("expected probe, found %s", childname)
-        parse_probe(childname, childprobe, "", system_probes)
+        for name,instance in expand_instances(childname, childprobe):
+            parse_probe(name, instance, "", system_probes)
     # system settings
     options = RawConfigParser()
     options.add_section("settings")
@@ -19,8 +19,10 @@
 import time
 from pesky.settings import ConfigureError
 from twisted.application.service import Service
-from twisted.web.xmlrpc import XMLRPC, withRequest
+from twisted.web.xmlrpc import XMLRPC, Fault, withRequest
 from twisted.web.server import Site
+from mandelbrot.instrumentation import instruments
+from mandelbrot.agent.profiler import ProfilerError
 from mandelbrot.loggers import getLogger
 from mandelbrot import versionstring
 
@@ -74,6 +76,35 @@ class API(XMLRPC):
         logger.debug("getUptime -> " + str(request))
         return long(time.time() - self.started)
 
+    @withRequest
+    def xmlrpc_getSchedulerLag(self, request):
+        logger.debug("getSchedulerLag -> " + str(request))
+        lag,maxlag = self.agent.scheduler.get_lag()
+        return {'lag': lag, 'maxLag': maxlag}
+
+    @withRequest
+    def xmlrpc_getProbeTimings(self, request, limit=0):
+        logger.debug("getProbeTimings -> " + str(request))
+        return self.agent.scheduler.get_probe_timings(limit or None)
+
+    @withRequest
+    def xmlrpc_getMetrics(self, request):
+        logger.debug("getMetrics -> " + str(request))
+        return instruments.snapshot()
+
+    @withRequest
+    def xmlrpc_startProfiling(self, request, mode='', duration=0):
+        """
+        Profile the agent for `duration` seconds using `mode`, which is
+        either 'cprofile' or 'sample'.  Empty arguments select the
+        configured defaults.  Returns the path of the profile output.
+        """
+        logger.debug("startProfiling -> " + str(request))
+        try:
+            return self.agent.profiler.start(mode or None, duration or None)
+        except ProfilerError, e:
+            raise Fault(1, str(e))
+
     @withRequest
     def xmlrpc_getSpec(self, request):
         return self.agent.inventory.spec
@@ -19,6 +19,7 @@ import time
 from twisted.internet import reactor
 from twisted.web.xmlrpc import Proxy
 from mandelbrot.http import http, as_json, from_json
+from mandelbrot.table import render_table
 from mandelbrot.loggers import getLogger, startLogging, StdoutHandler, DEBUG
 
 logger = getLogger('mandelbrot.client.agent')
@@ -62,6 +63,31 @@ def agent_uptime_callback(ns):
     defer.addCallbacks(onresponse, onfailure)
     reactor.run()
 
+def agent_probes_callback(ns):
+    section = ns.get_section('client')
+    url = 'http://localhost:9844/XMLRPC'
+    if section.get_bool("debug", False):
+        startLogging(StdoutHandler(), DEBUG)
+    else:
+        startLogging(None)
+    # client:agent:probes settings
+    section = ns.get_section('client:agent:probes')
+    limit = section.get_int('probes limit', 20)
+    tablefmt = section.get_str('probes table format', 'simple')
+    fields = ('probeRef','count','mean','p99','max','interval','driftP99','driftMax')
+    logger.debug("connecting to %s", url)
+    proxy = Proxy(url)
+    defer = proxy.callRemote('getProbeTimings', limit)
+    def onfailure(failure):
+        print "query failed: " + failure.getErrorMessage()
+        reactor.stop()
+    def onresponse(timings):
+        if len(timings) > 0:
+            print render_table(timings, expand=False, columns=fields, tablefmt=tablefmt)
+        reactor.stop()
+    defer.addCallbacks(onresponse, onfailure)
+    reactor.run()
+
 def agent_version_callback(ns):
     section = ns.get_section('client')
     url = 'http://localhost:9844/XMLRPC'
@@ -100,6 +126,14 @@ agent_actions = Action("agent",
                       description="display the local agent process uptime",
                       options=[],
                       callback=agent_uptime_callback),
+                    Action("probes",
+                      usage="[OPTIONS]",
+                      description="display the slowest probes run by the local agent process",
+                      options=[
+                        Option('n', 'limit', 'probes limit', help="display at most COUNT probes", metavar="COUNT"),
+                        Option('T', 'table-format', 'probes table format', help="display result using the specified FMT", metavar="FMT")
+                        ],
+                      callback=agent_probes_callback),
                     Action("version",
                       usage="[OPTIONS]",
                       description="display the local agent process version",
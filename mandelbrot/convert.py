@@ -15,13 +15,17 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-import collections, time
+import collections, time, datetime
+from dateutil.tz import tzutc
 
 from mandelbrot.ref import parse_proberef
 
 def millis2ctime(millis):
     return time.ctime(millis / 1000.0)
 
+def millis2datetime(millis):
+    return datetime.datetime.fromtimestamp(millis / 1000.0, tzutc())
+
 def timedelta2seconds(td):
     return (float(td.microseconds) + (float(td.seconds) + float(td.days) * 24.0 * 3600.0) * 10**6) / 10**6
 
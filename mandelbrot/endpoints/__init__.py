@@ -16,6 +16,7 @@
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
 from zope.interface import Interface, implements
+from twisted.internet.defer import DeferredList, maybeDeferred
 
 class IEndpoint(Interface):
 
@@ -25,6 +26,9 @@ class IEndpoint(Interface):
     def send(self, message):
         ""
 
+    def send_batch(self, messages):
+        ""
+
     def register(self, uri, registration):
         ""
 
@@ -33,6 +37,9 @@ class IEndpoint(Interface):
 
     def unregister(self, uri):
         ""
+
+    def close(self):
+        ""
  
 class Endpoint(object):
     """
@@ -40,6 +47,21 @@ class Endpoint(object):
     def configure(self, endpoint, settings):
         pass
 
+    def send_batch(self, messages):
+        """
+        Send each message in `messages`, and return a Deferred which fires
+        with the list of messages which could not be delivered.  Endpoints
+        which can submit several messages in one request should override
+        this method.
+        """
+        defers = [maybeDeferred(self.send, message) for message in messages]
+        def on_complete(results):
+            return [message for message,(success,_) in zip(messages, results) if not success]
+        return DeferredList(defers, consumeErrors=True).addCallback(on_complete)
+
+    def close(self):
+        return None
+
 class EndpointError(Exception):
     """
     """
@@ -56,6 +78,10 @@ class RetryLater(EndpointError):
     """
     """
 
+class CircuitOpen(RetryLater):
+    """
+    """
+
 class BadRequest(EndpointError):
     """
     """
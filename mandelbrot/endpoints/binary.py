@@ -0,0 +1,169 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct, datetime
+from mandelbrot.endpoints.http import HTTPEndpoint
+from mandelbrot.message import StatusMessage, MetricsMessage
+from mandelbrot.http import StringProducer, datetime2millis
+from mandelbrot.loggers import getLogger
+
+logger = getLogger('mandelbrot.endpoints.binary')
+
+CONTENT_TYPE = 'application/x-mandelbrot-frames'
+
+MAGIC = 'MBF1'
+
+# frame types
+DEFINE_REF = 1
+DEFINE_NAME = 2
+STATUS = 3
+METRICS = 4
+
+HEALTH_CODES = {'healthy': 0, 'degraded': 1, 'failed': 2, 'unknown': 3}
+HEALTH_NAMES = dict([(code, health) for health,code in HEALTH_CODES.items()])
+
+_frame_header = struct.Struct('>BI')
+_define = struct.Struct('>H')
+_status = struct.Struct('>HBqi')
+_metrics = struct.Struct('>HqH')
+_metric = struct.Struct('>Hd')
+
+def _timestamp(timestamp):
+    if isinstance(timestamp, datetime.datetime):
+        return datetime2millis(timestamp)
+    return long(timestamp)
+
+def is_encodable(message):
+    """
+    Returns True if `message` can be encoded as frames.  Only status and
+    metrics messages whose metric values are all numbers can be encoded.
+    """
+    if type(message) is StatusMessage:
+        return message.health in HEALTH_CODES
+    if type(message) is MetricsMessage:
+        for value in message.metrics.values():
+            if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+                return False
+        return True
+    return False
+
+def encode_frames(messages):
+    """
+    Encode `messages` as a sequence of length-prefixed frames.  Each probe
+    ref and metric name is sent once in a DEFINE frame, and is referred to
+    by its integer id in the STATUS and METRICS frames which follow.
+    """
+    frames = [MAGIC]
+    refs = dict()
+    names = dict()
+    def frame(frametype, payload):
+        frames.append(_frame_header.pack(frametype, len(payload)))
+        frames.append(payload)
+    def define(table, frametype, value):
+        ident = table.get(value)
+        if ident is None:
+            ident = len(table)
+            table[value] = ident
+            frame(frametype, _define.pack(ident) + value.encode('utf-8'))
+        return ident
+    for message in messages:
+        refid = define(refs, DEFINE_REF, unicode(message.source))
+        if type(message) is StatusMessage:
+            if message.summary is None:
+                summary = ''
+                length = -1
+            else:
+                summary = unicode(message.summary).encode('utf-8')
+                length = len(summary)
+            frame(STATUS, _status.pack(refid, HEALTH_CODES[message.health],
+                _timestamp(message.timestamp), length) + summary)
+        elif type(message) is MetricsMessage:
+            values = list()
+            for name,value in message.metrics.items():
+                values.append(_metric.pack(define(names, DEFINE_NAME, unicode(name)), value))
+            frame(METRICS, _metrics.pack(refid, _timestamp(message.timestamp), len(values)) + ''.join(values))
+        else:
+            raise TypeError("message %s cannot be encoded as frames" % message.msgtype)
+    return ''.join(frames)
+
+def decode_frames(data):
+    """
+    Decode the frames in `data`, and return a list of messages in the form
+    returned by __dump__().
+    """
+    if data[:4] != MAGIC:
+        raise ValueError("data is not a frame sequence")
+    refs = dict()
+    names = dict()
+    messages = list()
+    offset = 4
+    while offset < len(data):
+        frametype,length = _frame_header.unpack_from(data, offset)
+        offset += _frame_header.size
+        payload = data[offset:offset + length]
+        if len(payload) != length:
+            raise ValueError("frame is truncated")
+        offset += length
+        if frametype == DEFINE_REF or frametype == DEFINE_NAME:
+            ident, = _define.unpack_from(payload)
+            value = payload[_define.size:].decode('utf-8')
+            table = refs if frametype == DEFINE_REF else names
+            table[ident] = value
+        elif frametype == STATUS:
+            refid,health,timestamp,summarylen = _status.unpack_from(payload)
+            summary = None if summarylen < 0 else payload[_status.size:].decode('utf-8')
+            messages.append({'messageType': 'io.mandelbrot.message.StatusMessage', 'payload': {'probeRef': refs[refid],
+                'health': HEALTH_NAMES[health], 'summary': summary, 'timestamp': timestamp}})
+        elif frametype == METRICS:
+            refid,timestamp,count = _metrics.unpack_from(payload)
+            metrics = dict()
+            for i in range(count):
+                nameid,value = _metric.unpack_from(payload, _metrics.size + i * _metric.size)
+                metrics[names[nameid]] = value
+            messages.append({'messageType': 'io.mandelbrot.message.MetricsMessage', 'payload': {'probeRef': refs[refid],
+                'metrics': metrics, 'timestamp': timestamp}})
+        else:
+            raise ValueError("unknown frame type %i" % frametype)
+    return messages
+
+class BinaryEndpoint(HTTPEndpoint):
+    """
+    Submits messages to the supervisor as compact binary frames rather than
+    JSON.  Registration uses JSON as with HTTPEndpoint, and messages which
+    cannot be encoded as frames are sent as JSON.  If the supervisor does
+    not accept frames then the endpoint falls back to JSON entirely.
+    """
+    def __init__(self):
+        HTTPEndpoint.__init__(self)
+        self.binary = True
+
+    def _submit(self, url, data):
+        messages = data if isinstance(data, list) else [data]
+        if not self.binary or not all([is_encodable(message) for message in messages]):
+            return HTTPEndpoint._submit(self, url, data)
+        headers = self.headers
+        headers.setRawHeaders('Content-Type', [CONTENT_TYPE])
+        defer = self.agent.request('POST', url, headers, StringProducer(encode_frames(messages)))
+        def on_response(response):
+            if response.code != 415:
+                return response
+            logger.info("server does not accept %s, falling back to JSON", CONTENT_TYPE)
+            self.binary = False
+            def resubmit(body):
+                return HTTPEndpoint._submit(self, url, data)
+            return self.http.read_body(response).addCallback(resubmit)
+        return defer.addCallback(on_response)
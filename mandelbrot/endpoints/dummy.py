@@ -30,6 +30,11 @@ class DummyEndpoint(Endpoint):
 
     def send(self, message):
         logger.debug("received message: %s", message)
+        return succeed(None)
+
+    def send_batch(self, messages):
+        logger.debug("received batch of %i messages", len(messages))
+        return succeed(list())
 
     def register(self, uri, registration):
         logger.debug("registering uri %s using registration:\n%s", uri, registration)
@@ -15,56 +15,244 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-import urlparse, pprint
-from twisted.internet.defer import Deferred
+import urlparse, pprint, collections, datetime
+from twisted.internet.defer import Deferred, DeferredSemaphore, DeferredList, fail
+from twisted.internet.task import deferLater
 from twisted.python.failure import Failure
 from twisted.web.http_headers import Headers
 from mandelbrot.endpoints import *
 from mandelbrot.message import ProbeMessage
-from mandelbrot.http import http, as_json
+from pesky.settings import ConfigureError
+from mandelbrot.endpoints.retry import CircuitBreaker, backoff_delay, parse_retry_after
+from mandelbrot.http import http, as_json, from_json, COMPRESSION_WBITS
+from mandelbrot.convert import timedelta2seconds
+from mandelbrot.instrumentation import instruments
+from mandelbrot.metric import MetricUnit
 from mandelbrot.loggers import getLogger
 from mandelbrot import versionstring
 
 logger = getLogger('mandelbrot.endpoints.http')
 
+http_requests = instruments.counter("http_requests", MetricUnit.OPS)
+http_errors = instruments.counter("http_errors", MetricUnit.OPS)
+
 class HTTPEndpoint(Endpoint):
     """
+    Submits messages to the supervisor over HTTP.  By default requests use
+    the shared connection pool; set `http` to another Http instance before
+    configuring the endpoint to give it a pool of its own.
     """
     def __init__(self):
         Endpoint.__init__(self)
+        self.http = http
         self._agent = None
         self.endpoint = None
+        self.limiter = None
+        self.compression = None
+        self.compressionthreshold = 0
+        self.compressionlevel = 6
+        self.breaker = None
+        self.retryattempts = 1
+        self.retryinitialdelay = 1.0
+        self.retrymaxdelay = 30.0
 
     def configure(self, endpoint, section):
         self.endpoint = endpoint
+        self.http.configure(section)
+        # limit the number of concurrent message submissions to this endpoint.
+        # 'max connections per host' is the old name of the setting
+        maxsubmissions = section.get_int("max concurrent submissions",
+            section.get_int("max connections per host", 4))
+        if maxsubmissions < 1:
+            raise ConfigureError("max concurrent submissions must be greater than 0")
+        self.limiter = DeferredSemaphore(maxsubmissions)
+        # configure request body compression
+        self.compression = section.get_str("compression", "none")
+        if self.compression == "none":
+            self.compression = None
+        elif self.compression not in COMPRESSION_WBITS:
+            raise ConfigureError("unknown compression %s" % self.compression)
+        self.compressionthreshold = section.get_size("compression threshold", 1024)
+        self.compressionlevel = section.get_int("compression level", 6)
+        if self.compressionlevel < 0 or self.compressionlevel > 9:
+            raise ConfigureError("compression level must be between 0 and 9")
+        # configure retries and the circuit breaker
+        self.retryattempts = section.get_int("retry attempts", 3)
+        if self.retryattempts < 1:
+            raise ConfigureError("retry attempts must be greater than 0")
+        self.retryinitialdelay = timedelta2seconds(section.get_timedelta("retry initial delay", datetime.timedelta(seconds=1)))
+        self.retrymaxdelay = timedelta2seconds(section.get_timedelta("retry max delay", datetime.timedelta(seconds=30)))
+        threshold = section.get_int("circuit breaker threshold", 5)
+        if threshold < 1:
+            raise ConfigureError("circuit breaker threshold must be greater than 0")
+        resettimeout = section.get_timedelta("circuit breaker reset timeout", datetime.timedelta(seconds=30))
+        self.breaker = CircuitBreaker(endpoint, threshold, timedelta2seconds(resettimeout))
         Endpoint.configure(self, endpoint, section)
 
     @property
     def agent(self):
         if self._agent is None:
-            self._agent = http.agent()
+            self._agent = self.http.agent()
         return self._agent
 
     @property
     def headers(self):
         return Headers({'Content-Type': ['application/json'], 'User-Agent': ['mandelbrot-agent/' + versionstring()]})
 
+    def _submit(self, url, data):
+        """
+        POST `data` to `url`, compressing the entity if compression is
+        enabled.  If the server does not accept the content encoding then
+        compression is disabled and the entity is sent again uncompressed.
+        """
+        entity = as_json(data, self.compression, self.compressionthreshold, self.compressionlevel)
+        headers = self.headers
+        if entity.encoding is not None:
+            headers.addRawHeader('Content-Encoding', entity.encoding)
+        defer = self.agent.request('POST', url, headers, entity)
+        def on_response(response):
+            if response.code != 415 or entity.encoding is None:
+                return response
+            logger.info("server does not accept %s encoded entities, disabling compression", entity.encoding)
+            self.compression = None
+            def resubmit(body):
+                return self.agent.request('POST', url, self.headers, as_json(data))
+            return self.http.read_body(response).addCallback(resubmit)
+        return defer.addCallback(on_response)
+
+    def _post(self, url, data, attempt=0):
+        """
+        POST `data` to `url`, retrying with backoff after a connection
+        failure, a 5xx response, or a 429 response.  Returns a Deferred
+        which fires with the last response, or errbacks with the last
+        failure.  If the circuit breaker is open, the Deferred errbacks
+        with CircuitOpen without making a request.
+        """
+        if self.breaker is not None and not self.breaker.allow():
+            return fail(CircuitOpen("circuit breaker for %s is open" % self.endpoint))
+        from twisted.internet import reactor
+        defer = self.limiter.run(self._submit, url, data)
+        http_requests.increment()
+        def on_response(response):
+            if response.code >= 400:
+                http_errors.increment()
+            if response.code < 500 and response.code != 429:
+                if self.breaker is not None:
+                    self.breaker.success()
+                return response
+            if self.breaker is not None:
+                self.breaker.failure()
+            if attempt + 1 >= self.retryattempts:
+                return response
+            delay = parse_retry_after(response.headers)
+            if delay is None:
+                delay = backoff_delay(attempt, self.retryinitialdelay, self.retrymaxdelay)
+            delay = min(delay, self.retrymaxdelay)
+            logger.debug("server returned %i %s, retrying in %.1f seconds", response.code, response.phrase, delay)
+            def retry(body):
+                return deferLater(reactor, delay, self._post, url, data, attempt + 1)
+            return self.http.read_body(response).addCallback(retry)
+        def on_failure(failure):
+            http_errors.increment()
+            if self.breaker is not None:
+                self.breaker.failure()
+            if attempt + 1 >= self.retryattempts:
+                return failure
+            delay = backoff_delay(attempt, self.retryinitialdelay, self.retrymaxdelay)
+            logger.debug("request failed: %s, retrying in %.1f seconds", failure.getErrorMessage(), delay)
+            return deferLater(reactor, delay, self._post, url, data, attempt + 1)
+        return defer.addCallbacks(on_response, on_failure)
+
     def send(self, message):
+        """
+        Submit `message`, retrying transient failures.  Returns a Deferred
+        which fires once the server has accepted the message, or errbacks
+        if the message could not be delivered and may be retried later.
+        Messages which the server refuses with a 4xx response are logged
+        and dropped.
+        """
         if not isinstance(message, ProbeMessage):
             raise TypeError("message must be a ProbeMessage")
         uri = str(message.source.uri)
         url = urlparse.urljoin(self.endpoint, 'objects/systems/' + uri + '/actions/submit')
-        defer = self.agent.request('POST', url, self.headers, as_json(message))
+        defer = self._post(url, message)
         logger.debug("sending message to %s", url)
         def on_response(response):
-            if response.code != 200:
+            if response.code in (200, 202):
+                return None
+            def read_failure(body):
+                logger.debug("HTTP response entity was:\n----\n" + body + "\n----")
+                if response.code >= 500 or response.code == 429:
+                    raise RetryLater("server returned %i %s" % (response.code, response.phrase))
                 logger.debug("message was dropped by server: %i %s", response.code, response.phrase)
-                def read_failure(body):
-                    logger.debug("HTTP response entity was:\n----\n" + body + "\n----")
-                http.read_body(response).addCallback(read_failure)
+            return self.http.read_body(response).addCallback(read_failure)
+        defer.addCallback(on_response)
+        return defer
+
+    def send_batch(self, messages):
+        """
+        Submit `messages` using one request per system, with the messages
+        for each system sent as a JSON array.  Returns a Deferred which
+        fires with the list of messages which could not be delivered and
+        may be retried later.
+
+        If the server accepts only some of the messages, it responds with
+        207 and a JSON array holding a result object for each message, in
+        the same order as the submitted array.  Messages the server refuses
+        with a 4xx status are logged and dropped.
+        """
+        batches = collections.OrderedDict()
+        for message in messages:
+            if not isinstance(message, ProbeMessage):
+                raise TypeError("message must be a ProbeMessage")
+            batches.setdefault(str(message.source.uri), list()).append(message)
+        defers = list()
+        for uri,batch in batches.items():
+            defers.append(self._submit_batch(uri, batch))
+        def on_complete(results):
+            undelivered = list()
+            for batch,(success,result) in zip(batches.values(), results):
+                if success:
+                    undelivered.extend(result)
+                else:
+                    logger.debug("failed to send batch: %s", result.getErrorMessage())
+                    undelivered.extend(batch)
+            return undelivered
+        return DeferredList(defers, consumeErrors=True).addCallback(on_complete)
+
+    def _submit_batch(self, uri, batch):
+        url = urlparse.urljoin(self.endpoint, 'objects/systems/' + uri + '/actions/submit')
+        defer = self._post(url, batch)
+        logger.debug("sending batch of %i messages to %s", len(batch), url)
+        def on_response(response):
+            if response.code in (200, 202):
+                return list()
+            if response.code != 207:
+                if response.code >= 500 or response.code == 429:
+                    logger.debug("server failed to accept batch of %i messages: %i %s",
+                        len(batch), response.code, response.phrase)
+                    return batch
+                logger.debug("batch of %i messages was dropped by server: %i %s",
+                    len(batch), response.code, response.phrase)
+                return list()
+            def read_results(body):
+                results = from_json(body)
+                undelivered = list()
+                for message,result in zip(batch, results):
+                    status = result.get('status', 200)
+                    if status >= 500:
+                        undelivered.append(message)
+                    elif status < 200 or status > 299:
+                        logger.debug("message was dropped by server: %i %s", status, result.get('description', ''))
+                # any messages without a result are treated as undelivered
+                undelivered.extend(batch[len(results):])
+                return undelivered
+            return self.http.read_body(response).addCallback(read_results)
         def on_failure(failure):
-            logger.debug("failed to send message: %s", failure.getErrorMessage())
+            logger.debug("failed to send batch: %s", failure.getErrorMessage())
+            return batch
         defer.addCallbacks(on_response, on_failure)
+        return defer
 
     def register(self, uri, registration):
         """
@@ -89,7 +277,7 @@ class HTTPEndpoint(Endpoint):
                     def read_failure(body):
                         logger.debug("HTTP response entity was:\n----\n" + body + "\n----")
                         result.errback(EndpointError("registration encountered a fatal error"))
-                    http.read_body(response).addCallback(read_failure)
+                    self.http.read_body(response).addCallback(read_failure)
         url = urlparse.urljoin(self.endpoint, 'objects/systems')
         logger.info("registering system %s", uri)
         logger.debug("POST %s", url)
@@ -120,7 +308,7 @@ class HTTPEndpoint(Endpoint):
                     def read_failure(body):
                         logger.debug("HTTP response entity was:\n----\n" + body + "\n----")
                         result.errback(EndpointError("registration encountered a fatal error"))
-                    http.read_body(response).addCallback(read_failure)
+                    self.http.read_body(response).addCallback(read_failure)
         url = urlparse.urljoin(self.endpoint, 'objects/systems/' + uri)
         logger.info("updating system %s", uri)
         logger.debug("PUT %s", url)
@@ -130,3 +318,6 @@ class HTTPEndpoint(Endpoint):
 
     def unregister(self, uri):
         raise NotImplementedError()
+
+    def close(self):
+        return self.http.close()
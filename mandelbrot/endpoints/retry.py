@@ -0,0 +1,90 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+from mandelbrot.loggers import getLogger
+
+logger = getLogger('mandelbrot.endpoints.retry')
+
+def backoff_delay(attempt, initialdelay, maxdelay):
+    """
+    Return the number of seconds to wait before retrying after `attempt`
+    failed attempts, using exponential backoff with full jitter.
+    """
+    return random.uniform(0.0, min(maxdelay, initialdelay * (2 ** attempt)))
+
+def parse_retry_after(headers):
+    """
+    Return the number of seconds in the Retry-After header of the response
+    `headers`, or None if the header is missing or is not a number of
+    seconds.
+    """
+    values = headers.getRawHeaders('Retry-After')
+    if not values:
+        return None
+    try:
+        return max(0.0, float(values[0]))
+    except ValueError:
+        return None
+
+class CircuitBreaker(object):
+    """
+    Stops requests to a server which keeps failing.  After `threshold`
+    consecutive failures the breaker opens and allow() returns False, so
+    requests fail without using a connection.  After `resettimeout` seconds
+    a single trial request is allowed; if it succeeds the breaker closes,
+    otherwise it opens again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, threshold=5, resettimeout=30.0):
+        self.name = name
+        self.threshold = threshold
+        self.resettimeout = resettimeout
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self._openeduntil = None
+
+    def allow(self):
+        if self.state == CircuitBreaker.CLOSED:
+            return True
+        if self.state == CircuitBreaker.OPEN:
+            from twisted.internet import reactor
+            if reactor.seconds() < self._openeduntil:
+                return False
+            logger.debug("circuit breaker for %s is half-open, allowing a trial request", self.name)
+            self.state = CircuitBreaker.HALF_OPEN
+            return True
+        # only the trial request is allowed while half-open
+        return False
+
+    def success(self):
+        if self.state != CircuitBreaker.CLOSED:
+            logger.info("circuit breaker for %s is closed", self.name)
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.threshold:
+            from twisted.internet import reactor
+            if self.state != CircuitBreaker.OPEN:
+                logger.warning("circuit breaker for %s is open after %i failures", self.name, self.failures)
+            self.state = CircuitBreaker.OPEN
+            self._openeduntil = reactor.seconds() + self.resettimeout
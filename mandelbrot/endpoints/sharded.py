@@ -0,0 +1,233 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect, hashlib, struct, datetime, collections
+from twisted.internet.defer import DeferredList, maybeDeferred
+from twisted.internet.error import ConnectError, ConnectionLost, DNSLookupError, TimeoutError
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseFailed, RequestTransmissionFailed
+from pesky.settings import ConfigureError
+from mandelbrot.endpoints import Endpoint, RetryLater
+from mandelbrot.endpoints.http import HTTPEndpoint
+from mandelbrot.message import ProbeMessage
+from mandelbrot.http import Http
+from mandelbrot.convert import timedelta2seconds
+from mandelbrot.loggers import getLogger
+
+logger = getLogger('mandelbrot.endpoints.sharded')
+
+# errors which mean the node could not be reached or is overloaded
+TRANSPORT_ERRORS = (RetryLater, ConnectError, ConnectionLost, DNSLookupError, TimeoutError,
+                    ResponseFailed, RequestTransmissionFailed)
+
+class HashRing(object):
+    """
+    Consistent hash ring.  Each node is placed on the ring `replicas` times,
+    so that keys are spread evenly, and adding or removing a node only moves
+    the keys which hash next to it.
+    """
+    def __init__(self, nodes, replicas=64):
+        self.nodes = list(nodes)
+        points = list()
+        for node in self.nodes:
+            for i in range(replicas):
+                points.append((self._hash("%s-%i" % (node, i)), node))
+        points.sort()
+        self._hashes = [h for h,_ in points]
+        self._nodes = [node for _,node in points]
+
+    def _hash(self, key):
+        return struct.unpack('>Q', hashlib.md5(key).digest()[:8])[0]
+
+    def iter_nodes(self, key):
+        """
+        Iterate over each distinct node in ring order, starting with the
+        node which owns `key`.
+        """
+        if len(self._nodes) == 0:
+            return
+        start = bisect.bisect(self._hashes, self._hash(key))
+        seen = set()
+        for i in range(len(self._nodes)):
+            node = self._nodes[(start + i) % len(self._nodes)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+class SupervisorNode(object):
+    """
+    A supervisor node, with its own endpoint and connection pool.  When a
+    request to the node fails, the node is marked down for `retryinterval`
+    seconds.
+    """
+    def __init__(self, url, endpoint, retryinterval):
+        self.url = url
+        self.endpoint = endpoint
+        self.retryinterval = retryinterval
+        self.failures = 0
+        self.downuntil = None
+
+    def is_available(self):
+        if self.downuntil is None:
+            return True
+        from twisted.internet import reactor
+        return reactor.seconds() >= self.downuntil
+
+    def mark_up(self):
+        if self.downuntil is not None:
+            logger.info("supervisor node %s is available", self.url)
+        self.failures = 0
+        self.downuntil = None
+
+    def mark_down(self, reason):
+        from twisted.internet import reactor
+        if self.downuntil is None:
+            logger.warning("supervisor node %s is unavailable: %s", self.url, reason)
+        self.failures += 1
+        self.downuntil = reactor.seconds() + self.retryinterval
+
+class ShardedEndpoint(Endpoint):
+    """
+    Shards systems across several supervisor nodes using a consistent hash of
+    the system URI, so every message for a system goes to the same node.  If
+    the node for a system fails, requests fail over to the next available
+    node on the ring until the node recovers.
+    """
+    def __init__(self):
+        Endpoint.__init__(self)
+        self.nodes = collections.OrderedDict()
+        self.ring = None
+
+    def configure(self, endpoint, section):
+        urls = section.get_list("supervisor urls", [endpoint])
+        if len(urls) == 0:
+            raise ConfigureError("supervisor urls must not be empty")
+        retryinterval = section.get_timedelta("node retry interval", datetime.timedelta(seconds=30))
+        replicas = section.get_int("hash replicas", 64)
+        if replicas < 1:
+            raise ConfigureError("hash replicas must be greater than 0")
+        for url in urls:
+            if not url.endswith('/'):
+                url = url + '/'
+            node = HTTPEndpoint()
+            node.http = Http()
+            node.configure(url, section)
+            self.nodes[url] = SupervisorNode(url, node, timedelta2seconds(retryinterval))
+        self.ring = HashRing(self.nodes.keys(), replicas)
+        logger.debug("sharding systems across %i supervisor nodes", len(self.nodes))
+
+    def iter_nodes(self, uri):
+        """
+        Iterate over the nodes for the system `uri` in the order they should
+        be tried.  Available nodes are tried first, in ring order, followed
+        by unavailable nodes in case they have recovered.
+        """
+        nodes = [self.nodes[url] for url in self.ring.iter_nodes(str(uri))]
+        return [n for n in nodes if n.is_available()] + [n for n in nodes if not n.is_available()]
+
+    def _failover(self, uri, request, is_failure):
+        """
+        Call `request` with each node for `uri` in turn, until the result
+        of a request is not a failure according to `is_failure`.
+        """
+        nodes = self.iter_nodes(uri)
+        def attempt(index):
+            node = nodes[index]
+            defer = maybeDeferred(request, node.endpoint)
+            def on_result(result):
+                reason = is_failure(result)
+                if reason is None:
+                    node.mark_up()
+                    return result
+                node.mark_down(reason)
+                if index + 1 < len(nodes):
+                    return attempt(index + 1)
+                return result
+            return defer.addBoth(on_result)
+        return attempt(0)
+
+    def send(self, message):
+        if not isinstance(message, ProbeMessage):
+            raise TypeError("message must be a ProbeMessage")
+        return self._failover(message.source.uri, lambda node: node.send(message), self._is_transport_failure)
+
+    def send_batch(self, messages):
+        """
+        Submit `messages`, grouped by system, to the node for each system.
+        Messages which a node fails to deliver are retried on the next node.
+        Returns a Deferred which fires with the list of messages which could
+        not be delivered to any node.
+        """
+        batches = collections.OrderedDict()
+        for message in messages:
+            if not isinstance(message, ProbeMessage):
+                raise TypeError("message must be a ProbeMessage")
+            batches.setdefault(str(message.source.uri), list()).append(message)
+        defers = list()
+        for uri,batch in batches.items():
+            defers.append(self._send_batch(uri, batch))
+        def on_complete(results):
+            undelivered = list()
+            for batch,(success,result) in zip(batches.values(), results):
+                if success:
+                    undelivered.extend(result)
+                else:
+                    logger.debug("failed to send batch: %s", result.getErrorMessage())
+                    undelivered.extend(batch)
+            return undelivered
+        return DeferredList(defers, consumeErrors=True).addCallback(on_complete)
+
+    def _send_batch(self, uri, batch):
+        pending = [batch]
+        def request(node):
+            return node.send_batch(pending[0])
+        def is_failure(undelivered):
+            if isinstance(undelivered, Failure):
+                return undelivered.getErrorMessage()
+            if len(undelivered) == 0:
+                return None
+            pending[0] = undelivered
+            return "failed to deliver %i messages" % len(undelivered)
+        def on_failure(failure):
+            # every node failed, so whatever was still pending is undelivered
+            logger.debug("failed to send batch: %s", failure.getErrorMessage())
+            return pending[0]
+        return self._failover(uri, request, is_failure).addErrback(on_failure)
+
+    def _is_transport_failure(self, result):
+        # only fail over if the node could not be reached or is overloaded;
+        # any other error is the answer for the system wherever it is sent
+        if not isinstance(result, Failure):
+            return None
+        if not result.check(*TRANSPORT_ERRORS):
+            return None
+        return result.getErrorMessage()
+
+    def register(self, uri, registration):
+        return self._failover(uri, lambda node: node.register(uri, registration), self._is_transport_failure)
+
+    def update(self, uri, registration):
+        return self._failover(uri, lambda node: node.update(uri, registration), self._is_transport_failure)
+
+    def unregister(self, uri):
+        return self._failover(uri, lambda node: node.unregister(uri), self._is_transport_failure)
+
+    def close(self):
+        defers = [maybeDeferred(node.endpoint.close) for node in self.nodes.values()]
+        return DeferredList(defers, consumeErrors=True)
@@ -15,10 +15,13 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-import json, datetime, time, pprint
+import json, datetime, calendar, weakref, pprint, zlib
 from zope.interface import implements
-from twisted.internet.defer import succeed
-from twisted.web.iweb import IBodyProducer
+from twisted.internet import task
+from twisted.internet.defer import Deferred, succeed
+from twisted.web.iweb import IBodyProducer, UNKNOWN_LENGTH
+from mandelbrot.message import ProbeMessage, StatusMessage, MetricsMessage
+from mandelbrot.convert import timedelta2seconds
 from mandelbrot.loggers import getLogger
 
 logger = getLogger('mandelbrot.http')
@@ -32,21 +35,81 @@ class JSONEncoder(json.JSONEncoder):
     """
     def default(self, o):
         if isinstance(o, datetime.datetime):
-            seconds = time.mktime(o.utctimetuple())
-            return long(seconds * 1000)
+            return datetime2millis(o)
         if isinstance(o, datetime.timedelta):
             seconds = (float(o.microseconds) + (float(o.seconds) + float(o.days) * 24.0 * 3600.0) * 10**6) / 10**6
             return long(seconds * 1000)
         return json.JSONEncoder.default(self, o)
 
+def datetime2millis(dt):
+    """
+    Convert the datetime `dt` to milliseconds since the epoch.  A naive
+    datetime is assumed to be in UTC.
+    """
+    return calendar.timegm(dt.utctimetuple()) * 1000L + dt.microsecond // 1000
+
 json_decoder = JSONDecoder()
 json_encoder = JSONEncoder()
 
-class JsonProducer(object):
+class MessageEncoder(object):
+    """
+    Encodes StatusMessages and MetricsMessages directly to JSON, without
+    building the intermediate dicts returned by __dump__().  The encoded
+    messageType and probeRef prefix is cached for each ProbeRef, so it is
+    encoded only once for each probe runner.  Any other message is encoded
+    from its __dump__().
+    """
+    def __init__(self):
+        self._prefixes = weakref.WeakKeyDictionary()
+
+    def _prefix(self, message):
+        prefixes = self._prefixes.get(message.source)
+        if prefixes is None:
+            prefixes = dict()
+            self._prefixes[message.source] = prefixes
+        prefix = prefixes.get(message.msgtype)
+        if prefix is None:
+            prefix = '{"messageType": %s, "payload": {"probeRef": %s' % (
+                json_encoder.encode(message.msgtype), json_encoder.encode(str(message.source)))
+            prefixes[message.msgtype] = prefix
+        return prefix
+
+    def _timestamp(self, timestamp):
+        if isinstance(timestamp, datetime.datetime):
+            return str(datetime2millis(timestamp))
+        return json_encoder.encode(timestamp)
+
+    def encode(self, message):
+        if type(message) is StatusMessage:
+            return ''.join((self._prefix(message),
+                ', "health": ', json_encoder.encode(message.health),
+                ', "summary": ', json_encoder.encode(message.summary),
+                ', "timestamp": ', self._timestamp(message.timestamp), '}}'))
+        if type(message) is MetricsMessage:
+            return ''.join((self._prefix(message),
+                ', "metrics": ', json_encoder.encode(message.metrics),
+                ', "timestamp": ', self._timestamp(message.timestamp), '}}'))
+        return json_encoder.encode(message.__dump__())
+
+    def iterencode(self, messages):
+        """
+        Encode the list of `messages` as a JSON array, yielding the array
+        in chunks.
+        """
+        yield '['
+        for i,message in enumerate(messages):
+            if i > 0:
+                yield ', '
+            yield self.encode(message)
+        yield ']'
+
+message_encoder = MessageEncoder()
+
+class StringProducer(object):
     implements(IBodyProducer)
-    def __init__(self, data):
-        #logger.debug("entity:\n%s", pprint.pformat(data))
-        self.entity = json_encoder.encode(data)
+    encoding = None
+    def __init__(self, entity):
+        self.entity = entity
         self.length = len(self.entity)
     def startProducing(self, consumer):
         consumer.write(self.entity)
@@ -56,12 +119,98 @@ class JsonProducer(object):
     def stopProducing(self):
         pass
 
-def as_json(data):
+class JsonProducer(StringProducer):
+    def __init__(self, data):
+        #logger.debug("entity:\n%s", pprint.pformat(data))
+        StringProducer.__init__(self, json_encoder.encode(data))
+
+# wbits for each supported content encoding; deflate is the zlib format
+COMPRESSION_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+class CompressedJsonProducer(object):
     """
+    Compresses the JSON entity as it is encoded.  `prefix` holds the chunks
+    of `chunks` which have already been encoded.  Compressed output is
+    written to the consumer in blocks of at most `blocksize` bytes, one
+    block per iteration of `cooperator`, and production stops while the
+    consumer is paused, so neither the whole JSON entity nor the whole
+    compressed entity is held in memory at once.
     """
-    if hasattr(data, '__dump__'):
-        return JsonProducer(data.__dump__())
-    return JsonProducer(data)
+    implements(IBodyProducer)
+    length = UNKNOWN_LENGTH
+    blocksize = 64 * 1024
+    def __init__(self, prefix, chunks, encoding, level, cooperator=task):
+        self.encoding = encoding
+        self._prefix = prefix
+        self._chunks = chunks
+        self._level = level
+        self._cooperate = cooperator.cooperate
+        self._task = None
+    def _produce(self):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, COMPRESSION_WBITS[self.encoding])
+        block = list()
+        blocklen = 0
+        for chunks in (self._prefix, self._chunks):
+            for chunk in chunks:
+                data = compressor.compress(chunk)
+                if len(data) > 0:
+                    block.append(data)
+                    blocklen += len(data)
+                    if blocklen >= self.blocksize:
+                        yield ''.join(block)
+                        block = list()
+                        blocklen = 0
+        block.append(compressor.flush())
+        yield ''.join(block)
+    def _writeloop(self, consumer):
+        for block in self._produce():
+            consumer.write(block)
+            yield None
+    def startProducing(self, consumer):
+        self._task = self._cooperate(self._writeloop(consumer))
+        def on_stopped(failure):
+            # the request was abandoned, so the Deferred never fires
+            failure.trap(task.TaskStopped)
+            return Deferred()
+        return self._task.whenDone().addCallbacks(lambda _: None, on_stopped)
+    def pauseProducing(self):
+        self._task.pause()
+    def resumeProducing(self):
+        self._task.resume()
+    def stopProducing(self):
+        self._task.stop()
+
+def as_json(data, compression=None, threshold=0, level=6):
+    """
+    Return a body producer for `data` encoded as JSON.  ProbeMessages and
+    lists of ProbeMessages are encoded using the message encoder.  If `compression` is
+    'gzip' or 'deflate' and the encoded entity is at least `threshold`
+    bytes, then the entity is compressed as it is produced, and the
+    producer's `encoding` attribute names the content encoding.
+    """
+    if isinstance(data, ProbeMessage):
+        chunks = iter([message_encoder.encode(data)])
+    elif isinstance(data, list) and len(data) > 0 and all([isinstance(m, ProbeMessage) for m in data]):
+        chunks = message_encoder.iterencode(data)
+    else:
+        if hasattr(data, '__dump__'):
+            data = data.__dump__()
+        if compression is None:
+            return JsonProducer(data)
+        chunks = json_encoder.iterencode(data)
+    if compression is None:
+        return StringProducer(''.join(chunks))
+    if compression not in COMPRESSION_WBITS:
+        raise ValueError("unknown compression %s" % compression)
+    # encode only as far as the threshold before deciding whether to compress
+    prefix = list()
+    size = 0
+    for chunk in chunks:
+        prefix.append(chunk)
+        size += len(chunk)
+        if size >= threshold:
+            return CompressedJsonProducer(prefix, chunks, compression, level)
+    return StringProducer(''.join(prefix))
 
 def from_json(data, proto=None):
     """
@@ -75,17 +224,49 @@ def from_json(data, proto=None):
 
 class Http(object):
     """
+    Creates HTTP agents which share a single connection pool.  Unless
+    persistent connections are disabled, connections are kept alive and
+    reused across requests to the same host.
     """
     def __init__(self):
         self._pool = None
+        self.persistent = True
+        self.cachedconnections = 2
+        self.idletimeout = 240.0
+
+    def configure(self, section):
+        """
+        Configure the connection pool from the specified settings `section`.
+        Must be called before the pool is first used.
+        """
+        self.persistent = section.get_bool("http persistent connections", self.persistent)
+        self.cachedconnections = section.get_int("http cached connections per host", self.cachedconnections)
+        idletimeout = section.get_timedelta("http idle timeout", None)
+        if idletimeout is not None:
+            self.idletimeout = timedelta2seconds(idletimeout)
+        if self._pool is not None:
+            self._pool.maxPersistentPerHost = self.cachedconnections
+            self._pool.cachedConnectionTimeout = self.idletimeout
 
     @property
     def pool(self):
-        return None
         from twisted.web.client import HTTPConnectionPool
         if self._pool is None:
-            self._pool = HTTPConnectionPool(self.reactor)
-        #return self._pool
+            self._pool = HTTPConnectionPool(self.reactor, persistent=self.persistent)
+            self._pool.maxPersistentPerHost = self.cachedconnections
+            self._pool.cachedConnectionTimeout = self.idletimeout
+        return self._pool
+
+    def close(self):
+        """
+        Close all cached connections.  Returns a Deferred which fires when
+        the connections are closed.
+        """
+        if self._pool is None:
+            return succeed(None)
+        pool = self._pool
+        self._pool = None
+        return pool.closeCachedConnections()
 
     @property
     def reactor(self):
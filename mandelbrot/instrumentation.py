@@ -0,0 +1,146 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect, threading, collections
+
+# bucket upper bounds in seconds, for histograms of durations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Counter(object):
+    """
+    A value which only increases.
+    """
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.value = 0
+
+    def increment(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return {'type': 'counter', 'unit': self.unit, 'value': self.value}
+
+class Gauge(object):
+    """
+    A value which is either set directly, or read from `function` each time
+    the gauge is read.
+    """
+    def __init__(self, name, unit, function=None):
+        self.name = name
+        self.unit = unit
+        self.function = function
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        if self.function is not None:
+            return self.function()
+        return self._value
+
+    def snapshot(self):
+        return {'type': 'gauge', 'unit': self.unit, 'value': self.value}
+
+class Histogram(object):
+    """
+    Counts observations into fixed buckets, where `buckets` is the sorted
+    list of bucket upper bounds.  Observations greater than the last bound
+    are counted in an overflow bucket.
+    """
+    def __init__(self, name, unit, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.unit = unit
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        Return the upper bound of the bucket holding the `p`th percentile
+        observation, or the maximum if it is in the overflow bucket.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = self.count * p / 100.0
+        seen = 0
+        for bound,count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {'type': 'histogram', 'unit': self.unit, 'count': self.count, 'sum': self.sum,
+                'max': self.max, 'buckets': list(self.buckets), 'counts': list(self.counts)}
+
+class Registry(object):
+    """
+    Holds the instruments which the agent updates as it runs.  Instruments
+    are updated on the reactor thread without locking, so reads from other
+    threads may be slightly stale.
+    """
+    def __init__(self):
+        self._instruments = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, name, cls, *args):
+        with self._lock:
+            instrument = self._instruments.get(name)
+            if instrument is None:
+                instrument = cls(name, *args)
+                self._instruments[name] = instrument
+            elif not isinstance(instrument, cls):
+                raise TypeError("instrument %s is not a %s" % (name, cls.__name__))
+            return instrument
+
+    def counter(self, name, unit):
+        return self._get(name, Counter, unit)
+
+    def gauge(self, name, unit, function=None):
+        gauge = self._get(name, Gauge, unit)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, unit, buckets=LATENCY_BUCKETS):
+        return self._get(name, Histogram, unit, buckets)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(self._instruments.values())
+
+    def snapshot(self):
+        """
+        Return a dict mapping each instrument name to a dict describing its
+        current value.
+        """
+        return dict([(instrument.name, instrument.snapshot()) for instrument in self])
+
+instruments = Registry()
@@ -15,8 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-import os, sys, datetime, traceback, types
-from Queue import Queue
+import os, sys, time, json, atexit, datetime, threading, traceback, types, collections
 from functools import wraps
 from twisted.python.log import startLoggingWithObserver, msg, err, ILogObserver
 from twisted.python.util import untilConcludes
@@ -44,19 +43,34 @@ def _levelToName(level):
         return 'TRACE'
     return 'UNKNOWN'
 
+# the level of every logger when messages are discarded, below any real level
+_DISCARD = -1
+
+# the maximum number of records buffered before startLogging() is called
+MAX_BUFFERED_RECORDS = 10000
+
 _observer = None
-_records = Queue()
+_discarding = False
+_records = collections.deque()
+_recordsdropped = 0
 def _ObserverWrapper(record):
     """
     Upon first import of this module, configure logging to simply buffer
     log messages into the _records queue.  Once the application has configured
     logging using startLogging(), the queue is emptied and we simply forward
-    log messages to _observer.
+    log messages to _observer.  At most MAX_BUFFERED_RECORDS are buffered;
+    beyond that the oldest records are dropped and counted.
     """
     global _observer
     global _records
+    global _recordsdropped
+    if _discarding:
+        return
     if _observer == None:
-        _records.put(record)
+        if len(_records) >= MAX_BUFFERED_RECORDS:
+            _records.popleft()
+            _recordsdropped += 1
+        _records.append(record)
     else:
         try:
             ts = datetime.datetime.fromtimestamp(record['time'])
@@ -80,9 +94,17 @@ def _ObserverWrapper(record):
         _observer(record)
 startLoggingWithObserver(_ObserverWrapper, 0)
 
+LOG_FORMATS = ('text', 'json')
+
 class BaseHandler(object):
-    def __init__(self):
-        pass
+    """
+    Formats each record as a line of text, or if `format` is 'json' as a
+    JSON object on a single line, and passes it to handle().
+    """
+    def __init__(self, format='text'):
+        if format not in LOG_FORMATS:
+            raise ValueError("unknown log format %s" % format)
+        self.format = format
     def __call__(self, record):
         try:
             if 'failure' in record:
@@ -93,12 +115,24 @@ class BaseHandler(object):
                     if tb == None:
                         tb = sys.exc_info()[2]
                     record['why'] = ''.join(traceback.format_tb(tb))
-                self.handle("%(time)s %(levelname)s %(loggername)s: %(message)s\n%(why)s" % record)
+                if self.format == 'json':
+                    self.handle(self.as_json(record))
+                else:
+                    self.handle("%(time)s %(levelname)s %(loggername)s: %(message)s\n%(why)s" % record)
             else:
                 record['message'] = ' '.join(record['message'])
-                self.handle("%(time)s %(levelname)s %(loggername)s: %(message)s" % record)
+                if self.format == 'json':
+                    self.handle(self.as_json(record))
+                else:
+                    self.handle("%(time)s %(levelname)s %(loggername)s: %(message)s" % record)
         except Exception, e:
             print >> sys.stderr, "*** ERROR *** caught %s while logging error: record is %s" % (e, record)
+    def as_json(self, record):
+        entry = {'time': record['time'], 'level': record['levelname'],
+                 'logger': record['loggername'], 'message': record['message']}
+        if 'why' in record and record['why'] != None:
+            entry['traceback'] = record['why']
+        return json.dumps(entry)
     def handle(self, message):
         pass
     def close(self):
@@ -112,7 +146,8 @@ class StdoutHandler(BaseHandler):
         print message
 
 class FileHandler(BaseHandler):
-    def __init__(self, path):
+    def __init__(self, path, format='text'):
+        BaseHandler.__init__(self, format)
         self._f = open(path, 'a')
     def handle(self, message):
         untilConcludes(self._f.write, message + '\n')
@@ -120,6 +155,182 @@ class FileHandler(BaseHandler):
     def close(self):
         self._f.close()
 
+class AsyncFileHandler(BaseHandler):
+    """
+    Writes log messages to a file from a background thread, so the caller
+    never waits on the disk.  Messages are held in a buffer of at most
+    `buffersize` messages, which the writer thread flushes in a single
+    write every `flushinterval` seconds, or sooner once the buffer is half
+    full.  Messages which arrive while the buffer is full are dropped and
+    counted in `dropped`.  Once the file grows past `maxbytes` it is
+    rotated, keeping at most `backups` previous files.  Buffered messages
+    are written when the handler is closed.
+    """
+    def __init__(self, path, format='text', buffersize=8192, maxbytes=None, backups=5, flushinterval=1.0):
+        BaseHandler.__init__(self, format)
+        self.path = path
+        self.buffersize = buffersize
+        self.maxbytes = maxbytes
+        self.backups = backups
+        self.flushinterval = flushinterval
+        self.dropped = 0
+        self._buffer = collections.deque()
+        self._f = open(path, 'a')
+        self._size = self._f.tell()
+        self._closed = False
+        self._pid = None
+        self._thread = None
+        self._cond = None
+        self._startlock = threading.Lock()
+        atexit.register(self.close)
+
+    def _start(self):
+        # threads do not survive fork, so the writer is started on first use
+        # in each process; the agent forks after logging is started
+        self._pid = os.getpid()
+        self._cond = threading.Condition(threading.Lock())
+        self._thread = threading.Thread(target=self._run, name="log-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def handle(self, message):
+        if self._pid != os.getpid():
+            with self._startlock:
+                if self._pid != os.getpid():
+                    if self._closed:
+                        return
+                    self._start()
+        with self._cond:
+            if len(self._buffer) >= self.buffersize:
+                self.dropped += 1
+                return
+            self._buffer.append(message)
+            if len(self._buffer) == self.buffersize // 2:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._buffer) < self.buffersize // 2:
+                    self._cond.wait(self.flushinterval)
+                messages = self._buffer
+                self._buffer = collections.deque()
+                dropped = self.dropped
+                self.dropped = 0
+                closed = self._closed
+            if dropped > 0:
+                messages.append("*** log buffer was full, dropped %i messages" % dropped)
+            if len(messages) > 0:
+                self._write(messages)
+            if closed:
+                return
+
+    def _write(self, messages):
+        # any exception escaping here would kill the writer thread, so
+        # errors are reported and the messages are lost instead
+        try:
+            if self._f.closed:
+                self._reopen('a')
+            data = '\n'.join(messages) + '\n'
+            self._f.write(data)
+            self._f.flush()
+            self._size += len(data)
+            if self.maxbytes is not None and self._size >= self.maxbytes:
+                self._rotate()
+        except Exception, e:
+            print >> sys.stderr, "*** ERROR *** caught %s while writing log file %s" % (e, self.path)
+
+    def _reopen(self, mode):
+        self._f = open(self.path, mode)
+        self._size = self._f.tell()
+
+    def _rotate(self):
+        self._f.close()
+        # reopen even if a rename fails, so that later writes go to the
+        # current file rather than to the closed one
+        try:
+            if self.backups > 0:
+                for i in range(self.backups - 1, 0, -1):
+                    src = "%s.%i" % (self.path, i)
+                    if os.path.exists(src):
+                        os.rename(src, "%s.%i" % (self.path, i + 1))
+                os.rename(self.path, self.path + ".1")
+        finally:
+            self._reopen('a' if self.backups > 0 else 'w')
+
+    def close(self):
+        if self._closed:
+            return
+        if self._pid == os.getpid():
+            with self._cond:
+                self._closed = True
+                self._cond.notify()
+            self._thread.join()
+        else:
+            # the writer is not running in this process, so write directly
+            self._closed = True
+            if len(self._buffer) > 0:
+                self._write(self._buffer)
+        self._f.close()
+
+class RateLimiter(object):
+    """
+    Token bucket rate limiter keyed by call site.  Each call site may log
+    `burst` messages at once, refilled at `rate` messages per second, and
+    messages beyond that are suppressed.  The number suppressed at a call
+    site is reported at most once every `interval` seconds, either by the
+    next call to allow() or by flush().
+    """
+    def __init__(self, rate, burst, interval=10.0):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.interval = interval
+        self._buckets = dict()
+
+    def allow(self, site, now, context=None):
+        """
+        Returns a tuple containing True if a message from `site` may be
+        logged, and the number of messages suppressed at `site` which
+        should now be reported.  The `context` of the last suppressed
+        message is returned by flush().
+        """
+        bucket = self._buckets.get(site)
+        if bucket is None:
+            # tokens, last refill, suppressed, last report, context
+            bucket = [self.burst, now, 0, now, None]
+            self._buckets[site] = bucket
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            allowed = True
+        else:
+            bucket[2] += 1
+            bucket[4] = context
+            allowed = False
+        suppressed = 0
+        if bucket[2] > 0 and now - bucket[3] >= self.interval:
+            suppressed = bucket[2]
+            bucket[2] = 0
+            bucket[3] = now
+        return allowed, suppressed
+
+    def flush(self, now, force=False):
+        """
+        Returns a list of (suppressed, context) tuples for each call site
+        whose suppressed messages are due to be reported, or for every call
+        site with suppressed messages if `force` is True.
+        """
+        pending = list()
+        for bucket in self._buckets.values():
+            if bucket[2] > 0 and (force or now - bucket[3] >= self.interval):
+                pending.append((bucket[2], bucket[4]))
+                bucket[2] = 0
+                bucket[3] = now
+        return pending
+
+_ratelimiter = None
+
 class Logger(object):
     def __init__(self, name, level):
         self._name = name
@@ -129,7 +340,28 @@ class Logger(object):
     def __str__(self):
         return self._name
 
+    def isEnabledFor(self, level):
+        """
+        Returns True if a message at `level` would be logged.  Until
+        startLogging() is called every message is buffered, so every level
+        is enabled.
+        """
+        return _observer == None or level <= self._level
+
     def msg(self, level, message, **kwds):
+        # check the level before formatting the message, so disabled levels
+        # cost only a comparison.  the level is NOTSET until startLogging()
+        # is called, and every message is buffered until then
+        if level > self._level and _observer != None:
+            return
+        if _ratelimiter != None:
+            caller = sys._getframe(2)
+            allowed,suppressed = _ratelimiter.allow((caller.f_code, caller.f_lineno),
+                time.time(), (self, level, message[0]))
+            if suppressed > 0:
+                msg("suppressed %i messages like: %s" % (suppressed, message[0]), logger=self, level=level)
+            if not allowed:
+                return
         kwds.update({'logger': self, 'level': level})
         if len(message) > 1:
             msg(message[0] % message[1:], **kwds)
@@ -215,11 +447,14 @@ def getLogger(name):
 _twistedlogger = getLogger('twisted')
 _loggerslogger = getLogger('mandelbrot.loggers')
 
-def startLogging(observer, level=INFO, configfile=None):
+def startLogging(observer, level=INFO, configfile=None, ratelimit=None, rateburst=None):
     """
     Start logging messages using the supplied `observer`.  All buffered messages are
     flushed.  Log messages which have a level less than `level` are dropped, unless
     the logger has been specifically configured differently in the supplied `configfile`.  
+    If `observer` is None then all messages are discarded as cheaply as possible.
+    If `ratelimit` is specified, then each call site may log at most `ratelimit`
+    messages per second, with bursts of up to `rateburst` messages.
 
     :param observer: The observer to which will output messages.
     :type handler: callable or implements :class:`twisted.python.log.ILogObserver`
@@ -227,9 +462,16 @@ def startLogging(observer, level=INFO, configfile=None):
     :type level: int
     :param configfile: A path to the logging config file, or None.
     :type configfile: str
+    :param ratelimit: The maximum messages per second from each call site, or None.
+    :type ratelimit: float
+    :param rateburst: The maximum burst of messages from each call site.
+    :type rateburst: int
     """
     global _observer
     global _loggers
+    global _discarding
+    global _ratelimiter
+    global _recordsdropped
     if observer == None:
         _observer = NullHandler()
     else:
@@ -243,7 +485,21 @@ def startLogging(observer, level=INFO, configfile=None):
         l._level = v
         for l in l._children.values():
             _setLevel(l, v)
+    if observer == None:
+        # every logger rejects every message before formatting it, and
+        # records from twisted are dropped on arrival
+        _discarding = True
+        _setLevel(_loggers, _DISCARD)
+        _records.clear()
+        _recordsdropped = 0
+        _ratelimiter = None
+        return
+    _discarding = False
     _setLevel(_loggers, level)
+    if ratelimit != None and ratelimit > 0:
+        _ratelimiter = RateLimiter(ratelimit, rateburst if rateburst != None else ratelimit)
+    else:
+        _ratelimiter = None
     # Load the logging configuration from the specified configuration file.
     if configfile != None and os.access(configfile, os.R_OK):
         with file(configfile, 'r') as f:
@@ -269,11 +525,37 @@ def startLogging(observer, level=INFO, configfile=None):
                     _setLevel(logger, ERROR)
             _loggerslogger.info("loaded log config file %s" % configfile)
     # flush all buffered log messages to the real observer
-    while not _records.empty():
-        _ObserverWrapper(_records.get())
+    if _recordsdropped > 0:
+        _loggerslogger.warning("dropped %i log messages before logging was started", _recordsdropped)
+        _recordsdropped = 0
+    while len(_records) > 0:
+        _ObserverWrapper(_records.popleft())
+
+def flushSuppressed(force=False):
+    """
+    Report messages suppressed by the rate limit at call sites which have
+    not logged since the report came due.  If `force` is True, then every
+    pending report is made.
+    """
+    if _ratelimiter == None:
+        return
+    for suppressed,(logger,level,message) in _ratelimiter.flush(time.time(), force):
+        msg("suppressed %i messages like: %s" % (suppressed, message), logger=logger, level=level)
 
 def stopLogging():
-    pass
+    """
+    Stop logging, closing the observer so that any buffered messages are
+    written.  Messages logged afterwards are discarded.
+    """
+    global _observer
+    global _discarding
+    flushSuppressed(True)
+    if _observer != None:
+        observer = _observer
+        _observer = NullHandler()
+        _discarding = True
+        if hasattr(observer, 'close'):
+            observer.close()
 
 def restartLogging(observer, level, configfile=None):
     pass
@@ -16,7 +16,8 @@
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
 import json, pprint
-from mandelbrot.ref import ProbeRef
+from mandelbrot.ref import ProbeRef, parse_proberef
+from mandelbrot.convert import millis2datetime
 
 class Message(object):
     """
@@ -59,6 +60,12 @@ class StatusMessage(ProbeMessage):
         status.update({'health': self.health, 'summary': self.summary, 'timestamp': self.timestamp})
         return data
 
+    @classmethod
+    def __load__(cls, data):
+        payload = data['payload']
+        return cls(parse_proberef(payload['probeRef']), payload['health'], payload['summary'],
+            millis2datetime(payload['timestamp']))
+
 class MetricsMessage(ProbeMessage):
     """
     """
@@ -72,3 +79,20 @@ class MetricsMessage(ProbeMessage):
         status = data['payload']
         status.update({'metrics': self.metrics, 'timestamp': self.timestamp})
         return data
+
+    @classmethod
+    def __load__(cls, data):
+        payload = data['payload']
+        return cls(parse_proberef(payload['probeRef']), payload['metrics'], millis2datetime(payload['timestamp']))
+
+def load_message(data):
+    """
+    Return the message dumped as `data`, as returned by __dump__() and
+    encoded as JSON, using the __load__() of its message type.
+    """
+    messagetype = data.get('messageType')
+    if messagetype == 'io.mandelbrot.message.StatusMessage':
+        return StatusMessage.__load__(data)
+    if messagetype == 'io.mandelbrot.message.MetricsMessage':
+        return MetricsMessage.__load__(data)
+    raise ValueError("unknown message type %s" % messagetype)
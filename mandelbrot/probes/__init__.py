@@ -42,6 +42,9 @@ class IProbe(Interface):
     def get_behavior(self):
         ""
 
+    def get_deadline(self):
+        ""
+
     def get_probe(self, name):
         ""
 
@@ -68,6 +71,7 @@ class Probe(object):
         self._probetype = None
         self._metadata = None
         self._policy = None
+        self._deadline = None
         self._probes = dict()
         self._metrics = dict()
 
@@ -93,6 +97,9 @@ class Probe(object):
     def get_policy(self):
         return self._policy
 
+    def get_deadline(self):
+        return self._deadline
+
     def get_probe(self, name):
         return self._probes[name]
 
@@ -110,6 +117,7 @@ class ScalarProbe(Probe):
     """
     def configure(self, path, probetype, settings, metadata, policy, metrics):
         Probe.configure(self, path, probetype, metadata, policy, metrics)
+        self._deadline = settings.get_timedelta("execution deadline", None)
 
     def get_behavior(self):
         return ScalarBehavior(0, 0)
@@ -0,0 +1,75 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+from mandelbrot.probes import ScalarProbe
+from mandelbrot.metric import Metric, SourceType, MetricUnit
+from mandelbrot.instrumentation import instruments, Counter, Gauge, Histogram
+from mandelbrot.convert import timedelta2seconds
+
+def flatten(instrument):
+    """
+    Return a list of (name, sourcetype, unit, value) tuples for the metrics
+    of `instrument`.  A histogram is flattened into its count, sum, maximum,
+    and estimated 50th and 99th percentiles.
+    """
+    name = instrument.name
+    unit = instrument.unit
+    if isinstance(instrument, Counter):
+        return [(name, SourceType.COUNTER, unit, instrument.value)]
+    if isinstance(instrument, Gauge):
+        return [(name, SourceType.GAUGE, unit, instrument.value)]
+    if isinstance(instrument, Histogram):
+        return [(name + "_count", SourceType.COUNTER, MetricUnit.OPS, instrument.count),
+                (name + "_sum", SourceType.COUNTER, unit, instrument.sum),
+                (name + "_max", SourceType.GAUGE, unit, instrument.max),
+                (name + "_p50", SourceType.GAUGE, unit, instrument.percentile(50)),
+                (name + "_p99", SourceType.GAUGE, unit, instrument.percentile(99))]
+    return []
+
+class AgentSelf(ScalarProbe):
+    """
+    Check the health of the agent itself, and report the agent
+    instrumentation as metrics.
+
+    Parameters:
+
+    lag degraded threshold  = LAG: timedelta
+    lag failed threshold    = LAG: timedelta
+    """
+    def configure(self, path, probetype, settings, metadata, policy):
+        lagdegraded = settings.get_timedelta("lag degraded threshold", None)
+        self.lagdegraded = timedelta2seconds(lagdegraded) if lagdegraded is not None else None
+        lagfailed = settings.get_timedelta("lag failed threshold", None)
+        self.lagfailed = timedelta2seconds(lagfailed) if lagfailed is not None else None
+        metrics = dict()
+        for instrument in instruments:
+            for name,sourcetype,unit,_ in flatten(instrument):
+                metrics[name] = Metric(sourcetype, unit)
+        ScalarProbe.configure(self, path, probetype, settings, metadata, policy, metrics)
+
+    def probe(self):
+        metrics = dict()
+        for instrument in instruments:
+            for name,_,_,value in flatten(instrument):
+                metrics[name] = value
+        lag = metrics.get('scheduler_lag', 0.0)
+        summary = "agent queue depth is %i, scheduler lag is %.3f seconds" % (metrics.get('queue_depth', 0), lag)
+        if self.lagfailed is not None and lag > self.lagfailed:
+            return self.failed(summary, metrics)
+        if self.lagdegraded is not None and lag > self.lagdegraded:
+            return self.degraded(summary, metrics)
+        return self.healthy(summary, metrics)
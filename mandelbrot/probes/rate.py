@@ -0,0 +1,73 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+class CounterRates(object):
+    """
+    Converts samples of cumulative counters into per-second rates.  The
+    previous sample and timestamp are kept for each counter.  A counter
+    which goes backwards is treated as having wrapped at 32 or 64 bits if
+    the wrapped delta is plausible, otherwise as having been reset, in which
+    case the sample becomes the new baseline and no rate is reported.
+    """
+    def __init__(self):
+        self._samples = dict()
+        self._rates = dict()
+
+    def update(self, name, value, timestamp):
+        """
+        Record a sample of the counter `name` taken at `timestamp` seconds,
+        and return the rate per second since the previous sample, or None if
+        there is no usable previous sample.
+        """
+        previous = self._samples.get(name)
+        if previous is None:
+            self._samples[name] = (value, timestamp)
+            return None
+        lastvalue,lasttimestamp = previous
+        elapsed = timestamp - lasttimestamp
+        # the same sample was seen twice, so report the last rate again
+        if elapsed <= 0:
+            return self._rates.get(name)
+        self._samples[name] = (value, timestamp)
+        if value >= lastvalue:
+            delta = value - lastvalue
+        else:
+            width = 2 ** 32 if lastvalue < 2 ** 32 else 2 ** 64
+            delta = width - lastvalue + value
+            if delta > width / 2:
+                self._rates.pop(name, None)
+                return None
+        rate = float(delta) / float(elapsed)
+        self._rates[name] = rate
+        return rate
+
+    def update_all(self, values, timestamp):
+        """
+        Record a sample of each counter in the `values` dict, and return a
+        dict of rates, or None if a rate could not be calculated for every
+        counter.
+        """
+        rates = dict()
+        for name,value in values.items():
+            rates[name] = self.update(name, value, timestamp)
+        if None in rates.values():
+            return None
+        return rates
+
+    def reset(self):
+        self._samples.clear()
+        self._rates.clear()
@@ -0,0 +1,92 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, time, threading, collections, psutil
+
+Snapshot = collections.namedtuple('Snapshot', ['timestamp', 'value'])
+
+class FrozenDict(dict):
+    """
+    A dict which cannot be modified once created.
+    """
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("snapshot is immutable")
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    clear = _immutable
+    pop = _immutable
+    popitem = _immutable
+    setdefault = _immutable
+    update = _immutable
+
+def _disk_io_counters():
+    return psutil.disk_io_counters(perdisk=False)
+
+def _disk_io_counters_perdisk():
+    return FrozenDict(psutil.disk_io_counters(perdisk=True))
+
+def _net_io_counters():
+    return psutil.net_io_counters(pernic=False)
+
+def _net_io_counters_pernic():
+    return FrozenDict(psutil.net_io_counters(pernic=True))
+
+SOURCES = {
+    'loadavg': os.getloadavg,
+    'cpu_count': psutil.cpu_count,
+    'cpu_times_percent': psutil.cpu_times_percent,
+    'virtual_memory': psutil.virtual_memory,
+    'swap_memory': psutil.swap_memory,
+    'disk_io_counters': _disk_io_counters,
+    'disk_io_counters_perdisk': _disk_io_counters_perdisk,
+    'net_io_counters': _net_io_counters,
+    'net_io_counters_pernic': _net_io_counters_pernic,
+}
+
+class SnapshotCache(object):
+    """
+    Collects each psutil source at most once per `ttl` seconds, and hands
+    the same immutable snapshot to every probe which asks for it within
+    that time.  The agent sets the ttl to the scheduler resolution, so each
+    source is read at most once per scheduling tick no matter how many
+    probes read it.
+    """
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self._snapshots = dict()
+        self._locks = dict([(source, threading.Lock()) for source in SOURCES.keys()])
+
+    def get(self, source):
+        """
+        Return the current Snapshot of the specified `source`, collecting
+        it first if the cached snapshot is older than the ttl.
+        """
+        lock = self._locks[source]
+        with lock:
+            snapshot = self._snapshots.get(source)
+            now = time.time()
+            if snapshot is None or now - snapshot.timestamp >= self.ttl:
+                snapshot = Snapshot(now, SOURCES[source]())
+                self._snapshots[source] = snapshot
+            return snapshot
+
+    def clear(self):
+        for source,lock in self._locks.items():
+            with lock:
+                self._snapshots.pop(source, None)
+
+snapshots = SnapshotCache()
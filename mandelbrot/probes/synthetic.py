@@ -0,0 +1,68 @@
+# Copyright 2014 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import time, random
+from pesky.settings import ConfigureError
+from mandelbrot.probes import ScalarProbe
+from mandelbrot.metric import Metric, SourceType, MetricUnit
+from mandelbrot.convert import timedelta2seconds
+from mandelbrot.evaluation import Health
+
+class Synthetic(ScalarProbe):
+    """
+    Synthetic probe for scale testing the agent.  Each invocation spins the
+    cpu and then blocks for the configured time, reports a random value for
+    each metric, and flips between healthy and failed with probability
+    flip rate.
+
+    Parameters:
+
+    metric count        = COUNT: int = 1
+    cpu time            = DURATION: timedelta = 0
+    blocking time       = DURATION: timedelta = 0
+    flip rate           = RATE: float = 0.0
+    """
+    def configure(self, path, probetype, settings, metadata, policy):
+        self.metriccount = settings.get_int("metric count", 1)
+        if self.metriccount < 0:
+            raise ConfigureError("metric count must not be negative")
+        cputime = settings.get_timedelta("cpu time", None)
+        self.cputime = timedelta2seconds(cputime) if cputime is not None else 0.0
+        blockingtime = settings.get_timedelta("blocking time", None)
+        self.blockingtime = timedelta2seconds(blockingtime) if blockingtime is not None else 0.0
+        self.fliprate = settings.get_float("flip rate", 0.0)
+        if self.fliprate < 0.0 or self.fliprate > 1.0:
+            raise ConfigureError("flip rate must be between 0.0 and 1.0")
+        self.health = Health.HEALTHY
+        self.names = ["metric%i" % i for i in range(self.metriccount)]
+        metrics = dict()
+        for name in self.names:
+            metrics[name] = Metric(SourceType.GAUGE, MetricUnit.UNITS)
+        ScalarProbe.configure(self, path, probetype, settings, metadata, policy, metrics)
+
+    def probe(self):
+        if self.cputime > 0.0:
+            until = time.time() + self.cputime
+            while time.time() < until:
+                sum(xrange(1000))
+        if self.blockingtime > 0.0:
+            time.sleep(self.blockingtime)
+        if random.random() < self.fliprate:
+            self.health = Health.FAILED if self.health == Health.HEALTHY else Health.HEALTHY
+        metrics = dict([(name, random.random()) for name in self.names])
+        summary = "synthetic probe is %s" % self.health
+        return self.evaluate(self.health, summary, metrics)
@@ -18,6 +18,8 @@
 import os, psutil
 from datetime import timedelta
 from mandelbrot.probes import ScalarProbe
+from mandelbrot.probes.snapshot import snapshots
+from mandelbrot.probes.rate import CounterRates
 from mandelbrot.metric import Metric, SourceType, MetricUnit
 from mandelbrot.table import size2string
 
@@ -44,8 +46,8 @@ class SystemLoad(ScalarProbe):
         ScalarProbe.configure(self, path, probetype, settings, metadata, policy, metrics)
 
     def probe(self):
-        load1, load5, load15 = os.getloadavg()
-        ncores = psutil.cpu_count()
+        load1, load5, load15 = snapshots.get('loadavg').value
+        ncores = snapshots.get('cpu_count').value
         summary = "load average is %.1f %.1f %.1f, detected %i cores" % (load1,load5,load15,ncores)
         metrics = dict(load1=load1, load5=load5, load15=load15)
         if self.percpu == True:
@@ -91,13 +93,14 @@ class SystemCPU(ScalarProbe):
         self.idledegraded = settings.get_percent("idle degraded threshold", None)
         self.extended = settings.get_bool("extended summary", False)
         metrics = dict()
-        # has side effect of throwing away the first value
+        # has side effect of throwing away the first value.  psutil is called
+        # directly, so the primed value is not cached and reported by probe()
         for name,_ in psutil.cpu_times_percent()._asdict().items():
             metrics[name] = Metric(SourceType.GAUGE, MetricUnit.PERCENT)
         ScalarProbe.configure(self, path, probetype, settings, metadata, policy, metrics)
 
     def probe(self):
-        times = psutil.cpu_times_percent()
+        times = snapshots.get('cpu_times_percent').value
         items = sorted(times._asdict().items())
         if self.extended == False:
             showvals = ", ".join(["%.1f%% %s" % (v,n) for n,v in items if v != 0.0])
@@ -148,11 +151,11 @@ class SystemMemory(ScalarProbe):
         ScalarProbe.configure(self, path, probetype, settings, metadata, policy, metrics)
 
     def probe(self):
-        memory = psutil.virtual_memory()
+        memory = snapshots.get('virtual_memory').value
         memavail = memory.available
         memused = memory.percent
         memtotal = memory.total
-        swap = psutil.swap_memory()
+        swap = snapshots.get('swap_memory').value
         swapavail = swap.total - swap.used
         swapused = swap.percent
         swaptotal = swap.total
@@ -202,90 +205,128 @@ class SystemDiskUsage(ScalarProbe):
 
 class SystemDiskPerformance(ScalarProbe):
     """
-    Check system disk performance.
+    Check system disk performance.  Thresholds are compared against the
+    rate of operations per second since the previous check.
 
     Parameters:
     disk device              = PATH: path
-    read failed threshold    = USAGE: int
-    read degraded threshold  = USAGE: int
-    write failed threshold   = USAGE: int
-    write degraded threshold = USAGE: int
+    read failed threshold    = RATE: float
+    read degraded threshold  = RATE: float
+    write failed threshold   = RATE: float
+    write degraded threshold = RATE: float
     """
     def configure(self, path, probetype, settings, metadata, policy):
         self.device = settings.get_path("disk device", None)
-        self.readfailed = settings.get_int("read failed threshold", None)
-        self.readdegraded = settings.get_int("read degraded threshold", None)
-        self.writefailed = settings.get_int("write failed threshold", None)
-        self.writedegraded = settings.get_int("write degraded threshold", None)
+        self.readfailed = settings.get_float("read failed threshold", None)
+        self.readdegraded = settings.get_float("read degraded threshold", None)
+        self.writefailed = settings.get_float("write failed threshold", None)
+        self.writedegraded = settings.get_float("write degraded threshold", None)
+        self.rates = CounterRates()
         metrics = dict()
+        metrics['reads'] = Metric(SourceType.GAUGE, MetricUnit.OPS)
+        metrics['writes'] = Metric(SourceType.GAUGE, MetricUnit.OPS)
+        metrics['readbytes'] = Metric(SourceType.GAUGE, MetricUnit.BYTES)
+        metrics['writebytes'] = Metric(SourceType.GAUGE, MetricUnit.BYTES)
         ScalarProbe.configure(self, path, probetype, settings, metadata, policy, metrics)
 
     def probe(self):
         if self.device is not None:
-            disk = psutil.disk_io_counters(perdisk=True)[self.device]
+            snapshot = snapshots.get('disk_io_counters_perdisk')
+            disk = snapshot.value[self.device]
         else:
-            disk = psutil.disk_io_counters(perdisk=False)
-        reads = disk.read_count
-        writes = disk.write_count
+            snapshot = snapshots.get('disk_io_counters')
+            disk = snapshot.value
+        counters = dict(reads=disk.read_count, writes=disk.write_count,
+                        readbytes=disk.read_bytes, writebytes=disk.write_bytes)
+        metrics = self.rates.update_all(counters, snapshot.timestamp)
+        if metrics is None:
+            return self.unknown("waiting for a second sample of disk counters")
+        reads = metrics['reads']
+        writes = metrics['writes']
         if self.device is not None:
-            summary = "%i reads, %i writes on %s" % (reads,writes,self.device)
+            summary = "%.1f reads/s, %.1f writes/s on %s" % (reads,writes,self.device)
         else:
-            summary = "%i reads, %i writes across all devices" % (reads,writes)
+            summary = "%.1f reads/s, %.1f writes/s across all devices" % (reads,writes)
         if self.readfailed is not None and reads > self.readfailed:
-            return self.failed(summary)
+            return self.failed(summary, metrics)
         if self.writefailed is not None and writes > self.writefailed:
-            return self.failed(summary)
+            return self.failed(summary, metrics)
         if self.readdegraded is not None and reads > self.readdegraded:
-            return self.degraded(summary)
+            return self.degraded(summary, metrics)
         if self.writedegraded is not None and writes > self.writedegraded:
-            return self.degraded(summary)
-        return self.healthy(summary)
+            return self.degraded(summary, metrics)
+        return self.healthy(summary, metrics)
 
 class SystemNetPerformance(ScalarProbe):
     """
-    Check system network performance.
+    Check system network performance.  Thresholds are compared against the
+    rate of packets or errors per second since the previous check.
 
     Parameters:
-    net device              = DEVICE: str
-    send failed threshold   = USAGE: int
-    send degraded threshold = USAGE: int
-    recv failed threshold   = USAGE: int
-    recv degraded threshold = USAGE: int
+    net device               = DEVICE: str
+    send failed threshold    = RATE: float
+    send degraded threshold  = RATE: float
+    recv failed threshold    = RATE: float
+    recv degraded threshold  = RATE: float
+    error failed threshold   = RATE: float
+    error degraded threshold = RATE: float
     """
     def get_type(self):
         return "io.mandelbrot.probe.SystemNetPerformance"
 
     def configure(self, path, probetype, settings, metadata, policy):
         self.device = settings.get_str("net device", None)
-        self.sendfailed = settings.get_int("send failed threshold", None)
-        self.senddegraded = settings.get_int("send degraded threshold", None)
-        self.recvfailed = settings.get_int("recv failed threshold", None)
-        self.recvdegraded = settings.get_int("recv degraded threshold", None)
+        self.sendfailed = settings.get_float("send failed threshold", None)
+        self.senddegraded = settings.get_float("send degraded threshold", None)
+        self.recvfailed = settings.get_float("recv failed threshold", None)
+        self.recvdegraded = settings.get_float("recv degraded threshold", None)
+        self.errorfailed = settings.get_float("error failed threshold", None)
+        self.errordegraded = settings.get_float("error degraded threshold", None)
+        self.rates = CounterRates()
         metrics = dict()
+        metrics['packetssent'] = Metric(SourceType.GAUGE, MetricUnit.UNITS)
+        metrics['packetsrecv'] = Metric(SourceType.GAUGE, MetricUnit.UNITS)
+        metrics['bytessent'] = Metric(SourceType.GAUGE, MetricUnit.BYTES)
+        metrics['bytesrecv'] = Metric(SourceType.GAUGE, MetricUnit.BYTES)
+        metrics['errin'] = Metric(SourceType.GAUGE, MetricUnit.UNITS)
+        metrics['errout'] = Metric(SourceType.GAUGE, MetricUnit.UNITS)
+        metrics['dropin'] = Metric(SourceType.GAUGE, MetricUnit.UNITS)
+        metrics['dropout'] = Metric(SourceType.GAUGE, MetricUnit.UNITS)
         ScalarProbe.configure(self, path, probetype, settings, metadata, policy, metrics)
 
     def probe(self):
         if self.device is not None:
-            net = psutil.net_io_counters(pernic=True)[self.device]
+            snapshot = snapshots.get('net_io_counters_pernic')
+            net = snapshot.value[self.device]
         else:
-            net = psutil.net_io_counters(pernic=False)
-        tx = net.packets_sent
-        rx = net.packets_recv
-        errin = net.errin
-        errout = net.errout
-        dropin = net.dropin
-        dropout = net.dropout
+            snapshot = snapshots.get('net_io_counters')
+            net = snapshot.value
+        counters = dict(packetssent=net.packets_sent, packetsrecv=net.packets_recv,
+                        bytessent=net.bytes_sent, bytesrecv=net.bytes_recv,
+                        errin=net.errin, errout=net.errout,
+                        dropin=net.dropin, dropout=net.dropout)
+        metrics = self.rates.update_all(counters, snapshot.timestamp)
+        if metrics is None:
+            return self.unknown("waiting for a second sample of network counters")
+        tx = metrics['packetssent']
+        rx = metrics['packetsrecv']
+        errors = metrics['errin'] + metrics['errout']
         if self.device is not None:
-            summary = "%i packets sent, %i packets received on %s" % (tx,rx,self.device)
+            summary = "%.1f packets/s sent, %.1f packets/s received on %s" % (tx,rx,self.device)
         else:
-            summary = "%i packets sent, %i packets received across all devices" % (tx,rx)
+            summary = "%.1f packets/s sent, %.1f packets/s received across all devices" % (tx,rx)
+        if errors > 0.0:
+            summary += ", %.1f errors/s" % errors
         if self.sendfailed is not None and tx > self.sendfailed:
-            return self.failed(summary)
+            return self.failed(summary, metrics)
         if self.recvfailed is not None and rx > self.recvfailed:
-            return self.failed(summary)
+            return self.failed(summary, metrics)
+        if self.errorfailed is not None and errors > self.errorfailed:
+            return self.failed(summary, metrics)
         if self.senddegraded is not None and tx > self.senddegraded:
-            return self.degraded(summary)
+            return self.degraded(summary, metrics)
         if self.recvdegraded is not None and rx > self.recvdegraded:
-            return self.degraded(summary)
-        return self.healthy(summary)
-
+            return self.degraded(summary, metrics)
+        if self.errordegraded is not None and errors > self.errordegraded:
+            return self.degraded(summary, metrics)
+        return self.healthy(summary, metrics)
@@ -0,0 +1,20 @@
+import datetime
+from twisted.internet.defer import succeed, fail
+from mandelbrot.endpoints.http import HTTPEndpoint
+from mandelbrot.message import StatusMessage
+from mandelbrot.ref import parse_proberef
+
+def make_message(uri):
+    return StatusMessage(parse_proberef(uri + "/cpu"), 'healthy', 'ok', datetime.datetime.now())
+
+class FailingEndpoint(HTTPEndpoint):
+    def _submit_batch(self, uri, batch):
+        if uri == 'fqdn:broken':
+            return fail(ValueError("malformed 207 response"))
+        return succeed(list())
+
+def test_http_send_batch_returns_batch_which_errbacks():
+    messages = [make_message('fqdn:ok'), make_message('fqdn:broken'), make_message('fqdn:broken')]
+    results = list()
+    FailingEndpoint().send_batch(messages).addCallback(results.append)
+    assert results == [messages[1:]]
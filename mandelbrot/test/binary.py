@@ -0,0 +1,29 @@
+import datetime
+from dateutil.tz import tzutc
+from mandelbrot.endpoints.binary import encode_frames, decode_frames, is_encodable
+from mandelbrot.http import json_encoder, from_json
+from mandelbrot.message import StatusMessage, MetricsMessage
+from mandelbrot.ref import parse_proberef
+
+cpu = parse_proberef("fqdn:localhost/cpu")
+load = parse_proberef("fqdn:localhost/load")
+timestamp = datetime.datetime(2014, 6, 1, 12, 30, 15, 250000, tzutc())
+
+def test_frames_round_trip():
+    messages = [
+        StatusMessage(cpu, 'degraded', u'cpu is busy', timestamp),
+        StatusMessage(load, 'unknown', None, timestamp),
+        MetricsMessage(cpu, {'user': 12.5, 'system': 3}, timestamp),
+        MetricsMessage(load, {'user': 1.0, 'load1': 0.25}, timestamp),
+        ]
+    expected = [from_json(json_encoder.encode(message.__dump__())) for message in messages]
+    assert decode_frames(encode_frames(messages)) == expected
+
+def test_frames_define_names_once():
+    messages = [MetricsMessage(cpu, {'user': float(i)}, timestamp) for i in range(10)]
+    assert encode_frames(messages).count('user') == 1
+    assert encode_frames(messages).count('localhost/cpu') == 1
+
+def test_non_numeric_metrics_are_not_encodable():
+    assert is_encodable(MetricsMessage(cpu, {'user': 1.0}, timestamp))
+    assert not is_encodable(MetricsMessage(cpu, {'state': 'running'}, timestamp))
@@ -0,0 +1,105 @@
+import zlib, datetime
+from dateutil.tz import tzutc
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock, Cooperator
+from mandelbrot.http import as_json, from_json, StringProducer, CompressedJsonProducer, COMPRESSION_WBITS
+from mandelbrot.endpoints.http import HTTPEndpoint
+from mandelbrot.message import StatusMessage
+from mandelbrot.ref import parse_proberef
+
+ref = parse_proberef("fqdn:localhost/cpu")
+timestamp = datetime.datetime(2014, 6, 1, 12, 30, 15, 250000, tzutc())
+
+def messages(count):
+    return [StatusMessage(ref, 'healthy', "message %i" % i, timestamp) for i in range(count)]
+
+class Consumer(object):
+    def __init__(self):
+        self.blocks = list()
+    def write(self, data):
+        self.blocks.append(data)
+
+def produce(producer):
+    """
+    Run `producer` to completion, returning the list of blocks written.
+    """
+    clock = Clock()
+    producer._cooperate = Cooperator(scheduler=lambda work: clock.callLater(0, work)).cooperate
+    consumer = Consumer()
+    done = list()
+    producer.startProducing(consumer).addCallback(done.append)
+    while len(done) == 0:
+        clock.advance(0)
+    return consumer.blocks
+
+def test_as_json_compresses_only_at_threshold():
+    small = as_json(messages(1), 'gzip', threshold=1024)
+    assert isinstance(small, StringProducer)
+    assert small.encoding is None
+    large = as_json(messages(50), 'gzip', threshold=1024)
+    assert isinstance(large, CompressedJsonProducer)
+    assert large.encoding == 'gzip'
+    assert isinstance(as_json(messages(50)), StringProducer)
+
+def test_compressed_entity_round_trips():
+    expected = from_json(as_json(messages(200)).entity)
+    for encoding in ('gzip', 'deflate'):
+        producer = as_json(messages(200), encoding, threshold=0)
+        data = ''.join(produce(producer))
+        decoded = zlib.decompress(data, COMPRESSION_WBITS[encoding])
+        assert from_json(decoded) == expected
+
+def test_compressed_producer_stops_while_paused():
+    producer = CompressedJsonProducer([], iter([str(i) * 1000 for i in range(10)] * 100), 'deflate', 0)
+    producer.blocksize = 1024
+    clock = Clock()
+    # write a single block on each iteration
+    cooperator = Cooperator(terminationPredicateFactory=lambda: lambda: True,
+        scheduler=lambda work: clock.callLater(1, work))
+    producer._cooperate = cooperator.cooperate
+    consumer = Consumer()
+    producer.startProducing(consumer)
+    clock.advance(1)
+    written = len(consumer.blocks)
+    assert written > 0
+    producer.pauseProducing()
+    clock.advance(1)
+    clock.advance(1)
+    assert len(consumer.blocks) == written
+    producer.resumeProducing()
+    clock.advance(1)
+    assert len(consumer.blocks) > written
+    producer.stopProducing()
+
+class Response(object):
+    def __init__(self, code):
+        self.code = code
+
+class FakeAgent(object):
+    def __init__(self, codes):
+        self.codes = list(codes)
+        self.requests = list()
+    def request(self, method, url, headers, body):
+        self.requests.append((headers.getRawHeaders('Content-Encoding'), body))
+        return succeed(Response(self.codes.pop(0)))
+
+class FakeHttp(object):
+    def read_body(self, response):
+        return succeed('')
+
+def test_submit_disables_compression_after_415():
+    endpoint = HTTPEndpoint()
+    endpoint.http = FakeHttp()
+    endpoint._agent = FakeAgent([415, 200, 200])
+    endpoint.compression = 'gzip'
+    responses = list()
+    endpoint._submit("http://localhost/submit", messages(10)).addCallback(responses.append)
+    assert [response.code for response in responses] == [200]
+    assert endpoint.compression is None
+    (first,_),(second,body) = endpoint._agent.requests
+    assert first == ['gzip']
+    assert second is None
+    assert body.encoding is None
+    # later submissions are not compressed
+    endpoint._submit("http://localhost/submit", messages(10))
+    assert endpoint._agent.requests[-1][0] is None
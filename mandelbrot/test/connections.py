@@ -0,0 +1,66 @@
+import os
+from ConfigParser import RawConfigParser
+from pesky.settings.section import Section
+from twisted.internet.task import Clock
+from mandelbrot.http import Http
+from mandelbrot.endpoints.http import HTTPEndpoint
+
+def make_section(**settings):
+    options = RawConfigParser()
+    options.add_section('endpoint')
+    for name,value in settings.items():
+        options.set('endpoint', name.replace('_', ' '), value)
+    return Section('endpoint', options, os.getcwd())
+
+class ClockHttp(Http):
+    def __init__(self):
+        Http.__init__(self)
+        self.clock = Clock()
+    @property
+    def reactor(self):
+        return self.clock
+
+def test_http_configures_connection_pool():
+    http = ClockHttp()
+    http.configure(make_section(http_cached_connections_per_host='8', http_idle_timeout='30 seconds'))
+    pool = http.pool
+    assert pool.persistent
+    assert pool.maxPersistentPerHost == 8
+    assert pool.cachedConnectionTimeout == 30.0
+    # reconfiguring updates the existing pool
+    http.configure(make_section(http_idle_timeout='1 minute'))
+    assert http.pool is pool
+    assert pool.cachedConnectionTimeout == 60.0
+
+def test_http_disables_persistent_connections():
+    http = ClockHttp()
+    http.configure(make_section(http_persistent_connections='false'))
+    assert not http.pool.persistent
+
+def test_http_close_closes_pool():
+    http = ClockHttp()
+    http.configure(make_section())
+    pool = http.pool
+    closed = list()
+    pool.closeCachedConnections = lambda: closed.append(True)
+    http.close()
+    assert closed == [True]
+    assert http._pool is None
+    assert http.pool is not pool
+
+def test_endpoint_close_closes_pool():
+    endpoint = HTTPEndpoint()
+    endpoint.http = ClockHttp()
+    endpoint.configure("http://localhost:8080/", make_section(max_concurrent_submissions='2'))
+    assert endpoint.limiter.limit == 2
+    pool = endpoint.http.pool
+    closed = list()
+    pool.closeCachedConnections = lambda: closed.append(True)
+    endpoint.close()
+    assert closed == [True]
+
+def test_endpoint_accepts_old_submission_limit_name():
+    endpoint = HTTPEndpoint()
+    endpoint.http = ClockHttp()
+    endpoint.configure("http://localhost:8080/", make_section(max_connections_per_host='3'))
+    assert endpoint.limiter.limit == 3
@@ -0,0 +1,111 @@
+from twisted.internet.defer import Deferred
+from mandelbrot.agent.endpoints import MessageConsumer
+from mandelbrot.agent.queues import FifoQueue
+from mandelbrot.agent.spool import HoldingBuffer
+
+class PendingEndpoint(object):
+    def __init__(self):
+        self.sends = list()
+    def send(self, message):
+        defer = Deferred()
+        self.sends.append((message, defer))
+        return defer
+
+def test_consumer_spools_inflight_and_queued_messages_on_stop():
+    queue = FifoQueue(10)
+    spool = HoldingBuffer(10)
+    endpoint = PendingEndpoint()
+    consumer = MessageConsumer(queue, endpoint, maxinflight=1, spool=spool)
+    consumer.start()
+    queue.put_nowait('first')
+    queue.put_nowait('second')
+    assert [message for message,_ in endpoint.sends] == ['first']
+    stopped = list()
+    consumer.stop().addCallback(stopped.append)
+    assert stopped == []
+    endpoint.sends[0][1].errback(Exception("connection lost"))
+    assert stopped == [None]
+    assert spool.read(10) == ['first', 'second']
+
+def test_consumer_abandons_inflight_sends_after_timeout():
+    queue = FifoQueue(10)
+    spool = HoldingBuffer(10)
+    endpoint = PendingEndpoint()
+    consumer = MessageConsumer(queue, endpoint, maxinflight=1, spool=spool)
+    consumer.start()
+    queue.put_nowait('first')
+    queue.put_nowait('second')
+    stopped = list()
+    consumer.stop().addCallback(stopped.append)
+    consumer._abandoner.cancel()
+    consumer._abandon()
+    assert stopped == [None]
+    assert consumer.inflight == 0
+    assert spool.read(10) == ['first', 'second']
+    # a late result for the abandoned send is ignored
+    endpoint.sends[0][1].errback(Exception("connection lost"))
+    assert spool.empty()
+
+class FlakyEndpoint(object):
+    def __init__(self):
+        self.failing = True
+        self.delivered = list()
+    def send(self, message):
+        if self.failing:
+            raise Exception("connection refused")
+        self.delivered.append(message)
+
+def test_consumer_replays_spool_in_order_after_outage():
+    queue = FifoQueue(10)
+    spool = HoldingBuffer(10)
+    for message in ('a', 'b', 'c'):
+        spool.append(message)
+    endpoint = FlakyEndpoint()
+    consumer = MessageConsumer(queue, endpoint, maxinflight=1, spool=spool)
+    consumer.start()
+    consumer.replay()
+    assert not consumer.available
+    queue.put_nowait('d')
+    assert spool.peek(10) == ['a', 'b', 'c', 'd']
+    endpoint.failing = False
+    consumer.replay()
+    consumer.replay()
+    assert endpoint.delivered == ['a', 'b', 'c', 'd']
+    assert spool.empty()
+    consumer.stop()
+
+def test_consumer_spools_new_messages_until_spool_is_replayed():
+    queue = FifoQueue(10)
+    spool = HoldingBuffer(10)
+    for message in ('a', 'b'):
+        spool.append(message)
+    endpoint = FlakyEndpoint()
+    endpoint.failing = False
+    consumer = MessageConsumer(queue, endpoint, maxinflight=2, spool=spool)
+    consumer.start()
+    queue.put_nowait('c')
+    assert endpoint.delivered == []
+    assert spool.peek(10) == ['a', 'b', 'c']
+    consumer.replay()
+    assert endpoint.delivered == ['a', 'b', 'c']
+    assert spool.empty()
+    queue.put_nowait('d')
+    assert endpoint.delivered == ['a', 'b', 'c', 'd']
+    assert spool.empty()
+    consumer.stop()
+
+def test_consumer_replays_with_full_send_capacity():
+    queue = FifoQueue(10)
+    spool = HoldingBuffer(10)
+    for message in ('a', 'b', 'c', 'd', 'e'):
+        spool.append(message)
+    endpoint = PendingEndpoint()
+    consumer = MessageConsumer(queue, endpoint, maxinflight=2, batchsize=1, spool=spool)
+    consumer.start()
+    consumer.replay()
+    assert [message for message,_ in endpoint.sends] == ['a', 'b']
+    for _,defer in list(endpoint.sends):
+        defer.callback(None)
+    assert [message for message,_ in endpoint.sends] == ['a', 'b', 'c', 'd']
+    assert spool.peek(10) == ['c', 'd', 'e']
+    consumer.stop()
@@ -0,0 +1,21 @@
+import datetime
+from dateutil.tz import tzutc
+from mandelbrot.http import message_encoder, json_encoder, from_json, datetime2millis
+from mandelbrot.message import StatusMessage, MetricsMessage
+from mandelbrot.ref import parse_proberef
+
+ref = parse_proberef("fqdn:localhost/cpu")
+timestamp = datetime.datetime(2014, 6, 1, 12, 30, 15, 250000, tzutc())
+
+def test_datetime2millis_is_utc():
+    assert datetime2millis(timestamp) == 1401625815250
+    assert datetime2millis(timestamp.replace(tzinfo=None)) == 1401625815250
+
+def test_encode_status_message():
+    message = StatusMessage(ref, 'healthy', u'load is \u2193', timestamp)
+    assert from_json(message_encoder.encode(message)) == from_json(json_encoder.encode(message.__dump__()))
+
+def test_encode_metrics_message_batch():
+    messages = [MetricsMessage(ref, {'user': 1.5, 'system': 2}, timestamp) for _ in range(3)]
+    encoded = ''.join(message_encoder.iterencode(messages))
+    assert from_json(encoded) == [from_json(json_encoder.encode(m.__dump__())) for m in messages]
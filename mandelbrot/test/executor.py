@@ -0,0 +1,66 @@
+from mandelbrot.agent.executor import ProcessExecutor, ProbeProcessError
+
+class UnpicklableProbe(object):
+    def __init__(self):
+        self.callback = lambda: None
+    def probe(self):
+        return None
+
+def test_process_executor_fails_probe_which_cannot_be_pickled():
+    executor = ProcessExecutor(1)
+    executor.start()
+    try:
+        failures = list()
+        defer = executor.submit(UnpicklableProbe())
+        defer.addErrback(failures.append)
+        asyncresult,_ = executor._pending[defer]
+        asyncresult.wait(10)
+        executor._poll()
+        assert len(failures) == 1
+        assert failures[0].check(ProbeProcessError)
+        assert executor._pending == {}
+    finally:
+        executor.stop()
+
+def test_process_executor_fails_probe_which_does_not_return():
+    executor = ProcessExecutor(1)
+    executor.start()
+    try:
+        failures = list()
+        class Pending(object):
+            def ready(self):
+                return False
+        defer = executor.submit(UnpicklableProbe())
+        defer.addErrback(failures.append)
+        executor._pending[defer] = (Pending(), 0.0)
+        executor._poll()
+        assert len(failures) == 1
+        assert 'did not return' in failures[0].getErrorMessage()
+    finally:
+        executor.stop()
+
+def test_thread_executor_stop_abandons_hung_probe():
+    import threading
+    from mandelbrot.agent.executor import ThreadExecutor
+    release = threading.Event()
+    class HungProbe(object):
+        def probe(self):
+            release.wait(10)
+    executor = ThreadExecutor(1, stoptimeout=0.1)
+    executor.start()
+    try:
+        executor.submit(HungProbe())
+        executor.stop()
+        running = [thread for thread in executor.pool.threads if thread.is_alive()]
+        assert len(running) == 1
+        assert running[0].daemon
+    finally:
+        release.set()
+
+def test_thread_executor_stop_joins_idle_workers():
+    from mandelbrot.agent.executor import ThreadExecutor
+    executor = ThreadExecutor(2, stoptimeout=5.0)
+    executor.start()
+    executor.stop()
+    assert [thread for thread in executor.pool.threads if thread.is_alive()] == []
+    assert not executor.pool.started
@@ -0,0 +1,23 @@
+from mandelbrot.instrumentation import Registry, Histogram
+
+def test_histogram_counts_into_buckets():
+    histogram = Histogram('latency', 'seconds', (0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.max == 2.0
+    assert histogram.percentile(50) == 0.1
+    assert histogram.percentile(99) == 2.0
+
+def test_registry_returns_existing_instrument():
+    registry = Registry()
+    counter = registry.counter('sent', 'units')
+    counter.increment(3)
+    assert registry.counter('sent', 'units') is counter
+    assert registry.snapshot()['sent']['value'] == 3
+
+def test_registry_gauge_reads_function():
+    registry = Registry()
+    registry.gauge('depth', 'units', lambda: 42)
+    assert registry.snapshot()['depth']['value'] == 42
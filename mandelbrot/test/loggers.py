@@ -0,0 +1,109 @@
+import json
+from mandelbrot.loggers import getLogger, startLogging, BaseHandler, INFO, DEBUG
+
+class CountingArg(object):
+    def __init__(self):
+        self.formatted = 0
+    def __str__(self):
+        self.formatted += 1
+        return 'arg'
+
+class CapturingHandler(BaseHandler):
+    def __init__(self, format='text'):
+        BaseHandler.__init__(self, format)
+        self.lines = list()
+    def handle(self, message):
+        self.lines.append(message)
+
+def test_logger_skips_formatting_for_disabled_level():
+    handler = CapturingHandler()
+    startLogging(handler, INFO)
+    logger = getLogger('mandelbrot.test.loggers')
+    arg = CountingArg()
+    logger.debug("debug %s", arg)
+    assert arg.formatted == 0
+    assert not logger.isEnabledFor(DEBUG)
+    logger.info("info %s", arg)
+    assert arg.formatted == 1
+    assert handler.lines[-1].endswith("INFO mandelbrot.test.loggers: info arg")
+    startLogging(None)
+
+def test_handler_formats_json_lines():
+    handler = CapturingHandler('json')
+    startLogging(handler, INFO)
+    getLogger('mandelbrot.test.loggers').warning("disk %s is full", "/var")
+    entry = json.loads(handler.lines[-1])
+    assert entry['level'] == 'WARNING'
+    assert entry['logger'] == 'mandelbrot.test.loggers'
+    assert entry['message'] == "disk /var is full"
+    startLogging(None)
+
+def test_async_file_handler_writes_and_rotates():
+    import os, tempfile, shutil
+    from mandelbrot.loggers import AsyncFileHandler
+    path = tempfile.mkdtemp()
+    try:
+        handler = AsyncFileHandler(os.path.join(path, 'agent.log'), maxbytes=20, backups=1)
+        for i in range(6):
+            handler.handle("message %i" % i)
+        handler.close()
+        assert sorted(os.listdir(path)) == ['agent.log', 'agent.log.1']
+        lines = open(os.path.join(path, 'agent.log.1')).read().splitlines()
+        lines += open(os.path.join(path, 'agent.log')).read().splitlines()
+        assert lines == ["message %i" % i for i in range(6)][-len(lines):]
+        assert lines[-1] == "message 5"
+    finally:
+        shutil.rmtree(path)
+
+def test_async_file_handler_keeps_writing_when_rotation_fails():
+    import os, tempfile, shutil
+    from mandelbrot.loggers import AsyncFileHandler
+    path = tempfile.mkdtemp()
+    try:
+        handler = AsyncFileHandler(os.path.join(path, 'agent.log'), maxbytes=20, backups=1)
+        # a directory in place of the backup makes the rename fail
+        os.mkdir(os.path.join(path, 'agent.log.1'))
+        os.mkdir(os.path.join(path, 'agent.log.1', 'busy'))
+        handler._write(["message 0", "message 1", "message 2"])
+        assert not handler._f.closed
+        handler._write(["message 3"])
+        handler.close()
+        lines = open(os.path.join(path, 'agent.log')).read().splitlines()
+        assert lines == ["message 0", "message 1", "message 2", "message 3"]
+    finally:
+        shutil.rmtree(path)
+
+def test_rate_limiter_suppresses_and_reports():
+    from mandelbrot.loggers import RateLimiter
+    limiter = RateLimiter(1.0, 2, interval=10.0)
+    assert limiter.allow('site', 0.0) == (True, 0)
+    assert limiter.allow('site', 0.0) == (True, 0)
+    assert limiter.allow('site', 0.0) == (False, 0)
+    assert limiter.allow('other', 0.0) == (True, 0)
+    assert limiter.allow('site', 1.0) == (True, 0)
+    assert limiter.allow('site', 10.0) == (True, 1)
+
+def test_logger_rate_limits_call_site():
+    handler = CapturingHandler()
+    startLogging(handler, INFO, ratelimit=1.0, rateburst=3)
+    logger = getLogger('mandelbrot.test.loggers')
+    for i in range(10):
+        logger.info("agent queue is full, dropping message")
+    assert len(handler.lines) == 3
+    startLogging(None)
+    assert not logger.isEnabledFor(0)
+
+def test_suppressed_messages_are_reported_on_stop():
+    from mandelbrot.loggers import stopLogging
+    handler = CapturingHandler()
+    startLogging(handler, INFO, ratelimit=1.0, rateburst=1)
+    logger = getLogger('mandelbrot.test.loggers')
+    for i in range(5):
+        logger.info("agent queue is full, dropping message")
+    assert len(handler.lines) == 1
+    stopLogging()
+    assert len(handler.lines) == 2
+    assert handler.lines[-1].endswith("suppressed 4 messages like: agent queue is full, dropping message")
+    startLogging(None)
+    from mandelbrot import loggers
+    assert loggers._ratelimiter is None
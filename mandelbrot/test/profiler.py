@@ -0,0 +1,60 @@
+import os, time, tempfile, shutil
+from mandelbrot.agent.profiler import ProfilerService, ProfilerError, SamplingSession
+
+def make_profiler(directory):
+    profiler = ProfilerService()
+    profiler.directory = directory
+    profiler.mode = 'sample'
+    profiler.duration = 60.0
+    profiler.maxduration = 60.0
+    profiler.interval = 0.001
+    return profiler
+
+def test_profiler_writes_collapsed_stacks():
+    directory = tempfile.mkdtemp()
+    try:
+        profiler = make_profiler(directory)
+        path = profiler.start()
+        time.sleep(0.05)
+        session = profiler.session
+        profiler.stop()
+        assert profiler.session is None
+        assert session.samples > 0
+        lines = open(path).read().splitlines()
+        assert len(lines) > 0
+        for line in lines:
+            stack,count = line.rsplit(' ', 1)
+            assert int(count) > 0
+            assert stack.split(';')[0] != ''
+        assert sum([int(line.rsplit(' ', 1)[1]) for line in lines]) >= session.samples
+    finally:
+        shutil.rmtree(directory)
+
+def test_profiler_rejects_concurrent_start():
+    directory = tempfile.mkdtemp()
+    try:
+        profiler = make_profiler(directory)
+        profiler.start()
+        try:
+            profiler.start()
+            assert False, "expected ProfilerError"
+        except ProfilerError:
+            pass
+        finally:
+            profiler.stop()
+    finally:
+        shutil.rmtree(directory)
+
+def test_sampling_session_raises_write_error_on_stop():
+    directory = tempfile.mkdtemp()
+    try:
+        session = SamplingSession(os.path.join(directory, 'missing', 'profile.collapsed'), 0.001)
+        session.start()
+        try:
+            session.stop()
+            assert False, "expected IOError"
+        except IOError:
+            pass
+        assert not session._thread.is_alive()
+    finally:
+        shutil.rmtree(directory)
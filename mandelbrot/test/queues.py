@@ -0,0 +1,59 @@
+import Queue
+from mandelbrot.agent.queues import CoalescingQueue, PriorityQueue
+from mandelbrot.message import StatusMessage, MetricsMessage
+from mandelbrot.ref import parse_proberef
+
+cpu = parse_proberef("fqdn:localhost/cpu")
+load = parse_proberef("fqdn:localhost/load")
+
+def test_coalescing_queue_replaces_status():
+    queue = CoalescingQueue(10)
+    queue.put_nowait(StatusMessage(cpu, 'healthy', 'first', 1))
+    queue.put_nowait(StatusMessage(load, 'healthy', 'load', 1))
+    queue.put_nowait(StatusMessage(cpu, 'failed', 'second', 2))
+    assert queue.qsize() == 2
+    assert queue.coalesced == 1
+    assert queue.get_nowait().summary == 'second'
+    assert queue.get_nowait().summary == 'load'
+    assert queue.empty()
+
+def test_coalescing_queue_caps_metrics_per_probe():
+    queue = CoalescingQueue(10, metricsperprobe=2)
+    for timestamp in range(4):
+        queue.put_nowait(MetricsMessage(cpu, {'user': timestamp}, timestamp))
+    queue.put_nowait(MetricsMessage(load, {'load1': 0}, 0))
+    assert queue.qsize() == 3
+    assert [queue.get_nowait().timestamp for _ in range(3)] == [2, 0, 3]
+
+def test_coalescing_queue_is_bounded_by_probes():
+    queue = CoalescingQueue(1)
+    queue.put_nowait(StatusMessage(cpu, 'healthy', '', 1))
+    queue.put_nowait(StatusMessage(cpu, 'healthy', '', 2))
+    try:
+        queue.put_nowait(StatusMessage(load, 'healthy', '', 1))
+        assert False
+    except Queue.Full:
+        pass
+
+def test_priority_queue_sends_transitions_first():
+    queue = PriorityQueue(10, 2, weights=(2, 1, 1))
+    queue.put_nowait(StatusMessage(cpu, 'healthy', 'transition', 1))
+    queue.put_nowait(StatusMessage(cpu, 'healthy', 'routine', 2))
+    queue.put_nowait(MetricsMessage(cpu, {'user': 1}, 1))
+    queue.put_nowait(MetricsMessage(cpu, {'user': 2}, 2))
+    try:
+        queue.put_nowait(MetricsMessage(cpu, {'user': 3}, 3))
+        assert False
+    except Queue.Full:
+        pass
+    queue.put_nowait(StatusMessage(load, 'failed', 'load transition', 1))
+    assert queue.lane_sizes() == (2, 1, 2)
+    summaries = [getattr(queue.get_nowait(), 'summary', None) for _ in range(5)]
+    assert summaries == ['transition', 'load transition', 'routine', None, None]
+
+def test_priority_queue_discards_stale_routine_status():
+    queue = PriorityQueue(10, 10)
+    queue.put_nowait(StatusMessage(cpu, 'healthy', 'first', 1))
+    queue.put_nowait(StatusMessage(cpu, 'healthy', 'stale', 2))
+    queue.put_nowait(StatusMessage(cpu, 'failed', 'failed', 3))
+    assert queue.lane_sizes() == (2, 0, 0)
@@ -0,0 +1,33 @@
+from mandelbrot.probes.rate import CounterRates
+
+def test_counter_rate_requires_previous_sample():
+    rates = CounterRates()
+    assert rates.update('reads', 100, 10.0) == None
+    assert rates.update('reads', 300, 20.0) == 20.0
+
+def test_counter_rate_repeats_last_rate_for_same_sample():
+    rates = CounterRates()
+    rates.update('reads', 100, 10.0)
+    rates.update('reads', 300, 20.0)
+    assert rates.update('reads', 300, 20.0) == 20.0
+
+def test_counter_rate_handles_32bit_wraparound():
+    rates = CounterRates()
+    rates.update('packets', 2 ** 32 - 50, 10.0)
+    assert rates.update('packets', 50, 20.0) == 10.0
+
+def test_counter_rate_handles_64bit_wraparound():
+    rates = CounterRates()
+    rates.update('bytes', 2 ** 64 - 500, 10.0)
+    assert rates.update('bytes', 500, 20.0) == 100.0
+
+def test_counter_rate_rebaselines_after_reset():
+    rates = CounterRates()
+    rates.update('writes', 2 ** 20, 10.0)
+    assert rates.update('writes', 10, 20.0) == None
+    assert rates.update('writes', 110, 30.0) == 10.0
+
+def test_counter_rates_update_all():
+    rates = CounterRates()
+    assert rates.update_all({'reads': 0, 'writes': 0}, 0.0) == None
+    assert rates.update_all({'reads': 10, 'writes': 20}, 2.0) == {'reads': 5.0, 'writes': 10.0}
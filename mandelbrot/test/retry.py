@@ -0,0 +1,27 @@
+from twisted.web.http_headers import Headers
+from mandelbrot.endpoints.retry import CircuitBreaker, backoff_delay, parse_retry_after
+
+def test_backoff_delay_is_bounded():
+    for attempt in range(10):
+        delay = backoff_delay(attempt, 1.0, 30.0)
+        assert 0.0 <= delay <= min(30.0, 2 ** attempt)
+
+def test_parse_retry_after():
+    assert parse_retry_after(Headers({'Retry-After': ['5']})) == 5.0
+    assert parse_retry_after(Headers({'Retry-After': ['Fri, 31 Dec 1999 23:59:59 GMT']})) == None
+    assert parse_retry_after(Headers()) == None
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker('test', threshold=2, resettimeout=3600.0)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    breaker.resettimeout = 0.0
+    breaker.failure()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,154 @@
+import datetime
+from mandelbrot.agent.scheduler import TimingWheel, ProbeRunner, next_deadline
+from mandelbrot.agent.queues import FifoQueue
+from mandelbrot.agent.executor import ReactorExecutor
+from mandelbrot.evaluation import Evaluation, Health, Metrics
+from mandelbrot.policy import Policy
+from mandelbrot.ref import parse_proberef
+
+def test_timing_wheel_expires_due_items():
+    wheel = TimingWheel(1.0, 8, 100.0)
+    wheel.insert(101.5, 'a')
+    wheel.insert(103.0, 'b')
+    assert wheel.advance(101.0) == []
+    assert wheel.advance(102.0) == [(101.5, 'a')]
+    assert len(wheel) == 1
+    assert wheel.advance(103.0) == [(103.0, 'b')]
+    assert len(wheel) == 0
+
+def test_timing_wheel_expires_past_deadline_on_next_tick():
+    wheel = TimingWheel(1.0, 8, 100.0)
+    wheel.insert(50.0, 'a')
+    assert wheel.advance(101.0) == [(50.0, 'a')]
+
+def test_timing_wheel_holds_deadline_beyond_one_rotation():
+    wheel = TimingWheel(1.0, 4, 100.0)
+    wheel.insert(110.0, 'a')
+    assert wheel.advance(105.0) == []
+    assert wheel.advance(109.0) == []
+    assert wheel.advance(110.0) == [(110.0, 'a')]
+
+def test_timing_wheel_catches_up_after_falling_behind():
+    wheel = TimingWheel(1.0, 4, 100.0)
+    wheel.insert(102.0, 'b')
+    wheel.insert(101.0, 'a')
+    wheel.insert(120.0, 'c')
+    assert wheel.advance(110.0) == [(101.0, 'a'), (102.0, 'b')]
+    assert wheel.advance(120.0) == [(120.0, 'c')]
+
+def test_timing_wheel_expires_item_due_within_current_slot():
+    wheel = TimingWheel(1.0, 8, 100.0)
+    wheel.insert(100.5, 'a')
+    assert wheel.advance(100.2) == []
+    assert wheel.advance(100.6) == [(100.5, 'a')]
+    assert len(wheel) == 0
+
+def test_timing_wheel_expires_item_on_slot_boundary():
+    wheel = TimingWheel(1.0, 8, 100.0)
+    wheel.insert(101.0, 'a')
+    wheel.insert(101.25, 'b')
+    assert wheel.advance(100.999) == []
+    assert wheel.advance(101.0) == [(101.0, 'a')]
+    assert wheel.advance(101.5) == [(101.25, 'b')]
+
+def test_next_deadline_tolerates_one_tick_of_lag():
+    assert next_deadline(100.0, 100.0, 1.0, 1.0) == 101.0
+    assert next_deadline(100.0, 101.0, 1.0, 1.0) == 101.0
+    assert next_deadline(100.0, 101.5, 1.0, 1.0) == 101.0
+    assert next_deadline(100.0, 103.5, 1.0, 1.0) == 103.0
+    assert next_deadline(100.0, 100.5, 60.0, 1.0) == 160.0
+
+class FakeProbe(object):
+    def get_policy(self):
+        minutes = datetime.timedelta(minutes=1)
+        return Policy(minutes, datetime.timedelta(minutes=5), minutes, minutes, None)
+    def probe(self):
+        return Evaluation(Health('healthy', 'ok'))
+
+def test_probe_runner_suppresses_unchanged_status():
+    queue = FifoQueue(10)
+    runner = ProbeRunner(parse_proberef("fqdn:localhost/cpu"), FakeProbe(),
+        datetime.timedelta(minutes=1), datetime.timedelta(0), queue, None)
+    runner.suppress(datetime.timedelta(hours=1), deadband=0.1)
+    assert runner.maxsilence == 240.0
+    runner.on_evaluation(Evaluation(Health('healthy', 'ok'), Metrics({'user': 10.0})))
+    runner.on_evaluation(Evaluation(Health('healthy', 'ok'), Metrics({'user': 10.5})))
+    runner.on_evaluation(Evaluation(Health('failed', 'ok'), Metrics({'user': 12.0})))
+    assert runner.suppressed == 2
+    assert queue.qsize() == 4
+
+def test_probe_runner_records_timings_and_drift():
+    from twisted.internet import reactor
+    queue = FifoQueue(10)
+    runner = ProbeRunner(parse_proberef("fqdn:localhost/cpu"), FakeProbe(),
+        datetime.timedelta(minutes=1), datetime.timedelta(0), queue, ReactorExecutor())
+    runner.call(reactor.seconds() - 2.0)
+    runner.call()
+    timings = runner.get_timings()
+    assert timings['count'] == 2
+    assert timings['interval'] == 60.0
+    assert runner.drift.count == 1
+    assert runner.timings.name == "fqdn:localhost/cpu:execution"
+    assert runner.drift.name == "fqdn:localhost/cpu:drift"
+    assert 2.0 <= timings['driftMax'] < 3.0
+    assert queue.qsize() == 2
+
+class PendingExecutor(object):
+    def __init__(self):
+        self.defers = list()
+    def submit(self, probe):
+        from twisted.internet.defer import Deferred
+        defer = Deferred()
+        self.defers.append(defer)
+        return defer
+
+def fire_deadline(runner):
+    from twisted.internet import reactor
+    timers = [call for call in reactor.getDelayedCalls() if call.func == runner.on_deadline]
+    assert len(timers) == 1
+    # cancelling the timer makes it inactive, as though it had fired
+    on_deadline = timers[0].func
+    timers[0].cancel()
+    on_deadline()
+
+def test_probe_runner_sends_unknown_and_discards_late_result():
+    queue = FifoQueue(10)
+    executor = PendingExecutor()
+    runner = ProbeRunner(parse_proberef("fqdn:localhost/cpu"), FakeProbe(), datetime.timedelta(minutes=1),
+        datetime.timedelta(0), queue, executor, deadline=datetime.timedelta(seconds=30))
+    runner.call()
+    fire_deadline(runner)
+    assert queue.qsize() == 1
+    assert queue.get_nowait().health == Health.UNKNOWN
+    executor.defers[0].callback(Evaluation(Health('healthy', 'ok')))
+    assert queue.qsize() == 0
+    assert runner.inflight == 0
+
+def test_probe_runner_enforces_deadline_on_reactor_thread():
+    import time
+    class SlowProbe(FakeProbe):
+        def probe(self):
+            time.sleep(0.01)
+            return FakeProbe.probe(self)
+    queue = FifoQueue(10)
+    runner = ProbeRunner(parse_proberef("fqdn:localhost/cpu"), SlowProbe(), datetime.timedelta(minutes=1),
+        datetime.timedelta(0), queue, ReactorExecutor(), deadline=datetime.timedelta(milliseconds=1))
+    runner.call()
+    assert queue.qsize() == 1
+    assert queue.get_nowait().health == Health.UNKNOWN
+    from twisted.internet import reactor
+    assert [call for call in reactor.getDelayedCalls() if call.func == runner.on_deadline] == []
+
+def test_probe_runner_skips_run_while_previous_is_running():
+    queue = FifoQueue(10)
+    executor = PendingExecutor()
+    runner = ProbeRunner(parse_proberef("fqdn:localhost/cpu"), FakeProbe(), datetime.timedelta(minutes=1),
+        datetime.timedelta(0), queue, executor)
+    runner.call()
+    runner.call()
+    assert len(executor.defers) == 1
+    assert runner.inflight == 1
+    executor.defers[0].callback(Evaluation(Health('healthy', 'ok')))
+    assert runner.inflight == 0
+    runner.call()
+    assert len(executor.defers) == 2
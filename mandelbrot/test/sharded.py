@@ -0,0 +1,78 @@
+from mandelbrot.endpoints.sharded import HashRing
+
+nodes = ['http://supervisor%i:8080/' % i for i in range(4)]
+
+def test_hash_ring_visits_each_node_once():
+    ring = HashRing(nodes)
+    order = list(ring.iter_nodes('fqdn:host1.example.com'))
+    assert sorted(order) == sorted(nodes)
+    assert list(ring.iter_nodes('fqdn:host1.example.com')) == order
+
+def test_hash_ring_spreads_keys():
+    ring = HashRing(nodes)
+    owners = dict([(node, 0) for node in nodes])
+    for i in range(1000):
+        owners[ring.iter_nodes('fqdn:host%i.example.com' % i).next()] += 1
+    assert min(owners.values()) > 100
+
+def test_hash_ring_moves_only_keys_of_removed_node():
+    ring = HashRing(nodes)
+    smaller = HashRing(nodes[:3])
+    for i in range(200):
+        key = 'fqdn:host%i.example.com' % i
+        owner = ring.iter_nodes(key).next()
+        if owner != nodes[3]:
+            assert smaller.iter_nodes(key).next() == owner
+
+def test_sharded_send_batch_returns_batch_when_every_node_errbacks():
+    import datetime
+    from twisted.internet.defer import fail
+    from mandelbrot.endpoints.sharded import ShardedEndpoint, SupervisorNode
+    from mandelbrot.message import StatusMessage
+    from mandelbrot.ref import parse_proberef
+    class BrokenNode(object):
+        def send_batch(self, messages):
+            return fail(ValueError("malformed 207 response"))
+    endpoint = ShardedEndpoint()
+    for url in nodes[:2]:
+        endpoint.nodes[url] = SupervisorNode(url, BrokenNode(), 30.0)
+    endpoint.ring = HashRing(endpoint.nodes.keys())
+    messages = [StatusMessage(parse_proberef("fqdn:host%i/cpu" % i), 'healthy', 'ok', datetime.datetime.now())
+                for i in range(3)]
+    results = list()
+    endpoint.send_batch(messages).addCallback(results.append)
+    assert sorted(results[0]) == sorted(messages)
+    assert not any([node.is_available() for node in endpoint.nodes.values()])
+
+class UnregisterNode(object):
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+    def unregister(self, uri):
+        from twisted.internet.defer import fail
+        self.calls += 1
+        return fail(self.error)
+
+def make_sharded(error):
+    from mandelbrot.endpoints.sharded import ShardedEndpoint, SupervisorNode
+    endpoint = ShardedEndpoint()
+    for url in nodes:
+        endpoint.nodes[url] = SupervisorNode(url, UnregisterNode(error), 30.0)
+    endpoint.ring = HashRing(endpoint.nodes.keys())
+    return endpoint
+
+def test_sharded_does_not_fail_over_on_application_error():
+    endpoint = make_sharded(NotImplementedError())
+    failures = list()
+    endpoint.unregister('fqdn:host1.example.com').addErrback(failures.append)
+    assert failures[0].check(NotImplementedError)
+    assert sum([node.endpoint.calls for node in endpoint.nodes.values()]) == 1
+    assert all([node.is_available() for node in endpoint.nodes.values()])
+
+def test_sharded_fails_over_on_connection_error():
+    from twisted.internet.error import ConnectionRefusedError
+    endpoint = make_sharded(ConnectionRefusedError())
+    failures = list()
+    endpoint.unregister('fqdn:host1.example.com').addErrback(failures.append)
+    assert failures[0].check(ConnectionRefusedError)
+    assert sum([node.endpoint.calls for node in endpoint.nodes.values()]) == len(nodes)
@@ -0,0 +1,62 @@
+import time
+from mandelbrot.probes import snapshot
+from mandelbrot.probes.snapshot import SnapshotCache, FrozenDict
+
+class CountingSource(object):
+    def __init__(self):
+        self.calls = 0
+    def __call__(self):
+        self.calls += 1
+        return self.calls
+
+def with_source(test):
+    def wrapper():
+        source = CountingSource()
+        snapshot.SOURCES['counting'] = source
+        try:
+            test(source)
+        finally:
+            del snapshot.SOURCES['counting']
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+@with_source
+def test_snapshot_is_shared_within_ttl(source):
+    cache = SnapshotCache(ttl=60.0)
+    first = cache.get('counting')
+    second = cache.get('counting')
+    assert source.calls == 1
+    assert first is second
+
+@with_source
+def test_snapshot_is_refreshed_after_ttl(source):
+    cache = SnapshotCache(ttl=0.01)
+    assert cache.get('counting').value == 1
+    time.sleep(0.02)
+    assert cache.get('counting').value == 2
+    assert source.calls == 2
+
+def test_frozen_dict_cannot_be_modified():
+    frozen = FrozenDict({'sda': 1})
+    for modify in (lambda: frozen.__setitem__('sdb', 2), lambda: frozen.__delitem__('sda'),
+                   frozen.clear, lambda: frozen.pop('sda'), frozen.popitem,
+                   lambda: frozen.setdefault('sdb', 2), lambda: frozen.update({'sdb': 2})):
+        try:
+            modify()
+            assert False, "expected TypeError"
+        except TypeError:
+            pass
+    assert frozen == {'sda': 1}
+
+class DefaultSettings(object):
+    def __getattr__(self, name):
+        return lambda setting, default=None: default
+
+def test_system_cpu_does_not_cache_primed_value():
+    from mandelbrot.probes.system import SystemCPU
+    from mandelbrot.probes.snapshot import snapshots
+    snapshots.clear()
+    probe = SystemCPU()
+    probe.configure("/cpu", "io.mandelbrot.probe.SystemCPU", DefaultSettings(), {}, None)
+    assert 'cpu_times_percent' not in snapshots._snapshots
+    assert len(list(probe.iter_metrics())) > 0
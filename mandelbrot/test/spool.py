@@ -0,0 +1,109 @@
+import shutil, tempfile, datetime
+from dateutil.tz import tzutc
+from mandelbrot.agent.spool import Spool
+from mandelbrot.message import StatusMessage, MetricsMessage
+from mandelbrot.ref import parse_proberef
+
+def status(i):
+    timestamp = datetime.datetime(2014, 1, 1, tzinfo=tzutc()) + datetime.timedelta(seconds=i)
+    return StatusMessage(parse_proberef("fqdn:localhost/cpu"), 'healthy', "message %i" % i, timestamp)
+
+def summaries(messages):
+    return [int(message.summary.split()[1]) for message in messages]
+
+def test_spool_reads_messages_in_order():
+    path = tempfile.mkdtemp()
+    try:
+        spool = Spool(path, segmentsize=512)
+        for i in range(10):
+            spool.append(status(i))
+        assert not spool.empty()
+        assert summaries(spool.read(4)) == range(0, 4)
+        assert summaries(spool.read(100)) == range(4, 10)
+        assert spool.empty()
+        spool.close()
+    finally:
+        shutil.rmtree(path)
+
+def test_spool_stores_messages_as_json():
+    path = tempfile.mkdtemp()
+    try:
+        spool = Spool(path)
+        message = status(0)
+        spool.append(message)
+        metrics = MetricsMessage(parse_proberef("fqdn:localhost/load"), {'load1': 0.5}, message.timestamp)
+        spool.append(metrics)
+        with open(spool._segmentpath(0), 'rb') as f:
+            assert f.read()[4:].startswith('{"messageType": "io.mandelbrot.message.StatusMessage"')
+        loaded = spool.read(2)
+        assert isinstance(loaded[0], StatusMessage)
+        assert str(loaded[0].source) == "fqdn:localhost/cpu"
+        assert (loaded[0].health, loaded[0].summary) == ('healthy', "message 0")
+        assert loaded[0].timestamp == message.timestamp
+        assert isinstance(loaded[1], MetricsMessage)
+        assert loaded[1].metrics == {'load1': 0.5}
+        spool.close()
+    finally:
+        shutil.rmtree(path)
+
+def test_spool_resumes_after_reopen():
+    path = tempfile.mkdtemp()
+    try:
+        spool = Spool(path, segmentsize=512)
+        for i in range(10):
+            spool.append(status(i))
+        assert summaries(spool.read(3)) == [0, 1, 2]
+        spool.close()
+        spool = Spool(path, segmentsize=512)
+        spool.append(status(10))
+        assert summaries(spool.read(100)) == range(3, 11)
+        spool.close()
+    finally:
+        shutil.rmtree(path)
+
+def test_spool_evicts_oldest_segments():
+    path = tempfile.mkdtemp()
+    try:
+        spool = Spool(path, segmentsize=512, maxsize=2048)
+        for i in range(100):
+            spool.append(status(i))
+        assert spool.size() <= 2048
+        assert spool.evicted > 0
+        messages = spool.read(100)
+        assert summaries(messages) == range(100 - len(messages), 100)
+        spool.close()
+    finally:
+        shutil.rmtree(path)
+
+def test_spool_truncates_partial_record():
+    path = tempfile.mkdtemp()
+    try:
+        spool = Spool(path)
+        spool.append(status(0))
+        spool.close()
+        with open(spool._segmentpath(0), 'ab') as f:
+            f.write('\x00\x00\x01')
+        spool = Spool(path)
+        spool.append(status(1))
+        assert summaries(spool.read(100)) == [0, 1]
+        spool.close()
+    finally:
+        shutil.rmtree(path)
+
+def test_spool_peek_does_not_remove_until_commit():
+    path = tempfile.mkdtemp()
+    try:
+        spool = Spool(path, segmentsize=512)
+        for i in range(10):
+            spool.append(status(i))
+        assert summaries(spool.peek(6)) == range(0, 6)
+        assert summaries(spool.peek(6)) == range(0, 6)
+        spool.commit()
+        assert summaries(spool.peek(100)) == range(6, 10)
+        spool.close()
+        spool = Spool(path, segmentsize=512)
+        assert summaries(spool.read(100)) == range(6, 10)
+        assert spool.empty()
+        spool.close()
+    finally:
+        shutil.rmtree(path)
@@ -0,0 +1,50 @@
+import os, random
+from ConfigParser import RawConfigParser
+from pesky.settings import ConfigureError
+from pesky.settings.section import Section
+from mandelbrot.probes.synthetic import Synthetic
+from mandelbrot.evaluation import Health
+
+def make_probe(**settings):
+    options = RawConfigParser()
+    options.add_section('probe')
+    for name,value in settings.items():
+        options.set('probe', name.replace('_', ' '), value)
+    probe = Synthetic()
+    probe.configure("/synthetic", "io.mandelbrot.probe.Synthetic", Section('probe', options, os.getcwd()), {}, None)
+    return probe
+
+def assert_rejected(**settings):
+    try:
+        make_probe(**settings)
+        assert False, "expected ConfigureError"
+    except ConfigureError:
+        pass
+
+def test_synthetic_rejects_invalid_settings():
+    assert_rejected(metric_count='-1')
+    assert_rejected(flip_rate='-0.1')
+    assert_rejected(flip_rate='1.5')
+
+def test_synthetic_emits_configured_metrics():
+    probe = make_probe(metric_count='5')
+    assert len(list(probe.iter_metrics())) == 5
+    evaluation = probe.probe()
+    assert sorted(evaluation.metrics.metrics.keys()) == ["metric%i" % i for i in range(5)]
+    assert evaluation.health.health == Health.HEALTHY
+
+def test_synthetic_flips_health_at_configured_rate():
+    state = random.getstate()
+    try:
+        random.seed(42)
+        probe = make_probe(flip_rate='0.0')
+        assert set([probe.probe().health.health for _ in range(100)]) == set([Health.HEALTHY])
+        probe = make_probe(flip_rate='1.0')
+        healths = [probe.probe().health.health for _ in range(4)]
+        assert healths == [Health.FAILED, Health.HEALTHY, Health.FAILED, Health.HEALTHY]
+        probe = make_probe(flip_rate='0.25')
+        healths = [probe.probe().health.health for _ in range(2000)]
+        flips = len([i for i in range(1, len(healths)) if healths[i] != healths[i - 1]])
+        assert 400 < flips < 600
+    finally:
+        random.setstate(state)
@@ -0,0 +1,11 @@
+from mandelbrot.agent.systemfile import expand_instances
+
+def test_expand_instances_copies_probe():
+    instances = expand_instances('/probe', {'probe type': 'synthetic', 'probe instances': 3, 'policy': {}})
+    assert [name for name,_ in instances] == ['/probe0', '/probe1', '/probe2']
+    assert all([probe == {'probe type': 'synthetic', 'policy': {}} for _,probe in instances])
+    assert instances[0][1]['policy'] is not instances[1][1]['policy']
+
+def test_expand_instances_without_instances():
+    probe = {'probe type': 'synthetic'}
+    assert expand_instances('/probe', probe) == [('/probe', probe)]
@@ -59,6 +59,8 @@ setup(
         'io.mandelbrot.endpoint': [
             'io.mandelbrot.endpoint.DummyEndpoint=mandelbrot.endpoints.dummy:DummyEndpoint',
             'io.mandelbrot.endpoint.HTTPEndpoint=mandelbrot.endpoints.http:HTTPEndpoint',
+            'io.mandelbrot.endpoint.BinaryEndpoint=mandelbrot.endpoints.binary:BinaryEndpoint',
+            'io.mandelbrot.endpoint.ShardedEndpoint=mandelbrot.endpoints.sharded:ShardedEndpoint',
             ],
         'io.mandelbrot.endpoint.scheme': [
             'dummy=mandelbrot.endpoints.dummy:DummyEndpoint',
@@ -74,6 +76,8 @@ setup(
             'io.mandelbrot.probe.SystemNetPerformance=mandelbrot.probes.system:SystemNetPerformance',
             'io.mandelbrot.probe.Aggregate=mandelbrot.probes.container:Aggregate',
             'io.mandelbrot.probe.MetricsEvaluation=mandelbrot.probes.metrics:MetricsEvaluation',
+            'io.mandelbrot.probe.Synthetic=mandelbrot.probes.synthetic:Synthetic',
+            'io.mandelbrot.probe.AgentSelf=mandelbrot.probes.agent:AgentSelf',
             ],
         'io.mandelbrot.system': [
             'io.mandelbrot.system.GenericHost=mandelbrot.systems.generic:GenericHost',